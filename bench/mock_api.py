@@ -0,0 +1,177 @@
+"""Локальная замена API Кинопоиска для бенчмарков.
+
+Сервер отдает записанные ответы из bench/fixtures/<эндпоинт>/<ID>.json для
+карточки фильма, состава, сборов и прокатов. Если для запрошенного ID
+файла нет, берется один из имеющихся по кругу (с подмененным ID), поэтому
+можно запрашивать сколько угодно фильмов. Задержка ответа, разброс и доля
+ответов 429 настраиваются:
+
+    python bench/mock_api.py --port 8765 --latency 80 --jitter 40 --rate-429 0.02
+
+Клиент направляется на сервер переменной KINOPOISK_API_BASE.
+
+Новые фикстуры записываются с настоящего API:
+
+    python bench/mock_api.py --record 326 435 --api-key KEY
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Эндпоинты API и имена каталогов фикстур (как в kinopoisk_api.ENDPOINTS)
+ROUTES = (
+    (re.compile(r'^/api/v2\.2/films/(\d+)$'), 'film'),
+    (re.compile(r'^/api/v1/staff\?filmId=(\d+)$'), 'staff'),
+    (re.compile(r'^/api/v2\.2/films/(\d+)/box_office$'), 'box_office'),
+    (re.compile(r'^/api/v2\.2/films/(\d+)/distributions$'), 'distributions'),
+)
+
+
+def load_fixtures(path=FIXTURES_DIR):
+    """{эндпоинт: {ID фильма: ответ}} из каталога фикстур"""
+    fixtures = {}
+    for _, endpoint in ROUTES:
+        directory = os.path.join(path, endpoint)
+        fixtures[endpoint] = {}
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name), encoding='utf-8') as f:
+                    fixtures[endpoint][name[:-5]] = json.load(f)
+    if not fixtures['film']:
+        raise ValueError(f'В {path} нет фикстур карточек фильмов')
+    return fixtures
+
+
+class MockApi:
+    """Состояние сервера: фикстуры, параметры задержки и счетчики"""
+
+    def __init__(self, fixtures, latency=0.05, jitter=0.0, rate_429=0.0, retry_after=1, seed=None):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._film_ids = sorted(fixtures['film'])
+
+    def delay(self):
+        with self._lock:
+            jitter = self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+        return max(self.latency + jitter, 0.0)
+
+    def respond(self, path):
+        """(статус, заголовки, тело) для пути запроса"""
+        with self._lock:
+            self.requests += 1
+            throttle = self.rate_429 and self.random.random() < self.rate_429
+            if throttle:
+                self.throttled += 1
+        if throttle:
+            return 429, {'Retry-After': str(self.retry_after)}, {'message': 'Too many requests'}
+        for pattern, endpoint in ROUTES:
+            match = pattern.match(path)
+            if match:
+                return 200, {}, self.payload(endpoint, match.group(1))
+        return 404, {}, {'message': 'Not found'}
+
+    def payload(self, endpoint, film_id):
+        recorded = self.fixtures[endpoint]
+        if film_id in recorded:
+            return recorded[film_id]
+        # Нет записи для этого ID: ответ другого фильма из фикстур
+        source = self._film_ids[int(film_id) % len(self._film_ids)]
+        data = recorded.get(source, [] if endpoint == 'staff' else {'items': []})
+        if endpoint == 'film':
+            data = dict(data, kinopoiskId=int(film_id))
+        return data
+
+
+def _handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(api.delay())
+            status, headers, body = api.respond(self.path)
+            raw = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(raw)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(raw)
+
+    return Handler
+
+
+def start_server(api, host='127.0.0.1', port=0):
+    """Запускает сервер в фоновом потоке. Возвращает (сервер, базовый адрес)"""
+    server = ThreadingHTTPServer((host, port), _handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='mock-api').start()
+    return server, f'http://{host}:{server.server_port}'
+
+
+def record_fixtures(film_ids, api_key, path=FIXTURES_DIR):
+    """Сохраняет ответы настоящего API для фильмов в каталог фикстур"""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from kinopoisk_api import ENDPOINTS, api_get
+
+    for film_id in film_ids:
+        for endpoint in ENDPOINTS:
+            status, data = api_get(endpoint, film_id, api_key, use_cache=False)
+            if status != 200:
+                print(f'{film_id} {endpoint}: {status}', file=sys.stderr)
+                continue
+            os.makedirs(os.path.join(path, endpoint), exist_ok=True)
+            with open(os.path.join(path, endpoint, f'{film_id}.json'), 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+        print(f'{film_id}: записан')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Локальный сервер с записанными ответами API Кинопоиска')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=50, help='задержка ответа, мс')
+    parser.add_argument('--jitter', type=float, default=0, help='разброс задержки (±), мс')
+    parser.add_argument('--rate-429', type=float, default=0, help='доля ответов 429 (0..1)')
+    parser.add_argument('--record', nargs='+', metavar='ID', help='записать фикстуры для фильмов с настоящего API')
+    parser.add_argument('-k', '--api-key', default=os.environ.get('KINOPOISK_API_KEY'))
+    args = parser.parse_args(argv)
+
+    if args.record:
+        if not args.api_key:
+            parser.error('для записи нужен API-ключ (--api-key или KINOPOISK_API_KEY)')
+        record_fixtures(args.record, args.api_key)
+        return 0
+
+    api = MockApi(load_fixtures(), args.latency / 1000, args.jitter / 1000, args.rate_429)
+    server, base = start_server(api, port=args.port)
+    print(f'Сервер запущен: KINOPOISK_API_BASE={base}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
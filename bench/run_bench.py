@@ -0,0 +1,476 @@
+"""Офлайн-бенчмарк парсера на записанных ответах API.
+
+Запускает локальную замену API (bench/mock_api.py) и прогоняет сценарии:
+
+    single      — загрузка фильмов по одному (fetch_film, как на странице)
+    bulk        — пакетная обработка (run_batch) пулом потоков
+    mixed       — загрузка фильмов по одному во время пакетной обработки
+                  (задержки интерактивных запросов при общем лимите частоты)
+    page_batch  — пакетная обработка со страницы Streamlit (AppTest): запуск
+                  кнопкой, пауза и продолжение прогона
+    excel       — create_excel_file для фильма с большим составом
+    csv         — create_improved_csv_file
+    simple_csv  — create_simple_csv_file
+    stream_xlsx — потоковый экспорт export_films_xlsx для многих фильмов
+    stream_csv  — потоковый экспорт export_films_csv
+    postprocess — векторная нормализация и пересчет сборов (kinopoisk_postprocess)
+    startup     — холодный старт страницы: импорт модулей и первая отрисовка
+
+Для каждого сценария выводятся пропускная способность, задержки p50/p95/p99
+и пиковый RSS. Каждый сценарий выполняется в отдельном процессе, поэтому
+пиковый RSS относится только к нему:
+
+    python bench/run_bench.py --films 200 --workers 8 --latency 80 --jitter 40 --rate-429 0.01
+    python bench/run_bench.py --scenario excel csv --cast-sizes 1000,20000 --json after.json
+    python bench/run_bench.py --json after.json --baseline before.json --tolerance 0.2
+    python bench/run_bench.py --scenario mixed --films 400 --rate-limit 40
+
+С --baseline сценарии сравниваются с прошлым результатом: если пропускная
+способность упала или p95 либо пиковый RSS выросли больше допуска, код
+возврата 1.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+SCENARIOS = ('single', 'bulk', 'mixed', 'page_batch', 'excel', 'csv', 'simple_csv', 'stream_xlsx', 'stream_csv', 'postprocess', 'startup')
+
+# Сценарии, которые повторяются для каждого размера состава
+CAST_SCENARIOS = ('excel', 'csv', 'simple_csv')
+
+DEFAULT_CAST_SIZES = (1000, 10000, 50000)
+
+
+def percentile(values, p):
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(p / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux ru_maxrss в килобайтах, в macOS — в байтах
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def summarize(name, count, elapsed, latencies, unit):
+    return {
+        'scenario': name,
+        'count': count,
+        'unit': unit,
+        'elapsed': elapsed,
+        'throughput': count / elapsed if elapsed else None,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+# Сценарии (выполняются в дочернем процессе)
+
+# Библиотеки, которые не должны загружаться при старте страницы
+HEAVY_MODULES = ('pandas', 'numpy', 'pyarrow', 'xlsxwriter', 'openpyxl')
+
+def bench_single(options):
+    from kinopoisk_api import fetch_film
+
+    latencies = []
+    started = time.perf_counter()
+    for film_id in range(1, options['films'] + 1):
+        (film, error), latency = timed(fetch_film, str(film_id), options['api_key'])
+        if error:
+            raise RuntimeError(f'фильм {film_id}: {error}')
+        latencies.append(latency)
+    return summarize('single', options['films'], time.perf_counter() - started, latencies, 'фильм')
+
+
+def bench_bulk(options):
+    import kinopoisk_batch
+
+    latencies = []
+    fetch_film_record = kinopoisk_batch.fetch_film_record
+
+    # run_batch вызывает fetch_film_record через глобальное имя модуля,
+    # поэтому время каждого фильма можно снять оберткой
+    def timed_fetch(film_id, api_key):
+        result, latency = timed(fetch_film_record, film_id, api_key)
+        latencies.append(latency)
+        return result
+
+    kinopoisk_batch.fetch_film_record = timed_fetch
+    film_ids = [str(film_id) for film_id in range(1, options['films'] + 1)]
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = kinopoisk_batch.run_batch(film_ids, options['api_key'], os.path.join(tmp, 'films.jsonl'),
+                                          workers=options['workers'])
+    if stats['failed']:
+        raise RuntimeError(f"ошибок: {stats['failed']}")
+    return summarize('bulk', stats['fetched'], stats['elapsed'], latencies, 'фильм')
+
+
+def bench_mixed(options):
+    from kinopoisk_api import fetch_film
+    from kinopoisk_batch import BatchJob, run_batch
+
+    # Пакет занимает весь лимит частоты; пока он идет, фильмы с другими ID
+    # загружаются по одному с паузой, как при работе со страницей
+    batch_ids = [str(film_id) for film_id in range(1, options['films'] + 1)]
+    latencies = []
+    with tempfile.TemporaryDirectory() as tmp:
+        job = BatchJob(run_batch, batch_ids, options['api_key'], os.path.join(tmp, 'films.jsonl'),
+                       workers=options['workers'])
+        film_id = options['films']
+        while job.running:
+            film_id += 1
+            (film, error), latency = timed(fetch_film, str(film_id), options['api_key'])
+            if error:
+                raise RuntimeError(f'фильм {film_id}: {error}')
+            latencies.append(latency)
+            time.sleep(0.2)
+        job._thread.join()
+    if job.error is not None:
+        raise job.error
+    result = summarize('mixed', len(latencies), sum(latencies), latencies, 'фильм')
+    result['batch_throughput'] = job.stats['fetched'] / job.stats['elapsed']
+    return result
+
+
+def _button(app, label):
+    for button in app.button:
+        if label in button.label:
+            return button
+    # Обычно кнопки нет потому, что прогон уже завершился ошибкой
+    errors = [element.value for element in app.error] or [element.message for element in app.exception]
+    raise RuntimeError(f'нет кнопки «{label}»' + (f': {errors[0]}' if errors else ''))
+
+
+def _progress(app):
+    return [bar.value for bar in app.get('progress')]
+
+
+def _wait_result(app, timeout=300):
+    deadline = time.monotonic() + timeout
+    while not (app.success or app.error or app.exception):
+        if time.monotonic() > deadline:
+            raise RuntimeError('прогон со страницы не завершился')
+        time.sleep(0.2)
+        app.run()
+
+
+def bench_page_batch(options):
+    """Пакетная обработка через обработчики страницы: загрузка списка ID,
+    запуск, пауза прогона (прогресс не меняется) и продолжение до итогов;
+    затем инкрементальное обновление того же списка"""
+    from streamlit.testing.v1 import AppTest
+
+    page = os.path.join(ROOT_DIR, 'kinopoisk_streamlit.py')
+    film_ids = '\n'.join(str(film_id) for film_id in range(1, options['films'] + 1)).encode()
+    with tempfile.TemporaryDirectory() as tmp:
+        # Страница пишет результаты в batch_output текущего каталога
+        os.chdir(tmp)
+        try:
+            app = AppTest.from_file(page, default_timeout=60).run()
+            app.sidebar.text_input[0].input(options['api_key'])
+            app.file_uploader[0].set_value(('bench_ids.txt', film_ids, 'text/plain'))
+            app.run()
+            started = time.perf_counter()
+            _button(app, 'Запустить пакетную').click().run()
+            _button(app, 'Приостановить').click().run()
+            # Уже отправленные запросы завершаются, после этого прогон стоит
+            time.sleep(1)
+            held = _progress(app.run())
+            time.sleep(1)
+            if _progress(app.run()) != held:
+                raise RuntimeError('прогон не остановился на паузе')
+            paused = 2.0
+            _button(app, 'Продолжить').click().run()
+            _wait_result(app)
+            elapsed = time.perf_counter() - started - paused
+            if not app.error:
+                [box for box in app.checkbox if 'Инкрементальное' in box.label][0].check().run()
+                _button(app, 'Запустить пакетную').click().run()
+                _wait_result(app)
+                if not (app.error or 'Новых' in app.success[0].value):
+                    raise RuntimeError(f'нет итогов обновления: {app.success[0].value}')
+        finally:
+            os.chdir(ROOT_DIR)
+    if app.exception:
+        raise RuntimeError(f'ошибка страницы: {app.exception[0].message}')
+    if app.error:
+        raise RuntimeError(app.error[0].value)
+    return summarize('page_batch', options['films'], elapsed, [elapsed], 'фильм')
+
+
+def sample_film(cast_size=None):
+    """FilmRecord из фикстуры; при cast_size состав увеличивается до этого размера"""
+    from kinopoisk_api import parse_boxoffice_amounts, parse_cast, parse_premiere_dates
+    from kinopoisk_models import CastMember, FilmRecord
+    from mock_api import load_fixtures
+
+    fixtures = load_fixtures()
+    film_id = sorted(fixtures['staff'], key=lambda k: len(fixtures['staff'][k]))[-1]
+    cast = parse_cast(fixtures['staff'][film_id])
+    if cast_size:
+        cast = [CastMember(f'{cast[i % len(cast)].name} {i}', 1000000 + i) for i in range(cast_size)]
+    return FilmRecord.from_bundle(film_id, {
+        'data': fixtures['film'][film_id],
+        'boxoffice_amounts': parse_boxoffice_amounts(fixtures['box_office'][film_id]),
+        'premiere_dates': parse_premiere_dates(fixtures['distributions'][film_id]),
+        'cast': cast,
+    })
+
+
+def bench_cast(name, options):
+    import kinopoisk_export
+
+    builder = {
+        'excel': kinopoisk_export.create_excel_file,
+        'csv': kinopoisk_export.create_improved_csv_file,
+        'simple_csv': kinopoisk_export.create_simple_csv_file,
+    }[name]
+    film = sample_film(options['cast_size'])
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(options['repeat']):
+        output, latency = timed(builder, film.display(), film.cast)
+        latencies.append(latency)
+    elapsed = time.perf_counter() - started
+    result = summarize(f"{name}[cast={options['cast_size']}]", options['repeat'], elapsed, latencies, 'файл')
+    result['size_bytes'] = len(output.getvalue())
+    return result
+
+
+def bench_stream(name, options):
+    from kinopoisk_export import csv_paths, export_films_csv, export_films_xlsx
+
+    film = sample_film()
+    films = (film for _ in range(options['films']))
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        if name == 'stream_xlsx':
+            count = export_films_xlsx(films, os.path.join(tmp, 'films.xlsx'))
+        else:
+            count = export_films_csv(films, *csv_paths(os.path.join(tmp, 'films')))
+        elapsed = time.perf_counter() - started
+    return summarize(name, count, elapsed, [], 'фильм')
+
+
+def bench_postprocess(options):
+    from kinopoisk_postprocess import display_frame, films_frame, normalize
+
+    film = sample_film()
+    films = [film] * options['films']
+    latencies = []
+    started = time.perf_counter()
+    frame, latency = timed(films_frame, films)
+    latencies.append(latency)
+    frame, latency = timed(normalize, frame)
+    latencies.append(latency)
+    _, latency = timed(display_frame, frame)
+    latencies.append(latency)
+    return summarize('postprocess', len(films), time.perf_counter() - started, latencies, 'фильм')
+
+
+def bench_startup(options):
+    """Импорт модулей страницы и первая отрисовка в чистом процессе.
+
+    Время импорта снимается до отрисовки, поэтому первая отрисовка
+    (streamlit.testing AppTest) включает только выполнение скрипта страницы;
+    затем страница перезапускается, как при действии пользователя"""
+    import ast
+    import importlib
+
+    page = os.path.join(ROOT_DIR, 'kinopoisk_streamlit.py')
+    with open(page, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    # Модули, которые страница импортирует на верхнем уровне
+    modules = [alias.name for node in tree.body if isinstance(node, ast.Import) for alias in node.names]
+    modules += [node.module for node in tree.body if isinstance(node, ast.ImportFrom)]
+    started = time.perf_counter()
+    for module in modules:
+        importlib.import_module(module)
+    import_time = time.perf_counter() - started
+
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(page, default_timeout=60)
+    _, first_render = timed(app.run)
+    if app.exception:
+        raise RuntimeError(f'ошибка отрисовки: {app.exception[0].message}')
+    _, rerun = timed(app.run)
+    heavy = [name for name in HEAVY_MODULES if name in sys.modules]
+    result = summarize('startup', 1, import_time + first_render, [import_time + first_render], 'запуск')
+    result.update({'import_ms': _ms(import_time), 'first_render_ms': _ms(first_render),
+                   'rerun_ms': _ms(rerun), 'heavy_modules': heavy})
+    return result
+
+
+def run_child(scenario, options):
+    sys.path[:0] = [ROOT_DIR, BENCH_DIR]
+    if scenario in ('single', 'bulk'):
+        result = (bench_single if scenario == 'single' else bench_bulk)(options)
+    elif scenario == 'mixed':
+        result = bench_mixed(options)
+    elif scenario == 'page_batch':
+        result = bench_page_batch(options)
+    elif scenario in CAST_SCENARIOS:
+        result = bench_cast(scenario, options)
+    elif scenario == 'postprocess':
+        result = bench_postprocess(options)
+    elif scenario == 'startup':
+        result = bench_startup(options)
+    else:
+        result = bench_stream(scenario, options)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+# Управляющий процесс
+
+def child_env(base_url, options):
+    env = dict(os.environ)
+    env.update({
+        'KINOPOISK_API_BASE': base_url,
+        'KINOPOISK_CACHE': '0',
+        'KINOPOISK_SNAPSHOTS': '0',
+        'KINOPOISK_DAILY_QUOTA': '0',
+        'KINOPOISK_RATE_LIMIT': str(options['rate_limit']),
+        'KINOPOISK_RATE_BURST': str(max(int(options['rate_limit']), 1)),
+    })
+    return env
+
+
+def run_scenario(scenario, options, env):
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', scenario, json.dumps(options)],
+        env=env, capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f'сценарий {scenario} завершился с ошибкой:\n{process.stderr}')
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """Список регрессий относительно прошлого прогона"""
+    previous = {r['scenario']: r for r in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(result['scenario'])
+        if not old:
+            continue
+        if old['throughput'] and result['throughput'] < old['throughput'] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: пропускная способность "
+                               f"{old['throughput']:.1f} → {result['throughput']:.1f}")
+        for key in ('p95_ms', 'peak_rss_mb', 'import_ms', 'first_render_ms'):
+            if old.get(key) and result.get(key) and result[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{result['scenario']}: {key} {old[key]:.1f} → {result[key]:.1f}")
+    return regressions
+
+
+def _fmt(value, digits=1):
+    return '-' if value is None else f'{value:.{digits}f}'
+
+
+def print_table(results):
+    header = f"{'сценарий':<24}{'кол-во':>8}{'в секунду':>12}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'RSS МБ':>9}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['scenario']:<24}{r['count']:>8}{_fmt(r['throughput']):>12}{_fmt(r['p50_ms']):>10}"
+              f"{_fmt(r['p95_ms']):>10}{_fmt(r['p99_ms']):>10}{_fmt(r['peak_rss_mb']):>9}")
+    for r in results:
+        if 'batch_throughput' in r:
+            print(f"{r['scenario']}: пакет {_fmt(r['batch_throughput'])} фильмов/с, одиночные загрузки "
+                  f"p95 {_fmt(r['p95_ms'])} мс")
+        if 'first_render_ms' in r:
+            print(f"{r['scenario']}: импорт {_fmt(r['import_ms'])} мс, первая отрисовка "
+                  f"{_fmt(r['first_render_ms'])} мс, повторная {_fmt(r['rerun_ms'])} мс; "
+                  f"тяжелые библиотеки при старте: {', '.join(r['heavy_modules']) or 'нет'}")
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ['--child']:
+        run_child(argv[1], json.loads(argv[2]))
+        return 0
+
+    parser = argparse.ArgumentParser(description='Офлайн-бенчмарк парсера Кинопоиска')
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--films', type=int, default=100, help='число фильмов для single/bulk/stream_*/postprocess')
+    parser.add_argument('--workers', type=int, default=8, help='потоков в bulk')
+    parser.add_argument('--cast-sizes', default=','.join(map(str, DEFAULT_CAST_SIZES)),
+                        help='размеры состава для excel/csv/simple_csv')
+    parser.add_argument('--repeat', type=int, default=5, help='повторов для excel/csv/simple_csv')
+    parser.add_argument('--latency', type=float, default=50, help='задержка ответа сервера, мс')
+    parser.add_argument('--jitter', type=float, default=20, help='разброс задержки (±), мс')
+    parser.add_argument('--rate-429', type=float, default=0, help='доля ответов 429 (0..1)')
+    parser.add_argument('--rate-limit', type=float, default=1000,
+                        help='ограничение частоты клиента, запросов в секунду')
+    parser.add_argument('--json', help='сохранить результаты в файл JSON')
+    parser.add_argument('--baseline', help='файл JSON прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое ухудшение (доля)')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, BENCH_DIR)
+    from mock_api import MockApi, load_fixtures, start_server
+
+    api = MockApi(load_fixtures(), args.latency / 1000, args.jitter / 1000, args.rate_429, seed=1)
+    server, base_url = start_server(api)
+    options = {'films': args.films, 'workers': args.workers, 'repeat': args.repeat,
+               'api_key': 'bench-key', 'rate_limit': args.rate_limit}
+    env = child_env(base_url, options)
+
+    results = []
+    try:
+        for scenario in args.scenario:
+            sizes = [int(s) for s in args.cast_sizes.split(',') if s] if scenario in CAST_SCENARIOS else [None]
+            for cast_size in sizes:
+                requests_before, throttled_before = api.requests, api.throttled
+                result = run_scenario(scenario, dict(options, cast_size=cast_size), env)
+                if scenario in ('single', 'bulk', 'mixed', 'page_batch'):
+                    result['http_requests'] = api.requests - requests_before
+                    result['http_429'] = api.throttled - throttled_before
+                results.append(result)
+                print(f"{result['scenario']}: {_fmt(result['throughput'])} {result['unit']}/с", file=sys.stderr)
+    finally:
+        server.shutdown()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=1)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'РЕГРЕССИЯ {line}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
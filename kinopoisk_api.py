@@ -0,0 +1,388 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from kinopoisk_cache import get_cache
+from kinopoisk_format import CURRENCY_SYMBOLS, format_date
+from kinopoisk_http import get_session
+from kinopoisk_keys import KeyPool
+from kinopoisk_metrics import instrument, metrics
+from kinopoisk_models import CastMember, FilmRecord
+from kinopoisk_ratelimit import (
+    MAX_RETRIES,
+    ApiLimitError,
+    QuotaExceededError,
+    RateLimitError,
+    get_limiter,
+)
+from kinopoisk_scheduler import current_priority, submit
+from kinopoisk_singleflight import SingleFlight
+from kinopoisk_snapshots import get_snapshots
+
+# Базовый адрес API (можно переопределить, например, для локального стаб-сервера)
+API_BASE = os.environ.get('KINOPOISK_API_BASE', 'https://kinopoiskapiunofficial.tech').rstrip('/')
+
+# API URLs
+API_URL = API_BASE + '/api/v2.2/films/{}'
+API_URL_STAFF = API_BASE + '/api/v1/staff?filmId={}'
+API_URL_BOXOFFICE = API_BASE + '/api/v2.2/films/{}/box_office'
+API_URL_DISTRIBUTIONS = API_BASE + '/api/v2.2/films/{}/distributions'
+API_URL_SEARCH = API_BASE + '/api/v2.1/films/search-by-keyword?keyword={}'
+
+# Эндпоинты по имени
+ENDPOINTS = {
+    'film': API_URL,
+    'staff': API_URL_STAFF,
+    'box_office': API_URL_BOXOFFICE,
+    'distributions': API_URL_DISTRIBUTIONS,
+}
+
+# Все адреса api_get: эндпоинты фильма и поиск по названию (вместо ID
+# фильма — строка запроса)
+URLS = dict(ENDPOINTS, search=API_URL_SEARCH)
+
+# Виды сборов в ответе box_office
+BOXOFFICE_TYPES = {
+    'BUDGET': 'budget',
+    'WORLD': 'world',
+    'RUS': 'russia',
+    'USA': 'usa',
+    'MARKETING': 'marketing',
+}
+
+# Ответы, которые можно отдать всем ожидающим одинакового запроса; ошибки
+# ключа (401/402) относятся только к ключу выполнившего запрос
+SHAREABLE_STATUSES = (200, 400, 404)
+
+# Профессии, которые не попадают в состав (монтажеры и художники)
+SKIPPED_PROFESSIONS = frozenset({'EDITOR', 'DESIGN'})
+SKIPPED_PROFESSION_TEXTS = ('монтажер', 'художник')
+
+# Таймауты по эндпоинтам, секунды (список персон бывает большим)
+TIMEOUTS = {
+    'film': 10,
+    'staff': 15,
+    'box_office': 10,
+    'distributions': 10,
+    'search': 10,
+}
+
+
+# Выполняющиеся запросы к API процесса по (эндпоинт, ID фильма)
+flights = SingleFlight()
+
+
+def get_headers(api_key):
+    return {
+        'X-API-KEY': api_key,
+        'Content-Type': 'application/json',
+    }
+
+
+def api_get(endpoint, film_id, api_key, timeout=None, use_cache=True):
+    """Запрос к эндпоинту API. Возвращает (status_code, data), где data — JSON
+    при статусе 200 и текст ответа в остальных случаях.
+
+    Успешные ответы берутся из постоянного кэша и сохраняются в него
+    (use_cache=False — всегда запрашивать API, обновив запись в кэше).
+    Одновременные запросы одного эндпоинта для одного фильма из разных
+    потоков и сессий с одинаковым приоритетом объединяются: выполняется
+    только первый, остальные получают его ответ. Запросы к API проходят
+    через ограничитель частоты ключа; на 429 делаются повторы с паузой, при исчерпании лимитов
+    бросается ApiLimitError. Если архив включен, ответы API
+    дописываются в него (kinopoisk_snapshots). Вместо одного ключа можно передать KeyPool"""
+    cache = get_cache()
+    if cache is not None and use_cache:
+        cached = cache.get(endpoint, film_id)
+        metrics.inc('kinopoisk_api_cache_total', endpoint=endpoint,
+                    outcome='miss' if cached is None else 'hit')
+        if cached is not None:
+            return 200, cached
+
+    # Фоновый запрос ждет токена дольше, поэтому интерактивный запрос не
+    # присоединяется к нему, а выполняется сам (объединение — в пределах приоритета)
+    result, shared = flights.do(
+        (endpoint, str(film_id), current_priority()),
+        lambda: _request(endpoint, film_id, api_key, timeout, cache),
+        reusable=lambda response: response[0] in SHAREABLE_STATUSES,
+    )
+    if shared:
+        metrics.inc('kinopoisk_api_deduplicated_total', endpoint=endpoint)
+    return result
+
+
+def _request(endpoint, film_id, api_key, timeout, cache):
+    """Запрос к API с повторами и переключением ключей (см. api_get)"""
+    url = URLS[endpoint].format(quote(str(film_id)))
+    pool = api_key if isinstance(api_key, KeyPool) else None
+    attempt = 0
+    # Переключения ключей из-за квоты: больше, чем ключей в пуле, не нужно
+    failovers = 0
+    while True:
+        # С пулом ключ выбирается заново на каждой попытке, поэтому ключ,
+        # получивший 401/402/429, сразу заменяется другим
+        key = pool.acquire() if pool else api_key
+        limiter = get_limiter(key)
+        try:
+            limiter.acquire()
+        except QuotaExceededError:
+            if pool and failovers < len(pool):
+                failovers += 1
+                metrics.inc('kinopoisk_api_retries_total', endpoint=endpoint, reason='quota')
+                continue
+            raise
+        started = time.perf_counter()
+        response = get_session().get(url, headers=get_headers(key), timeout=timeout or TIMEOUTS[endpoint])
+        latency = time.perf_counter() - started
+        metrics.observe('kinopoisk_api_request_seconds', latency, film_id, endpoint=endpoint)
+        metrics.inc('kinopoisk_api_requests_total', endpoint=endpoint, status=response.status_code)
+        if pool:
+            pool.report(key, response.status_code, latency, response.headers.get('Retry-After'))
+        if response.status_code == 402:
+            # Сервер сообщает, что суточный лимит ключа исчерпан
+            limiter.quota.exhaust()
+            if pool and failovers < len(pool):
+                failovers += 1
+                metrics.inc('kinopoisk_api_retries_total', endpoint=endpoint, reason='402')
+                continue
+            raise QuotaExceededError('Суточная квота API-ключа исчерпана', limiter.quota.reset_at())
+        if response.status_code == 401 and pool:
+            metrics.inc('kinopoisk_api_retries_total', endpoint=endpoint, reason='401')
+            continue
+        if response.status_code != 429:
+            break
+        if attempt == MAX_RETRIES:
+            raise RateLimitError(f'Превышен лимит запросов ({endpoint}, фильм {film_id})')
+        metrics.inc('kinopoisk_api_retries_total', endpoint=endpoint, reason='429')
+        limiter.backoff(attempt, response.headers.get('Retry-After'))
+        attempt += 1
+
+    metrics.observe('kinopoisk_api_response_bytes', len(response.content), film_id, endpoint=endpoint)
+    # Ответ целиком сохраняется в архив: новые поля можно будет разобрать без запросов
+    snapshots = get_snapshots()
+    if snapshots is not None and response.status_code in SHAREABLE_STATUSES:
+        snapshots.append(endpoint, film_id, response.status_code, response.content)
+    if response.status_code != 200:
+        return response.status_code, response.text
+    with metrics.timer('kinopoisk_api_json_seconds', film_id, endpoint=endpoint):
+        data = response.json()
+    if cache is not None:
+        cache.set(endpoint, film_id, data)
+    return response.status_code, data
+
+
+@instrument('kinopoisk_fetch_seconds')
+def get_film_info(film_id, api_key):
+    try:
+        status, data = api_get('film', film_id, api_key)
+        if status != 200:
+            return None, f'Ошибка: {status} — {data}'
+        return data, None
+    except ApiLimitError:
+        raise
+    except Exception as e:
+        return None, f'Ошибка запроса: {e}'
+
+def parse_cast(data):
+    """Список CastMember из ответа staff (без монтажеров и художников)"""
+    cast = []
+    for p in data:
+        key = p.get('professionKey')
+        if key:
+            if key in SKIPPED_PROFESSIONS:
+                continue
+            key = sys.intern(key)
+        else:
+            # Ответы без professionKey: проверка по тексту профессии
+            profession = (p.get('professionText') or p.get('profession') or '').lower()
+            if any(x in profession for x in SKIPPED_PROFESSION_TEXTS):
+                continue
+        name = p.get('nameRu') or p.get('nameEn') or '-'
+        cast.append(CastMember(sys.intern(name), p.get('staffId') or None, key, p.get('description') or None))
+    return cast
+
+@instrument('kinopoisk_fetch_seconds')
+def get_film_cast(film_id, api_key):
+    """Состав фильма: список CastMember (без монтажеров и художников)"""
+    try:
+        status, data = api_get('staff', film_id, api_key)
+        if status != 200:
+            return []
+        return parse_cast(data)
+    except ApiLimitError:
+        raise
+    except Exception as e:
+        return []
+
+def parse_boxoffice_amounts(data):
+    """Сборы из ответа box_office: {'budget': (сумма, код валюты), ...}"""
+    result = {}
+    for item in data.get('items', []):
+        key = BOXOFFICE_TYPES.get(item['type'])
+        if key:
+            result[key] = (item.get('amount'), item.get('currencyCode', 'USD'))
+    return result
+
+@instrument('kinopoisk_fetch_seconds')
+def get_film_boxoffice_amounts(film_id, api_key):
+    """Сборы фильма без форматирования: {'budget': (сумма, код валюты), ...}"""
+    try:
+        status, data = api_get('box_office', film_id, api_key)
+        if status != 200:
+            return {}
+        return parse_boxoffice_amounts(data)
+    except ApiLimitError:
+        raise
+    except Exception as e:
+        return {}
+
+def format_boxoffice(amounts):
+    """Строки вида "123 $" из результата get_film_boxoffice_amounts"""
+    result = {}
+    for key, (amount, currency) in amounts.items():
+        symbol = CURRENCY_SYMBOLS.get(currency, currency)
+        result[key] = f"{amount} {symbol}" if amount else '-'
+    return result
+
+def get_film_boxoffice(film_id, api_key):
+    return format_boxoffice(get_film_boxoffice_amounts(film_id, api_key))
+
+def parse_premiere_dates(data):
+    """Даты премьер из ответа distributions (строки ISO или None): (в РФ, мировая)"""
+    premiere_rf = None
+    premiere_world = None
+    for item in data.get('items', []):
+        t = item.get('type', '').upper()
+        date = item.get('date')
+        country_obj = item.get('country')
+        if t == 'WORLD_PREMIER':
+            premiere_world = date
+        if t == 'COUNTRY_SPECIFIC' and country_obj:
+            country_name = country_obj.get('country', '').lower()
+            if country_name in ('россия', 'russia'):
+                premiere_rf = date
+    return premiere_rf, premiere_world
+
+@instrument('kinopoisk_fetch_seconds')
+def get_film_premiere_dates(film_id, api_key):
+    """Даты премьер без форматирования (строки ISO или None): (в РФ, мировая)"""
+    try:
+        status, data = api_get('distributions', film_id, api_key)
+        if status != 200:
+            return None, None
+        return parse_premiere_dates(data)
+    except ApiLimitError:
+        raise
+    except Exception as e:
+        return None, None
+
+def format_premieres(dates):
+    return tuple(format_date(date) if date else '-' for date in dates)
+
+def get_film_premieres(film_id, api_key):
+    return format_premieres(get_film_premiere_dates(film_id, api_key))
+
+@instrument('kinopoisk_fetch_seconds')
+def fetch_film_bundle(film_id, api_key):
+    """Параллельно запрашивает все четыре эндпоинта фильма.
+
+    Время ответа определяется самым медленным запросом. Каждый эндпоинт
+    обрабатывается независимо: если один запрос упал, остальные результаты
+    все равно возвращаются (с теми же значениями по умолчанию, что и у
+    отдельных функций). Если же запрос не выполнен из-за лимитов API,
+    данные считаются неполными и ApiLimitError пробрасывается дальше."""
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix='kinopoisk') as pool:
+        futures = {
+            'info': submit(pool, get_film_info, film_id, api_key),
+            'boxoffice': submit(pool, get_film_boxoffice_amounts, film_id, api_key),
+            'premieres': submit(pool, get_film_premiere_dates, film_id, api_key),
+            'cast': submit(pool, get_film_cast, film_id, api_key),
+        }
+    results = {}
+    limit_errors = []
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except ApiLimitError as e:
+            limit_errors.append(e)
+    if limit_errors:
+        # Исчерпанная квота важнее временного 429: по ней батч встает на паузу
+        quota_errors = [e for e in limit_errors if isinstance(e, QuotaExceededError)]
+        raise (quota_errors or limit_errors)[0]
+
+    data, error = results['info']
+    return {
+        'data': data,
+        'error': error,
+        'boxoffice_amounts': results['boxoffice'],
+        'premiere_dates': results['premieres'],
+        'cast': results['cast'],
+    }
+
+@instrument('kinopoisk_fetch_seconds')
+def fetch_payloads(film_id, api_key, endpoints=tuple(ENDPOINTS), use_cache=True):
+    """Параллельно запрашивает ответы эндпоинтов без разбора.
+
+    Возвращает {эндпоинт: (status_code, data)}; при сетевой ошибке status_code
+    равен None, а data — текст ошибки. ApiLimitError пробрасывается, как в
+    fetch_film_bundle"""
+    def get(endpoint):
+        try:
+            return api_get(endpoint, film_id, api_key, use_cache=use_cache)
+        except ApiLimitError:
+            raise
+        except Exception as e:
+            return None, f'Ошибка запроса: {e}'
+
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix='kinopoisk') as pool:
+        futures = {endpoint: submit(pool, get, endpoint) for endpoint in endpoints}
+    results = {}
+    limit_errors = []
+    for endpoint, future in futures.items():
+        try:
+            results[endpoint] = future.result()
+        except ApiLimitError as e:
+            limit_errors.append(e)
+    if limit_errors:
+        quota_errors = [e for e in limit_errors if isinstance(e, QuotaExceededError)]
+        raise (quota_errors or limit_errors)[0]
+    return results
+
+def bundle_from_payloads(payloads):
+    """Результат в формате fetch_film_bundle из ответов fetch_payloads.
+
+    Неуспешные и недостающие ответы дают те же значения по умолчанию, что и
+    функции get_film_*"""
+    def parsed(endpoint, parse, default):
+        status, data = payloads.get(endpoint, (None, None))
+        if status != 200:
+            return default
+        try:
+            return parse(data)
+        except Exception:
+            return default
+
+    status, data = payloads.get('film', (None, 'Нет данных'))
+    if status == 200:
+        error = None
+    else:
+        data, error = None, data if status is None else f'Ошибка: {status} — {data}'
+    return {
+        'data': data,
+        'error': error,
+        'boxoffice_amounts': parsed('box_office', parse_boxoffice_amounts, {}),
+        'premiere_dates': parsed('distributions', parse_premiere_dates, (None, None)),
+        'cast': parsed('staff', parse_cast, []),
+    }
+
+@instrument('kinopoisk_fetch_seconds')
+def fetch_film(film_id, api_key):
+    """Запрашивает фильм целиком. Возвращает (FilmRecord, None) или (None, ошибка)"""
+    bundle = fetch_film_bundle(film_id, api_key)
+    if bundle['error'] or not bundle['data']:
+        return None, bundle['error'] or 'Нет данных'
+    with metrics.timer('kinopoisk_fetch_seconds', film_id, function='FilmRecord.from_bundle'):
+        film = FilmRecord.from_bundle(film_id, bundle)
+    return film, None
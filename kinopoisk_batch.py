@@ -0,0 +1,513 @@
+"""Пакетная обработка списка ID фильмов.
+
+Использование из командной строки:
+
+    python kinopoisk_batch.py ids.txt --api-key KEY --output films.jsonl --workers 8
+
+Результаты пишутся в файл построчно (JSON Lines) по мере готовности, а с
+--csv — еще и в два CSV-файла (фильмы и состав). Рядом ведется файл-чекпоинт
+с уже обработанными ID, поэтому повторный запуск после сбоя продолжает
+работу с места остановки, не запрашивая готовые фильмы и не читая
+выходные файлы.
+
+Файлы сбрасываются на диск (fsync) группами: каждые FSYNC_EVERY фильмов
+или FSYNC_INTERVAL секунд. Строка чекпоинта пишется только после fsync
+выходных файлов и хранит их размеры, поэтому при перезапуске хвост,
+записанный после последнего сброса (в том числе оборванная строка),
+отрезается, и фильмы из него запрашиваются заново без дублей.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from kinopoisk_api import fetch_film
+from kinopoisk_export import (
+    CAST_COLUMNS,
+    MAIN_COLUMNS,
+    PARQUET_ROW_GROUP,
+    append_to_dataset,
+    cast_csv_rows,
+    csv_paths,
+    film_csv_row,
+)
+from kinopoisk_keys import get_key_pool, parse_keys
+from kinopoisk_ratelimit import ApiLimitError, QuotaExceededError
+from kinopoisk_scheduler import BATCH, PauseSwitch, priority, submit
+
+DEFAULT_WORKERS = 8
+
+# Сброс выходных файлов и чекпоинта на диск: каждые FSYNC_EVERY фильмов,
+# но не реже чем раз в FSYNC_INTERVAL секунд
+FSYNC_EVERY = 100
+FSYNC_INTERVAL = 5.0
+
+
+def read_film_ids(source):
+    """Читает ID фильмов из CSV/TXT (путь, байты или файловый объект).
+
+    Берется первое число в каждой строке, поэтому подходят и простые списки,
+    и CSV с ID в первом столбце. Заголовки и пустые строки пропускаются,
+    повторы удаляются с сохранением порядка."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            raw = f.read()
+    elif isinstance(source, bytes):
+        raw = source
+    else:
+        raw = source.read()
+    text = raw.decode('utf-8-sig') if isinstance(raw, bytes) else raw
+
+    film_ids = []
+    seen = set()
+    for line in io.StringIO(text):
+        match = re.search(r'\d+', line)
+        if not match:
+            continue
+        film_id = match.group(0)
+        if film_id not in seen:
+            seen.add(film_id)
+            film_ids.append(film_id)
+    return film_ids
+
+
+def checkpoint_path(output_path):
+    return output_path + '.done'
+
+
+def load_checkpoint(output_path):
+    """Возвращает множество ID, уже записанных в выходной файл.
+
+    Строки чекпоинта — «ID<TAB>размеры файлов» (см. BatchWriter); строка
+    с '#' и оборванная последняя строка пропускаются"""
+    path = checkpoint_path(output_path)
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return {line.split('\t', 1)[0].strip() for line in f
+                if line.endswith('\n') and line.strip() and not line.startswith('#')}
+
+
+def _truncate_partial_line(path, block=65536):
+    """Отрезает оборванную последнюю строку файла (без завершающего \\n)"""
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(pos - block, 0)
+            f.seek(start)
+            chunk = f.read(pos - start)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                size = start + newline + 1
+                break
+            pos = start
+        else:
+            size = 0
+        if size != end:
+            f.truncate(size)
+
+
+def _last_line(path, block=65536):
+    """Последняя строка файла (файл должен заканчиваться переводом строки)"""
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        tail = b''
+        while pos > 0:
+            start = max(pos - block, 0)
+            f.seek(start)
+            tail = f.read(pos - start) + tail
+            if tail.count(b'\n') > 1:
+                break
+            pos = start
+    lines = tail.rstrip(b'\n').rsplit(b'\n', 1)
+    return lines[-1].decode('utf-8') if lines[-1] else None
+
+
+class _AppendFile:
+    """Файл, открытый на дозапись; size — его размер с учетом еще не
+    сброшенного буфера"""
+
+    def __init__(self, path, header=b''):
+        self.file = open(path, 'ab')
+        self.size = self.file.seek(0, os.SEEK_END)
+        if header and self.size == 0:
+            self.write(header)
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def truncate(self, size):
+        self.file.flush()
+        self.file.truncate(size)
+        self.size = size
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def _csv_bytes(rows, bom=False):
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter=';', quoting=csv.QUOTE_ALL).writerows(rows)
+    return ('\ufeff' if bom else '').encode('utf-8') + buffer.getvalue().encode('utf-8')
+
+
+class BatchWriter:
+    """Дозапись результатов в JSON Lines (и CSV) с чекпоинтом.
+
+    Строка чекпоинта «ID<TAB>размер файла 1<TAB>...» добавляется только после
+    fsync выходных файлов. При открытии файлы обрезаются до размеров из
+    последней строки чекпоинта: все, что записано после нее, не подтверждено
+    и будет загружено заново. Первая строка нового чекпоинта («#» и размеры)
+    фиксирует исходные размеры файлов"""
+
+    def __init__(self, output_path, csv_prefix=None, fsync_every=FSYNC_EVERY, fsync_interval=FSYNC_INTERVAL):
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.sinks = [_AppendFile(output_path)]
+        if csv_prefix:
+            main_path, cast_path = csv_paths(csv_prefix)
+            self.sinks.append(_AppendFile(main_path, _csv_bytes([MAIN_COLUMNS], bom=True)))
+            self.sinks.append(_AppendFile(cast_path, _csv_bytes([CAST_COLUMNS], bom=True)))
+
+        path = checkpoint_path(output_path)
+        offsets = self._recover(path)
+        self.checkpoint = open(path, 'ab')
+        if offsets is None:
+            for sink in self.sinks:
+                sink.sync()
+            self.checkpoint.write(('#\t' + self._offsets() + '\n').encode('utf-8'))
+            self.checkpoint.flush()
+            os.fsync(self.checkpoint.fileno())
+        self._pending = []
+        self._synced_at = time.monotonic()
+
+    def _offsets(self):
+        return '\t'.join(str(sink.size) for sink in self.sinks)
+
+    def _recover(self, path):
+        """Приводит выходные файлы к последней строке чекпоинта. Возвращает
+        размеры из нее или None, если чекпоинта нет или он пуст"""
+        if not os.path.exists(path):
+            return None
+        _truncate_partial_line(path)
+        line = _last_line(path)
+        if line is None:
+            return None
+        offsets = line.split('\t')[1:]
+        # Файлы, которых в чекпоинте нет (например, CSV добавлен при
+        # повторном запуске), не обрезаются
+        for sink, offset in zip(self.sinks, map(int, offsets)):
+            if sink.size > offset:
+                sink.truncate(offset)
+        return offsets
+
+    def write(self, film_id, film):
+        self.sinks[0].write((json.dumps(film.to_json(), ensure_ascii=False) + '\n').encode('utf-8'))
+        if len(self.sinks) > 1:
+            self.sinks[1].write(_csv_bytes([film_csv_row(film)]))
+            self.sinks[2].write(_csv_bytes(cast_csv_rows(film)))
+        self._pending.append(f'{film_id}\t{self._offsets()}\n')
+        if len(self._pending) >= self.fsync_every or time.monotonic() - self._synced_at >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """Сбрасывает выходные файлы на диск, затем подтверждает фильмы в чекпоинте"""
+        self._synced_at = time.monotonic()
+        if not self._pending:
+            return
+        for sink in self.sinks:
+            sink.sync()
+        self.checkpoint.write(''.join(self._pending).encode('utf-8'))
+        self.checkpoint.flush()
+        os.fsync(self.checkpoint.fileno())
+        self._pending = []
+
+    def close(self):
+        self.sync()
+        for sink in self.sinks:
+            sink.close()
+        self.checkpoint.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def fetch_film_record(film_id, api_key):
+    """Запрашивает фильм. Возвращает (FilmRecord, None) или (None, ошибка).
+
+    Стойкий 429 (или отключение всех ключей пула) превращается в ошибку
+    (фильм будет запрошен при следующем запуске), исчерпанная квота
+    пробрасывается наверх"""
+    try:
+        return fetch_film(film_id, api_key)
+    except QuotaExceededError:
+        raise
+    except ApiLimitError as e:
+        return None, str(e)
+
+
+def process_ids(film_ids, task, on_result, workers=DEFAULT_WORKERS, progress=None,
+                wait_for_quota=True, on_pause=None, done=0, total=None, on_hold=None, switch=None):
+    """Выполняет task(film_id) для каждого ID пулом из workers потоков.
+
+    Запросы задач выполняются с фоновым приоритетом (BATCH), то есть
+    уступают интерактивным. on_result(film_id, result) вызывается в
+    вызывающем потоке по мере готовности задач, поэтому запись результатов
+    не требует блокировок.
+
+    Когда суточная квота ключа исчерпана, фильмы, попавшие под лимит,
+    возвращаются в очередь, и обработка встает на паузу до сброса квоты
+    (on_pause(reset_at) вызывается перед ожиданием). При wait_for_quota=False
+    обработка вместо этого останавливается и функция возвращает 'quota'.
+
+    Пока прогон приостановлен (switch.pause(), см. PauseSwitch), новые задачи
+    не отправляются, а еще не начатые возвращаются в очередь; когда
+    выполняющиеся завершатся, вызывается on_hold() и обработка ждет
+    switch.resume().
+
+    progress(done, total) вызывается после каждого фильма; done и total —
+    начальные значения счетчика (например, с учетом пропущенных ID)."""
+    pending = deque(film_ids)
+    if switch is None:
+        switch = PauseSwitch()
+    if total is None:
+        total = done + len(pending)
+    if progress:
+        progress(done, total)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kinopoisk-batch') as pool:
+        in_flight = {}
+        quota_error = None
+
+        # Держим в очереди не больше 2 * workers задач, чтобы не создавать
+        # сотни тысяч futures для больших списков
+        def fill():
+            with priority(BATCH):
+                while pending and len(in_flight) < workers * 2 and not switch.paused():
+                    film_id = pending.popleft()
+                    in_flight[submit(pool, task, film_id)] = film_id
+
+        fill()
+        while in_flight or pending:
+            if not in_flight:
+                # Обработка приостановлена, отправленные задачи завершены
+                if on_hold:
+                    on_hold()
+                switch.wait_resumed()
+                fill()
+                continue
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                film_id = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except QuotaExceededError as e:
+                    # Фильм не потерян: вернется в очередь после паузы
+                    quota_error = e
+                    pending.appendleft(film_id)
+                    continue
+                on_result(film_id, result)
+                done += 1
+                if progress:
+                    progress(done, total)
+
+            if switch.paused():
+                # Еще не начатые задачи возвращаются в очередь в прежнем порядке
+                for future in reversed(list(in_flight)):
+                    if future.cancel():
+                        pending.appendleft(in_flight.pop(future))
+
+            if quota_error is not None:
+                # Дожидаемся уже отправленных запросов и только потом
+                # останавливаемся или засыпаем до сброса квоты
+                if in_flight:
+                    continue
+                if not wait_for_quota:
+                    return 'quota'
+                if on_pause:
+                    on_pause(quota_error.reset_at)
+                time.sleep(max(quota_error.reset_at - time.time(), 0) + 1)
+                quota_error = None
+            fill()
+    return None
+
+
+def run_batch(film_ids, api_key, output_path, workers=DEFAULT_WORKERS, progress=None,
+              wait_for_quota=True, on_pause=None, dataset=None, csv_prefix=None, switch=None):
+    """Обрабатывает список ID пулом из workers потоков.
+
+    Каждая готовая запись сразу дописывается в output_path (и, если задан
+    csv_prefix, в файлы CSV из kinopoisk_export.csv_paths), а ее ID после
+    сброса файлов на диск — в чекпоинт (см. BatchWriter). ID из чекпоинта
+    повторно не запрашиваются. Фильмы с ошибкой не отмечаются выполненными и
+    будут запрошены при следующем запуске.
+
+    При исчерпании суточной квоты обработка ждет ее сброса или, при
+    wait_for_quota=False, останавливается с stats['stopped'] = 'quota'
+    (см. process_ids).
+
+    switch — PauseSwitch для приостановки прогона (см. process_ids).
+
+    Если задан dataset, загруженные в этом прогоне фильмы также дописываются
+    в набор данных Parquet (группами по PARQUET_ROW_GROUP записей; после сбоя
+    недописанные группы можно добавить из JSON Lines через kinopoisk_export).
+
+    progress(done, total) вызывается после каждого фильма.
+    Возвращает словарь со статистикой прогона."""
+    started = time.time()
+    # Писатель открывается первым: он отрезает неподтвержденный хвост
+    # выходных файлов и оборванную строку чекпоинта
+    with BatchWriter(output_path, csv_prefix) as writer:
+        done_ids = load_checkpoint(output_path)
+        pending = [film_id for film_id in film_ids if film_id not in done_ids]
+        total = len(film_ids)
+        stats = {'total': total, 'skipped': total - len(pending), 'fetched': 0, 'failed': 0,
+                 'errors': {}, 'stopped': None}
+        dataset_buffer = []
+
+        def on_result(film_id, result):
+            nonlocal dataset_buffer
+            film, error = result
+            if error:
+                stats['failed'] += 1
+                stats['errors'][film_id] = error
+                return
+            writer.write(film_id, film)
+            stats['fetched'] += 1
+            if dataset:
+                dataset_buffer.append(film)
+                if len(dataset_buffer) >= PARQUET_ROW_GROUP:
+                    append_to_dataset(dataset_buffer, dataset)
+                    dataset_buffer = []
+
+        def pause(reset_at):
+            # Перед долгим ожиданием сброса квоты подтверждаем готовые фильмы
+            writer.sync()
+            if on_pause:
+                on_pause(reset_at)
+
+        stats['stopped'] = process_ids(
+            pending, lambda film_id: fetch_film_record(film_id, api_key), on_result,
+            workers=workers, progress=progress, wait_for_quota=wait_for_quota, on_pause=pause,
+            done=stats['skipped'], total=total, on_hold=writer.sync, switch=switch)
+
+        if dataset_buffer:
+            append_to_dataset(dataset_buffer, dataset)
+
+    stats['elapsed'] = time.time() - started
+    return stats
+
+
+class BatchJob:
+    """Пакетная обработка в фоновом потоке (для страницы Streamlit).
+
+    func(*args, progress=..., switch=..., **kwargs) — run_batch или
+    run_refresh; прогресс (done, total), статистика и исключение читаются из
+    других потоков. Запросы выполняются с фоновым приоритетом; пауза
+    (job.switch) действует только на этот прогон"""
+
+    def __init__(self, func, *args, **kwargs):
+        self.switch = PauseSwitch()
+        self.done = 0
+        self.total = 0
+        self.stats = None
+        self.error = None
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, args=(func, args, kwargs),
+                                        name='kinopoisk-batch-job', daemon=True)
+        self._thread.start()
+
+    def _progress(self, done, total):
+        self.done, self.total = done, total
+
+    def _run(self, func, args, kwargs):
+        try:
+            with priority(BATCH):
+                self.stats = func(*args, progress=self._progress, switch=self.switch, **kwargs)
+        except Exception as e:
+            self.error = e
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+
+def print_pause(reset_at):
+    sys.stderr.write(f"\nСуточная квота исчерпана, пауза до "
+                     f"{datetime.fromtimestamp(reset_at):%d.%m.%Y %H:%M}\n")
+    sys.stderr.flush()
+
+
+def print_progress(done, total):
+    width = 40
+    filled = int(width * done / total) if total else width
+    sys.stderr.write(f"\r[{'#' * filled}{'.' * (width - filled)}] {done}/{total}")
+    sys.stderr.flush()
+    if done == total:
+        sys.stderr.write('\n')
+
+
+def add_key_arguments(parser):
+    parser.add_argument('-k', '--api-key', default=os.environ.get('KINOPOISK_API_KEY'),
+                        help='API-ключ или несколько ключей через запятую (по умолчанию из KINOPOISK_API_KEY)')
+    parser.add_argument('--keys-file', help='файл с API-ключами, по одному в строке')
+
+
+def api_key_from_args(parser, args):
+    """Ключ или пул ключей из аргументов add_key_arguments"""
+    keys = parse_keys(args.api_key or '')
+    if args.keys_file:
+        with open(args.keys_file, encoding='utf-8') as f:
+            keys += parse_keys(f.read())
+    if not keys:
+        parser.error('не указан API-ключ (--api-key, --keys-file или KINOPOISK_API_KEY)')
+    return keys[0] if len(keys) == 1 else get_key_pool(keys)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Пакетная загрузка фильмов с Кинопоиска')
+    parser.add_argument('ids', help='файл CSV/TXT со списком ID фильмов')
+    add_key_arguments(parser)
+    parser.add_argument('-o', '--output', default='films.jsonl', help='выходной файл JSON Lines')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help='число потоков')
+    parser.add_argument('--csv', help='префикс файлов CSV (<префикс>_films.csv, <префикс>_cast.csv), '
+                                      'которые дописываются по ходу загрузки')
+    parser.add_argument('--dataset', help='каталог набора данных Parquet для дописывания результатов')
+    parser.add_argument('--no-wait-quota', action='store_true',
+                        help='остановиться, а не ждать сброса суточной квоты')
+    args = parser.parse_args(argv)
+
+    api_key = api_key_from_args(parser, args)
+    film_ids = read_film_ids(args.ids)
+    stats = run_batch(film_ids, api_key, args.output, workers=args.workers, progress=print_progress,
+                      wait_for_quota=not args.no_wait_quota, on_pause=print_pause, dataset=args.dataset,
+                      csv_prefix=args.csv)
+    print(f"Готово: загружено {stats['fetched']}, пропущено {stats['skipped']}, "
+          f"ошибок {stats['failed']} за {stats['elapsed']:.1f} с")
+    if stats['stopped'] == 'quota':
+        print("Остановлено: суточная квота исчерпана, повторный запуск продолжит с чекпоинта")
+    for film_id, error in stats['errors'].items():
+        print(f"  {film_id}: {error}", file=sys.stderr)
+    return 1 if stats['failed'] or stats['stopped'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""Постоянный кэш ответов API в SQLite.
+
+Ответы хранятся по ключу (эндпоинт, ID фильма) в сжатом виде и переживают
+перезапуск приложения. У каждого эндпоинта свой срок жизни записей, общий
+размер кэша ограничен: при превышении удаляются давно не читавшиеся записи.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Путь к файлу кэша; KINOPOISK_CACHE=0 отключает кэш
+CACHE_PATH = os.environ.get(
+    'KINOPOISK_CACHE_PATH',
+    os.path.join(os.path.expanduser('~'), '.cache', 'kinopoisk', 'responses.sqlite3'),
+)
+CACHE_ENABLED = os.environ.get('KINOPOISK_CACHE', '1') != '0'
+
+# Сроки жизни записей по эндпоинтам, секунды. Карточка фильма и состав
+# меняются редко, кассовые сборы — часто
+DAY = 24 * 60 * 60
+CACHE_TTLS = {
+    'film': 7 * DAY,
+    'staff': 30 * DAY,
+    'box_office': 1 * DAY,
+    'distributions': 7 * DAY,
+    'search': 7 * DAY,
+}
+DEFAULT_TTL = 1 * DAY
+
+# Максимальный размер кэша (сумма сжатых ответов), байты
+CACHE_MAX_BYTES = int(os.environ.get('KINOPOISK_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+
+class ResponseCache:
+    """Кэш ответов API с TTL по эндпоинтам и LRU-вытеснением"""
+
+    def __init__(self, path=CACHE_PATH, ttls=None, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                endpoint TEXT NOT NULL,
+                film_id TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (endpoint, film_id)
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self._conn.commit()
+        # Текущий размер кэша ведется в памяти, чтобы не суммировать таблицу на каждой записи
+        self._size = self._total()
+
+    def _total(self):
+        return self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, endpoint, film_id):
+        """Возвращает закэшированный JSON или None, если записи нет или она устарела"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT payload, fetched_at FROM responses WHERE endpoint = ? AND film_id = ?',
+                (endpoint, str(film_id)),
+            ).fetchone()
+            if row is None or now - row[1] > self.ttls.get(endpoint, DEFAULT_TTL):
+                self.misses += 1
+                return None
+            self._conn.execute(
+                'UPDATE responses SET accessed_at = ? WHERE endpoint = ? AND film_id = ?',
+                (now, endpoint, str(film_id)),
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def entries(self, endpoint):
+        """Все записи эндпоинта, включая устаревшие: пары (ID, JSON).
+
+        Не обновляет время чтения и счетчики попаданий"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT film_id, payload FROM responses WHERE endpoint = ?', (endpoint,)
+            ).fetchall()
+        for film_id, payload in rows:
+            yield film_id, json.loads(zlib.decompress(payload))
+
+    def set(self, endpoint, film_id, data):
+        payload = zlib.compress(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute(
+                'SELECT size FROM responses WHERE endpoint = ? AND film_id = ?', (endpoint, str(film_id))
+            ).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (endpoint, str(film_id), payload, len(payload), now, now),
+            )
+            self._size += len(payload) - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Удаляет самые давно читавшиеся записи, пока кэш не станет меньше лимита"""
+        if self._size <= self.max_bytes:
+            return
+        # Файл кэша могут менять и другие процессы: перед вытеснением размер
+        # пересчитывается точно
+        total = self._size = self._total()
+        if total <= self.max_bytes:
+            return
+        # Освобождаем с запасом, чтобы не вытеснять на каждой записи
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute('SELECT endpoint, film_id, size FROM responses ORDER BY accessed_at')
+        victims = []
+        for endpoint, film_id, size in rows:
+            if total <= target:
+                break
+            victims.append((endpoint, film_id))
+            total -= size
+        self._conn.executemany('DELETE FROM responses WHERE endpoint = ? AND film_id = ?', victims)
+        self._size = total
+        self.evictions += len(victims)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'size_bytes': size,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Общий для процесса экземпляр кэша (None, если кэш отключен)"""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
@@ -0,0 +1,520 @@
+"""Потоковый экспорт результатов пакетной обработки в Excel и CSV.
+
+Фильмы читаются из файла JSON Lines по одному и сразу пишутся в выходной
+файл, поэтому потребление памяти не зависит от числа фильмов:
+
+    python kinopoisk_export.py films.jsonl --xlsx films.xlsx --csv films
+
+В книге Excel лист «Фильмы» содержит по строке на фильм, а лист «Актеры и
+съемочная группа» — длинную таблицу с ID фильма в первом столбце.
+
+Колоночный экспорт (Parquet, нужен pyarrow) сохраняет типы: год, рейтинги,
+число голосов, продолжительность и сборы — числа, валюта — отдельный столбец,
+даты премьер — даты. Его можно дописывать в партиционированный набор данных:
+
+    python kinopoisk_export.py films.jsonl --parquet films --dataset dataset/
+
+Здесь же собираются файлы для одного фильма, которые отдает страница
+Streamlit (create_excel_file, create_improved_csv_file, create_simple_csv_file,
+create_parquet_file).
+
+pandas, xlsxwriter и pyarrow импортируются внутри функций экспорта: модуль
+импортирует страница и пакетная обработка, а эти библиотеки нужны только при
+создании файлов.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import date, datetime
+
+from kinopoisk_metrics import instrument, metrics
+from kinopoisk_models import FILM_FIELDS, FilmRecord
+
+# Ограничения Excel
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_CELL = 32000
+EXCEL_MAX_NAME = 255
+
+MAIN_SHEET = 'Фильмы'
+CAST_SHEET = 'Актеры и съемочная группа'
+
+MAIN_COLUMNS = ('ID фильма',) + FILM_FIELDS
+CAST_COLUMNS = ('ID фильма', 'Имя', 'ID')
+
+
+def iter_films(path):
+    """Построчно читает FilmRecord из файла JSON Lines.
+
+    Записи без данных фильма (ошибки загрузки) пропускаются"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            film = film_from_line(line)
+            if film is not None:
+                yield film
+
+
+def film_from_line(line):
+    """FilmRecord из строки JSON Lines (str или bytes) или None"""
+    if not line.strip():
+        return None
+    return FilmRecord.from_json(json.loads(line))
+
+
+def clean_excel_value(value, limit=EXCEL_MAX_CELL):
+    if isinstance(value, str):
+        value = value.replace('\x00', '').replace('\ufeff', '')
+        if len(value) > limit:
+            value = value[:limit] + "..."
+    return value
+
+
+def clean_csv_value(value):
+    if isinstance(value, str):
+        return value.replace('\x00', '').replace('\ufeff', '').replace('\n', ' ').replace('\r', ' ')
+    return value
+
+
+class _SheetWriter:
+    """Построчная запись в лист книги; при достижении лимита строк Excel
+    продолжает запись на новом листе с тем же заголовком"""
+
+    def __init__(self, workbook, name, columns, widths, header_format):
+        self.workbook = workbook
+        self.name = name
+        self.columns = columns
+        self.widths = widths
+        self.header_format = header_format
+        self.sheets = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        self.sheets += 1
+        name = self.name if self.sheets == 1 else f'{self.name[:26]} ({self.sheets})'
+        self.worksheet = self.workbook.add_worksheet(name)
+        for col_num, width in enumerate(self.widths):
+            self.worksheet.set_column(col_num, col_num, width)
+        for col_num, value in enumerate(self.columns):
+            self.worksheet.write(0, col_num, value, self.header_format)
+        self.row = 1
+
+    def write(self, values):
+        if self.row >= EXCEL_MAX_ROWS:
+            self._new_sheet()
+        self.worksheet.write_row(self.row, 0, values)
+        self.row += 1
+
+
+@instrument('kinopoisk_export_seconds')
+def export_films_xlsx(films, output):
+    """Пишет фильмы в одну книгу Excel (путь или файловый объект).
+
+    Используется режим constant_memory xlsxwriter: каждая строка сбрасывается
+    на диск сразу после записи. Возвращает число записанных фильмов."""
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    header_format = workbook.add_format({
+        'bold': True,
+        'bg_color': '#D3D3D3',
+        'border': 1
+    })
+    main = _SheetWriter(workbook, MAIN_SHEET, MAIN_COLUMNS,
+                        [12] + [25] * len(FILM_FIELDS), header_format)
+    cast = _SheetWriter(workbook, CAST_SHEET, CAST_COLUMNS, [12, 40, 15], header_format)
+
+    count = 0
+    for film in films:
+        display = film.display()
+        main.write([film.film_id] + [clean_excel_value(display[field]) for field in FILM_FIELDS])
+        for member in film.cast:
+            cast.write([film.film_id, clean_excel_value(member.name, EXCEL_MAX_NAME), member.staff_id or ''])
+        count += 1
+
+    workbook.close()
+    return count
+
+
+@instrument('kinopoisk_export_seconds')
+def export_films_csv(films, main_path, cast_path):
+    """Пишет фильмы в два CSV-файла (основная информация и состав) в формате
+    create_improved_csv_file: разделитель «;», все поля в кавычках, UTF-8 с BOM.
+    Возвращает число записанных фильмов."""
+    count = 0
+    with open(main_path, 'w', encoding='utf-8-sig', newline='') as main_file, \
+            open(cast_path, 'w', encoding='utf-8-sig', newline='') as cast_file:
+        main = csv.writer(main_file, delimiter=';', quoting=csv.QUOTE_ALL)
+        cast = csv.writer(cast_file, delimiter=';', quoting=csv.QUOTE_ALL)
+        main.writerow(MAIN_COLUMNS)
+        cast.writerow(CAST_COLUMNS)
+        for film in films:
+            main.writerow(film_csv_row(film))
+            cast.writerows(cast_csv_rows(film))
+            count += 1
+    return count
+
+
+def film_csv_row(film):
+    """Строка фильма для CSV (столбцы MAIN_COLUMNS)"""
+    display = film.display()
+    return [film.film_id] + [clean_csv_value(display[field]) for field in FILM_FIELDS]
+
+
+def cast_csv_rows(film):
+    """Строки состава фильма для CSV (столбцы CAST_COLUMNS)"""
+    return [[film.film_id, clean_csv_value(member.name), member.staff_id or ''] for member in film.cast]
+
+
+# Файлы для одного фильма (страница Streamlit)
+
+@instrument('kinopoisk_export_seconds')
+def create_excel_file(film_data, cast_data):
+    """Создает Excel файл с данными о фильме (исключения пробрасываются)"""
+    import pandas as pd
+
+    output = io.BytesIO()
+    
+    try:
+        started = time.perf_counter()
+        # Очищаем данные от проблемных символов
+        cleaned_film_data = {}
+        for key, value in film_data.items():
+            if isinstance(value, str):
+                # Удаляем или заменяем проблемные символы
+                cleaned_value = value.replace('\x00', '').replace('\ufeff', '')
+                # Ограничиваем длину для Excel (максимум 32767 символов в ячейке)
+                if len(cleaned_value) > 32000:
+                    cleaned_value = cleaned_value[:32000] + "..."
+                cleaned_film_data[key] = cleaned_value
+            else:
+                cleaned_film_data[key] = value
+        
+        # Основные данные фильма
+        df_main = pd.DataFrame([cleaned_film_data])
+        
+        # Данные о касте
+        cast_list = []
+        for member in cast_data:
+            # Очищаем имя от проблемных символов
+            clean_name = member.name.strip().replace('\x00', '').replace('\ufeff', '')
+            if len(clean_name) > 255:  # Ограничение для имен
+                clean_name = clean_name[:255]
+            cast_list.append({'Имя': clean_name, 'ID': member.staff_id or ''})
+        
+        df_cast = pd.DataFrame(cast_list)
+        metrics.observe('kinopoisk_export_stage_seconds', time.perf_counter() - started,
+                        function='create_excel_file', stage='dataframe')
+        started = time.perf_counter()
+        
+        # Записываем в Excel с правильными настройками
+        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+            # Записываем основную информацию
+            df_main.to_excel(writer, sheet_name='Основная информация', index=False)
+            
+            # Записываем данные о касте
+            df_cast.to_excel(writer, sheet_name='Актеры и съемочная группа', index=False)
+            
+            # Получаем workbook и worksheet для настройки
+            workbook = writer.book
+            worksheet_main = writer.sheets['Основная информация']
+            worksheet_cast = writer.sheets['Актеры и съемочная группа']
+            
+            # Настраиваем ширину столбцов
+            worksheet_main.set_column('A:A', 25)  # Названия полей
+            worksheet_main.set_column('B:B', 50)  # Значения
+            
+            worksheet_cast.set_column('A:A', 40)  # Имена
+            worksheet_cast.set_column('B:B', 15)  # ID
+            
+            # Добавляем форматирование заголовков
+            header_format = workbook.add_format({
+                'bold': True,
+                'bg_color': '#D3D3D3',
+                'border': 1
+            })
+            
+            # Применяем форматирование к заголовкам
+            for col_num, value in enumerate(df_main.columns.values):
+                worksheet_main.write(0, col_num, value, header_format)
+            
+            for col_num, value in enumerate(df_cast.columns.values):
+                worksheet_cast.write(0, col_num, value, header_format)
+        
+        metrics.observe('kinopoisk_export_stage_seconds', time.perf_counter() - started,
+                        function='create_excel_file', stage='write')
+        output.seek(0)
+        return output
+        
+    except Exception:
+        output.close()
+        raise
+
+@instrument('kinopoisk_export_seconds')
+def create_improved_csv_file(film_data, cast_data):
+    """Создает улучшенный CSV файл как альтернатива Excel"""
+    import pandas as pd
+
+    output = io.BytesIO()
+    
+    # Создаем временный файл в памяти
+    temp_output = io.StringIO()
+    
+    try:
+        # Очищаем данные
+        cleaned_film_data = {}
+        for key, value in film_data.items():
+            if isinstance(value, str):
+                cleaned_value = value.replace('\x00', '').replace('\ufeff', '').replace('\n', ' ').replace('\r', ' ')
+                cleaned_film_data[key] = cleaned_value
+            else:
+                cleaned_film_data[key] = value
+        
+        # Создаем DataFrame для основной информации
+        df_main = pd.DataFrame([cleaned_film_data])
+        
+        # Создаем DataFrame для актеров
+        cast_list = []
+        for member in cast_data:
+            clean_name = member.name.strip().replace('\x00', '').replace('\ufeff', '').replace('\n', ' ').replace('\r', ' ')
+            cast_list.append({'Имя': clean_name, 'ID': member.staff_id or ''})
+        
+        df_cast = pd.DataFrame(cast_list)
+        
+        # Записываем в CSV с правильной кодировкой
+        temp_output.write("=== ОСНОВНАЯ ИНФОРМАЦИЯ ===\n")
+        df_main.to_csv(temp_output, index=False, encoding='utf-8', sep=';', quoting=1)
+        
+        temp_output.write("\n=== АКТЕРЫ И СЪЕМОЧНАЯ ГРУППА ===\n")
+        df_cast.to_csv(temp_output, index=False, encoding='utf-8', sep=';', quoting=1)
+        
+        # Получаем содержимое и кодируем с BOM для Excel
+        content = temp_output.getvalue()
+        
+        # Возвращаем байтовый поток с правильной кодировкой
+        final_content = '\ufeff' + content
+        output.write(final_content.encode('utf-8'))
+        output.seek(0)
+        
+        return output
+        
+    finally:
+        temp_output.close()
+
+@instrument('kinopoisk_export_seconds')
+def create_simple_csv_file(film_data, cast_data):
+    """Создает простой CSV файл для универсального использования"""
+    import pandas as pd
+
+    output = io.StringIO()
+    
+    # Создаем DataFrame для основной информации
+    df_main = pd.DataFrame([film_data])
+    
+    # Создаем DataFrame для актеров
+    cast_list = []
+    for member in cast_data:
+        cast_list.append({'Имя': member.name.strip(), 'ID': member.staff_id or ''})
+    
+    df_cast = pd.DataFrame(cast_list)
+    
+    # Записываем основную информацию
+    output.write("=== ОСНОВНАЯ ИНФОРМАЦИЯ ===\n")
+    df_main.to_csv(output, index=False, encoding='utf-8')
+    
+    output.write("\n=== АКТЕРЫ И СЪЕМОЧНАЯ ГРУППА ===\n")
+    df_cast.to_csv(output, index=False, encoding='utf-8')
+    
+    content = output.getvalue()
+    output.close()
+    
+    # Возвращаем с UTF-8 BOM для корректного отображения
+    return io.BytesIO(('\ufeff' + content).encode('utf-8'))
+
+
+# Parquet: число строк в группе (столько записей держится в памяти)
+PARQUET_ROW_GROUP = 10000
+
+
+def _arrow():
+    """pyarrow импортируется только при колоночном экспорте"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Для экспорта в Parquet установите pyarrow: pip install pyarrow')
+    return pa, pq
+
+
+def film_schema(pa, with_cast=False):
+    """Схема таблицы фильмов: числа, даты и списки вместо строк для отображения"""
+    fields = [
+        ('film_id', pa.int64()),
+        ('name_ru', pa.string()),
+        ('name_original', pa.string()),
+        ('year', pa.int32()),
+        ('genres', pa.list_(pa.string())),
+        ('countries', pa.list_(pa.string())),
+        ('rating_imdb', pa.float64()),
+        ('rating_kinopoisk', pa.float64()),
+        ('vote_count', pa.int64()),
+        ('description', pa.string()),
+        ('duration', pa.int32()),
+    ]
+    for key in ('budget', 'world', 'russia', 'usa'):
+        fields.append((f'{key}_amount', pa.int64()))
+        fields.append((f'{key}_currency', pa.dictionary(pa.int8(), pa.string())))
+    fields += [
+        ('premiere_rf', pa.date32()),
+        ('premiere_world', pa.date32()),
+        ('fetched_at', pa.timestamp('s', tz='UTC')),
+    ]
+    if with_cast:
+        fields.append(('cast', pa.list_(pa.struct([('name', pa.string()), ('staff_id', pa.int64())]))))
+    return pa.schema(fields)
+
+
+def cast_schema(pa):
+    return pa.schema([
+        ('film_id', pa.int64()),
+        ('name', pa.string()),
+        ('staff_id', pa.int64()),
+    ])
+
+
+def _arrow_row(film):
+    """Словарь значений FilmRecord для Arrow: даты — объекты date/datetime"""
+    row = {name: getattr(film, name) for name in FilmRecord.__slots__ if name != 'cast'}
+    row['genres'] = list(film.genres)
+    row['countries'] = list(film.countries)
+    for key in ('premiere_rf', 'premiere_world'):
+        if row[key]:
+            row[key] = date.fromisoformat(row[key])
+    if row['fetched_at']:
+        row['fetched_at'] = datetime.fromisoformat(row['fetched_at'])
+    return row
+
+
+def _chunks(films, size=PARQUET_ROW_GROUP):
+    """Группы по size фильмов"""
+    chunk = []
+    for film in films:
+        chunk.append(film)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _tables(pa, chunk):
+    films = pa.Table.from_pylist([_arrow_row(film) for film in chunk], schema=film_schema(pa))
+    cast = [{'film_id': film.film_id, 'name': member.name, 'staff_id': member.staff_id}
+            for film in chunk for member in film.cast]
+    return films, pa.Table.from_pylist(cast, schema=cast_schema(pa))
+
+
+@instrument('kinopoisk_export_seconds')
+def export_films_parquet(films, films_path, cast_path):
+    """Пишет фильмы и состав в два файла Parquet группами по PARQUET_ROW_GROUP
+    записей. Возвращает число записанных фильмов."""
+    pa, pq = _arrow()
+    count = 0
+    with pq.ParquetWriter(films_path, film_schema(pa)) as films_writer, \
+            pq.ParquetWriter(cast_path, cast_schema(pa)) as cast_writer:
+        for chunk in _chunks(films):
+            films_table, cast_table = _tables(pa, chunk)
+            films_writer.write_table(films_table)
+            cast_writer.write_table(cast_table)
+            count += len(chunk)
+    return count
+
+
+@instrument('kinopoisk_export_seconds')
+def create_parquet_file(film):
+    """Parquet для одного фильма: состав хранится во вложенном столбце cast"""
+    pa, pq = _arrow()
+    row = _arrow_row(film)
+    row['cast'] = [{'name': member.name, 'staff_id': member.staff_id} for member in film.cast]
+    output = io.BytesIO()
+    pq.write_table(pa.Table.from_pylist([row], schema=film_schema(pa, with_cast=True)), output)
+    output.seek(0)
+    return output
+
+
+@instrument('kinopoisk_export_seconds')
+def append_to_dataset(films, root):
+    """Дописывает фильмы в локальный набор данных Parquet.
+
+    Набор лежит в root/films и root/cast и разбит на партиции по дате загрузки
+    (fetched_date=ГГГГ-ММ-ДД). Каждый вызов добавляет новые файлы, не трогая
+    существующие. Возвращает число добавленных фильмов."""
+    pa, pq = _arrow()
+    count = 0
+    for chunk in _chunks(films):
+        films_table, cast_table = _tables(pa, chunk)
+        fetched_date = [(film.fetched_at or '')[:10] or 'unknown' for film in chunk]
+        films_table = films_table.append_column('fetched_date', pa.array(fetched_date, pa.string()))
+        cast_table = cast_table.append_column('fetched_date', pa.array(
+            [day for film, day in zip(chunk, fetched_date) for _ in film.cast], pa.string()))
+        # Уникальное имя файлов, чтобы повторные добавления не перезаписывали старые
+        template = f'part-{uuid.uuid4().hex}-{{i}}.parquet'
+        pq.write_to_dataset(films_table, os.path.join(root, 'films'), partition_cols=['fetched_date'],
+                            basename_template=template)
+        pq.write_to_dataset(cast_table, os.path.join(root, 'cast'), partition_cols=['fetched_date'],
+                            basename_template=template)
+        count += len(chunk)
+    return count
+
+
+def open_dataset(root, table='films'):
+    """Ленивое чтение набора данных: pyarrow.dataset.Dataset, по которому можно
+    делать выборки (to_table(filter=...), scanner) без загрузки всех файлов"""
+    _arrow()
+    import pyarrow.dataset as ds
+    return ds.dataset(os.path.join(root, table), format='parquet', partitioning='hive')
+
+
+def csv_paths(prefix):
+    """Имена файлов CSV для основной информации и состава"""
+    return f'{prefix}_films.csv', f'{prefix}_cast.csv'
+
+
+def parquet_paths(prefix):
+    return f'{prefix}_films.parquet', f'{prefix}_cast.parquet'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Экспорт результатов пакетной обработки')
+    parser.add_argument('input', help='файл JSON Lines из kinopoisk_batch.py')
+    parser.add_argument('--xlsx', help='путь к книге Excel')
+    parser.add_argument('--csv', help='префикс для файлов <префикс>_films.csv и <префикс>_cast.csv')
+    parser.add_argument('--parquet', help='префикс для файлов <префикс>_films.parquet и <префикс>_cast.parquet')
+    parser.add_argument('--dataset', help='каталог набора данных Parquet, в который дописываются фильмы')
+    args = parser.parse_args(argv)
+
+    if not (args.xlsx or args.csv or args.parquet or args.dataset):
+        parser.error('укажите хотя бы один из форматов: --xlsx, --csv, --parquet, --dataset')
+
+    if args.xlsx:
+        count = export_films_xlsx(iter_films(args.input), args.xlsx)
+        print(f"Excel: {count} фильмов → {args.xlsx}")
+    if args.csv:
+        main_path, cast_path = csv_paths(args.csv)
+        count = export_films_csv(iter_films(args.input), main_path, cast_path)
+        print(f"CSV: {count} фильмов → {main_path}, {cast_path}")
+    if args.parquet:
+        films_path, cast_path = parquet_paths(args.parquet)
+        count = export_films_parquet(iter_films(args.input), films_path, cast_path)
+        print(f"Parquet: {count} фильмов → {films_path}, {cast_path}")
+    if args.dataset:
+        count = append_to_dataset(iter_films(args.input), args.dataset)
+        print(f"Набор данных: добавлено {count} фильмов → {args.dataset}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Форматирование значений для отображения и экспорта.
+
+Функции принимают «сырые» значения из API (числа, строки ISO) и
+возвращают строки для интерфейса; пустые значения отображаются как '-'.
+"""
+from datetime import datetime
+
+CURRENCY_SYMBOLS = {
+    'USD': '$', 'RUB': '₽', 'EUR': '€', 'GBP': '£',
+    'CNY': '¥', 'JPY': '¥', 'KZT': '₸', 'UAH': '₴',
+    'BYN': 'Br', 'INR': '₹',
+}
+
+
+def format_money(value):
+    if not value or value == '-' or value is None:
+        return '-'
+    parts = str(value).split()
+    if not parts or not parts[0].replace(',', '').replace(' ', '').isdigit():
+        return value
+    try:
+        num = int(parts[0].replace(' ', '').replace(',', ''))
+        currency = parts[1] if len(parts) > 1 and parts[1] else 'USD'
+        formatted = f"{num:,}".replace(",", " ")
+        return f"{formatted} {currency}".strip()
+    except Exception as e:
+        return value
+
+def format_date(date_str):
+    if not date_str or date_str == '-':
+        return '-'
+    try:
+        dt = datetime.strptime(date_str[:10], '%Y-%m-%d')
+        return dt.strftime('%d.%m.%Y')
+    except Exception as e:
+        return date_str
+
+def format_duration(duration):
+    """Форматирует продолжительность в минутах"""
+    if not duration or duration == '-' or duration is None:
+        return '-'
+    try:
+        minutes = int(duration)
+        if minutes <= 0:
+            return '-'
+        return str(minutes)
+    except (ValueError, TypeError):
+        return str(duration) if duration else '-'
+
+def format_vote_count(vote_count):
+    """Форматирует количество голосов"""
+    if not vote_count or vote_count == '-' or vote_count is None:
+        return '-'
+    try:
+        count = int(vote_count)
+        if count <= 0:
+            return '-'
+        # Форматируем с разделителями тысяч
+        return f"{count:,}".replace(",", " ")
+    except (ValueError, TypeError):
+        return str(vote_count) if vote_count else '-'
+
+def format_amount(amount, currency):
+    """Сумма с разделителями тысяч и символом валюты (1 000 000 $)"""
+    if not amount:
+        return '-'
+    symbol = CURRENCY_SYMBOLS.get(currency, currency) or ''
+    return f"{int(amount):,} {symbol}".replace(",", " ").strip()
+
+def safe(val):
+    return '-' if val is None or val == '' else val
@@ -0,0 +1,106 @@
+"""Общий HTTP-клиент с пулом keep-alive соединений.
+
+Все запросы к API идут через одну requests.Session на процесс, поэтому
+соединения с хостом переиспользуются, и TCP+TLS handshake выполняется
+только при открытии нового соединения. Адаптер считает запросы и новые
+соединения и замеряет время их установки.
+"""
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Размер пула соединений к одному хосту. Пакетная обработка держит до
+# workers * 4 одновременных запросов, лишние соединения закрываются после ответа
+POOL_SIZE = int(os.environ.get('KINOPOISK_HTTP_POOL_SIZE', 32))
+
+
+class ConnectionStats:
+    """Счетчики запросов и новых соединений"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.handshake_time = 0.0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connect(self, seconds):
+        with self._lock:
+            self.connections += 1
+            self.handshake_time += seconds
+
+    def snapshot(self):
+        with self._lock:
+            requests_count, connections, handshake_time = self.requests, self.connections, self.handshake_time
+        return {
+            'requests': requests_count,
+            'connections': connections,
+            # Доля запросов, ушедших по уже открытому соединению
+            'reuse_ratio': 1 - connections / requests_count if requests_count else 0.0,
+            'avg_handshake_ms': handshake_time / connections * 1000 if connections else 0.0,
+            'handshake_time': handshake_time,
+        }
+
+
+def _instrumented_pool(pool_cls, conn_cls, stats):
+    """Подкласс пула urllib3, замеряющий установку каждого соединения"""
+
+    class Connection(conn_cls):
+        def connect(self):
+            started = time.perf_counter()
+            super().connect()
+            stats.record_connect(time.perf_counter() - started)
+
+    return type(pool_cls.__name__, (pool_cls,), {'ConnectionCls': Connection})
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """HTTPAdapter, собирающий статистику переиспользования соединений"""
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _instrumented_pool(HTTPConnectionPool, HTTPConnection, self.stats),
+            'https': _instrumented_pool(HTTPSConnectionPool, HTTPSConnection, self.stats),
+        }
+
+    def send(self, request, **kwargs):
+        self.stats.record_request()
+        return super().send(request, **kwargs)
+
+
+connection_stats = ConnectionStats()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(stats=connection_stats, pool_size=POOL_SIZE):
+    session = requests.Session()
+    # Повторы делает ограничитель частоты, у адаптера они выключены
+    adapter = InstrumentedAdapter(stats, pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    """Общая для процесса сессия (потокобезопасна для запросов без cookies)"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
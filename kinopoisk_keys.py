@@ -0,0 +1,168 @@
+"""Пул API-ключей с балансировкой нагрузки и автоматическим отключением.
+
+Запросы распределяются между ключами пропорционально остатку суточной
+квоты и обратно пропорционально недавней задержке ответа. Ключ, получивший
+401, выводится из ротации насовсем, 402 — до сброса квоты, 429 — на время
+паузы. Поскольку у каждого ключа свой ограничитель частоты, пропускная
+способность растет примерно линейно с числом ключей.
+"""
+import random
+import threading
+import time
+
+from kinopoisk_ratelimit import ApiLimitError, QuotaExceededError, get_limiter
+
+# Сглаживание задержки (EWMA) и начальная оценка для нового ключа, секунды
+LATENCY_ALPHA = 0.2
+INITIAL_LATENCY = 0.5
+
+# Пауза для ключа после 429, если сервер не прислал Retry-After
+COOLDOWN_429 = 5.0
+
+
+class KeyStats:
+    """Статистика одного ключа"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latency = INITIAL_LATENCY
+        self.cooldown_until = 0.0
+        # До сброса суточной квоты после 402 (и при квоте без лимита)
+        self.exhausted_until = 0.0
+        self.disabled = None  # причина отключения
+
+
+class KeyPool:
+    """Набор API-ключей, используемый вместо одного ключа в функциях запроса"""
+
+    def __init__(self, keys):
+        self.keys = list(dict.fromkeys(k.strip() for k in keys if k and k.strip()))
+        if not self.keys:
+            raise ValueError('Пул API-ключей пуст')
+        self.stats = {key: KeyStats() for key in self.keys}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def acquire(self):
+        """Выбирает ключ для следующего запроса.
+
+        Если все ключи исчерпали квоту, бросает QuotaExceededError с ближайшим
+        моментом сброса; если все ключи отключены — ApiLimitError"""
+        now = time.time()
+        with self._lock:
+            candidates = []
+            cooling = []
+            reset_at = []
+            for key in self.keys:
+                stats = self.stats[key]
+                if stats.disabled:
+                    continue
+                if stats.exhausted_until > now:
+                    reset_at.append(stats.exhausted_until)
+                    continue
+                quota = get_limiter(key).quota
+                remaining = quota.remaining()
+                if remaining == 0:
+                    reset_at.append(quota.reset_at())
+                    continue
+                if stats.cooldown_until > now:
+                    cooling.append((stats.cooldown_until, key))
+                    continue
+                share = remaining / quota.limit if remaining is not None else 1.0
+                candidates.append((key, share / stats.latency))
+
+        if candidates:
+            keys, weights = zip(*candidates)
+            return random.choices(keys, weights=weights)[0]
+        if cooling:
+            # Все живые ключи на паузе после 429: берем тот, что освободится
+            # раньше, его ограничитель сам выдержит паузу
+            return min(cooling)[1]
+        if reset_at:
+            raise QuotaExceededError('Суточная квота исчерпана у всех API-ключей', min(reset_at))
+        raise ApiLimitError('Нет рабочих API-ключей: все ключи отключены')
+
+    def report(self, key, status_code, latency, retry_after=None):
+        """Учитывает результат запроса; выводит ключ из ротации при 401/402/429"""
+        with self._lock:
+            stats = self.stats[key]
+            stats.requests += 1
+            stats.latency += LATENCY_ALPHA * (latency - stats.latency)
+            if status_code == 401:
+                stats.errors += 1
+                stats.disabled = 'неверный ключ (401)'
+            elif status_code == 402:
+                stats.errors += 1
+                quota = get_limiter(key).quota
+                quota.exhaust()
+                # При KINOPOISK_DAILY_QUOTA=0 счетчик квоты не ограничен, поэтому
+                # ключ исключается из ротации отдельно
+                stats.exhausted_until = quota.reset_at()
+            elif status_code == 429:
+                stats.errors += 1
+                try:
+                    delay = float(retry_after) if retry_after else COOLDOWN_429
+                except ValueError:
+                    delay = COOLDOWN_429
+                stats.cooldown_until = time.time() + delay
+
+    def enable(self, key):
+        with self._lock:
+            self.stats[key].disabled = None
+            self.stats[key].cooldown_until = 0.0
+            self.stats[key].exhausted_until = 0.0
+
+    def usage(self):
+        """Статистика по ключам для отображения"""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for key in self.keys:
+                stats = self.stats[key]
+                remaining = get_limiter(key).quota.remaining()
+                if stats.exhausted_until > now:
+                    remaining = 0
+                if stats.disabled:
+                    state = f'отключен: {stats.disabled}'
+                elif remaining == 0:
+                    state = 'квота исчерпана'
+                elif stats.cooldown_until > now:
+                    state = f'пауза {stats.cooldown_until - now:.0f} с'
+                else:
+                    state = 'активен'
+                rows.append({
+                    'Ключ': mask_key(key),
+                    'Запросов': stats.requests,
+                    'Ошибок': stats.errors,
+                    'Задержка (мс)': round(stats.latency * 1000),
+                    'Осталось квоты': '∞' if remaining is None else remaining,
+                    'Состояние': state,
+                })
+        return rows
+
+
+def mask_key(key):
+    return key if len(key) <= 8 else f'{key[:4]}…{key[-4:]}'
+
+
+def parse_keys(text):
+    """Разбирает ключи, разделенные переводами строк, запятыми или пробелами"""
+    return [k for k in text.replace(',', ' ').split() if k]
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_key_pool(keys):
+    """Общий для процесса пул для данного набора ключей (статистика и
+    отключенные ключи сохраняются между перезапусками страницы)"""
+    keys = tuple(dict.fromkeys(keys))
+    with _pools_lock:
+        pool = _pools.get(keys)
+        if pool is None:
+            pool = _pools[keys] = KeyPool(keys)
+        return pool
@@ -0,0 +1,228 @@
+"""Метрики производительности в памяти процесса.
+
+Запросы к API, разбор ответов, функции загрузки и экспорта отчитываются в
+общий реестр metrics: счетчики (статусы HTTP, попадания в кэш, повторы) и
+гистограммы (время, размер ответов). Кроме агрегатов реестр хранит последние
+события с ID фильма, по которым видно, куда ушло время при загрузке одного
+фильма. Реестр выгружается в текстовом формате Prometheus или в JSON Lines.
+"""
+import functools
+import inspect
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Границы корзин гистограмм: время, секунды, и размер, байты
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Сколько последних событий хранить; KINOPOISK_METRICS=0 отключает сбор
+MAX_EVENTS = 5000
+METRICS_ENABLED = os.environ.get('KINOPOISK_METRICS', '1') != '0'
+
+# Описания метрик: имя → (тип, описание, корзины)
+METRICS = {
+    'kinopoisk_api_requests_total': ('counter', 'Ответы API по эндпоинтам и статусам HTTP', None),
+    'kinopoisk_api_request_seconds': ('histogram', 'Время HTTP-запроса к API', TIME_BUCKETS),
+    'kinopoisk_api_response_bytes': ('histogram', 'Размер ответа API', SIZE_BUCKETS),
+    'kinopoisk_api_json_seconds': ('histogram', 'Время разбора JSON ответа', TIME_BUCKETS),
+    'kinopoisk_api_cache_total': ('counter', 'Обращения к кэшу ответов (hit/miss)', None),
+    'kinopoisk_api_retries_total': ('counter', 'Повторы запросов по причинам', None),
+    'kinopoisk_api_deduplicated_total': ('counter', 'Запросы, получившие ответ одновременного одинакового запроса', None),
+    'kinopoisk_snapshot_records_total': ('counter', 'Ответы API, записанные в архив', None),
+    'kinopoisk_snapshot_bytes': ('histogram', 'Размер сжатого ответа в архиве', SIZE_BUCKETS),
+    'kinopoisk_search_total': ('counter', 'Поиски по названию по источнику результата', None),
+    'kinopoisk_search_seconds': ('histogram', 'Время поиска по названию', TIME_BUCKETS),
+    'kinopoisk_scheduler_wait_seconds': ('histogram', 'Ожидание разрешения на запрос к API по приоритетам', TIME_BUCKETS),
+    'kinopoisk_scheduler_queue_depth': ('gauge', 'Запросы к API, ожидающие разрешения, по приоритетам', None),
+    'kinopoisk_fetch_seconds': ('histogram', 'Время функций загрузки данных фильма', TIME_BUCKETS),
+    'kinopoisk_export_seconds': ('histogram', 'Время функций экспорта', TIME_BUCKETS),
+    'kinopoisk_export_stage_seconds': ('histogram', 'Время этапов экспорта', TIME_BUCKETS),
+    'kinopoisk_export_bytes': ('histogram', 'Размер созданных файлов', SIZE_BUCKETS),
+    'kinopoisk_streamlit_rerun_seconds': ('histogram', 'Время выполнения страницы Streamlit', TIME_BUCKETS),
+    'kinopoisk_service_requests_total': ('counter', 'Ответы HTTP-сервиса по маршрутам и статусам', None),
+    'kinopoisk_service_request_seconds': ('histogram', 'Время обработки запроса HTTP-сервисом', TIME_BUCKETS),
+    'kinopoisk_service_coalesced_total': ('counter', 'Запросы сервиса, объединенные с уже идущей загрузкой', None),
+}
+
+
+class _Histogram:
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets):
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class MetricsRegistry:
+    """Счетчики, гистограммы и журнал последних событий"""
+
+    def __init__(self, metrics=METRICS, max_events=MAX_EVENTS):
+        self.metrics = dict(metrics)
+        self.enabled = METRICS_ENABLED
+        self._counters = {}
+        self._histograms = {}
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Текущее значение датчика (gauge); хранится рядом со счетчиками"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = value
+
+    def observe(self, name, value, film_id=None, **labels):
+        """Добавляет значение в гистограмму и событие в журнал"""
+        if not self.enabled:
+            return
+        buckets = self.metrics[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram.counts[i] += 1
+            histogram.count += 1
+            histogram.sum += value
+            histogram.max = max(histogram.max, value)
+            self._events.append({'ts': time.time(), 'metric': name, 'film_id': film_id,
+                                 'labels': labels, 'value': value})
+
+    @contextmanager
+    def timer(self, name, film_id=None, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, film_id, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._events.clear()
+
+    def counters(self):
+        """[(имя, метки, значение)]"""
+        with self._lock:
+            return [(name, dict(labels), value) for (name, labels), value in sorted(self._counters.items())]
+
+    def summary(self):
+        """Строки по гистограммам: число, среднее, оценка p95 по корзинам, максимум"""
+        rows = []
+        with self._lock:
+            items = sorted(self._histograms.items())
+            for (name, labels), h in items:
+                rows.append({
+                    'metric': name,
+                    'labels': dict(labels),
+                    'count': h.count,
+                    'sum': h.sum,
+                    'avg': h.sum / h.count if h.count else 0.0,
+                    'p95': self._quantile(name, h, 0.95),
+                    'max': h.max,
+                })
+        return rows
+
+    def _quantile(self, name, histogram, q):
+        """Верхняя граница корзины, в которую попадает квантиль q"""
+        target = q * histogram.count
+        for bound, count in zip(self.metrics[name][2], histogram.counts):
+            if count >= target:
+                return min(bound, histogram.max)
+        return histogram.max
+
+    def events(self, film_id=None):
+        with self._lock:
+            events = list(self._events)
+        if film_id is not None:
+            events = [e for e in events if str(e['film_id']) == str(film_id)]
+        return events
+
+    def to_prometheus(self):
+        """Текстовый формат Prometheus"""
+        out = io.StringIO()
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+            series = {}
+            for (name, labels), value in counters:
+                series.setdefault(name, []).append((labels, value))
+            for (name, labels), h in histograms:
+                series.setdefault(name, []).append((labels, (list(h.counts), h.count, h.sum)))
+        for name, items in series.items():
+            kind, description, buckets = self.metrics[name]
+            out.write(f'# HELP {name} {description}\n# TYPE {name} {kind}\n')
+            for labels, value in items:
+                if kind in ('counter', 'gauge'):
+                    out.write(f'{name}{_labels(labels)} {value}\n')
+                    continue
+                counts, count, total = value
+                for bound, bucket_count in zip(buckets, counts):
+                    out.write(f'{name}_bucket{_labels(labels + (("le", repr(float(bound))),))} {bucket_count}\n')
+                out.write(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}\n')
+                out.write(f'{name}_sum{_labels(labels)} {total}\n')
+                out.write(f'{name}_count{_labels(labels)} {count}\n')
+        return out.getvalue()
+
+    def to_json_lines(self):
+        """События журнала и агрегаты, по объекту JSON в строке"""
+        lines = [json.dumps(dict(event, type='event'), ensure_ascii=False) for event in self.events()]
+        lines += [json.dumps({'type': self.metrics[name][0], 'metric': name, 'labels': labels, 'value': value},
+                             ensure_ascii=False) for name, labels, value in self.counters()]
+        lines += [json.dumps(dict(row, type='histogram'), ensure_ascii=False) for row in self.summary()]
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+metrics = MetricsRegistry()
+
+
+def instrument(name):
+    """Декоратор: время вызова функции в гистограмму name (метка function).
+
+    Если первый параметр функции — film_id, событие привязывается к фильму;
+    если функция возвращает файловый объект в памяти, его размер пишется в
+    kinopoisk_export_bytes"""
+    def decorator(func):
+        params = list(inspect.signature(func).parameters)
+        takes_film_id = bool(params) and params[0] == 'film_id'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            film_id = (args[0] if args else kwargs.get('film_id')) if takes_film_id else None
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                metrics.observe(name, time.perf_counter() - started, film_id, function=func.__name__)
+            if hasattr(result, 'getbuffer'):
+                metrics.observe('kinopoisk_export_bytes', result.getbuffer().nbytes, film_id,
+                                function=func.__name__)
+            return result
+        return wrapper
+    return decorator
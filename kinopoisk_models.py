@@ -0,0 +1,170 @@
+"""Типизированная модель записи о фильме.
+
+FilmRecord хранит «сырые» значения из API: числа, коды валют, даты ISO,
+кортежи жанров и стран, состав в виде CastMember. Строки для отображения
+(с '-' вместо пустых значений и разделителями тысяч) строятся только при
+выводе и экспорте через FilmRecord.display().
+
+Классы объявлены со __slots__, а повторяющиеся строки (жанры, страны,
+валюты, имена персон) интернируются, поэтому в памяти помещаются
+результаты пакетной обработки на сотни тысяч фильмов.
+"""
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from kinopoisk_format import (
+    format_amount,
+    format_date,
+    format_duration,
+    format_vote_count,
+    safe,
+)
+
+# Виды сборов, попадающие в запись
+BOXOFFICE_KEYS = ('budget', 'world', 'russia', 'usa')
+
+# Порядок полей FilmRecord.display() (столбцы таблиц экспорта)
+FILM_FIELDS = (
+    'Название (RU)', 'Оригинальное название', 'Год', 'Жанры', 'Страна',
+    'Рейтинг IMDB', 'Рейтинг Кинопоиска', 'Кол-во голосов КП', 'Описание',
+    'Продолжительность (мин)', 'Бюджет', 'Касса (мир)', 'Касса (РФ)', 'Касса (США)',
+    'Премьера в РФ', 'Премьера мировая',
+)
+
+
+def _to_int(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (ValueError, TypeError):
+        return None
+
+def _to_float(value):
+    try:
+        return float(value) if value not in (None, '') else None
+    except (ValueError, TypeError):
+        return None
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@dataclass(slots=True)
+class CastMember:
+    name: str
+    staff_id: int = None
+    # professionKey из API (ACTOR, DIRECTOR, ...) и роль (персонаж) — description
+    profession: str = None
+    role: str = None
+
+    def to_json(self):
+        return [self.name, self.staff_id, self.profession, self.role]
+
+    @classmethod
+    def from_json(cls, item):
+        """Участник из списка to_json"""
+        name, staff_id, profession, role = item
+        return cls(_intern(name), staff_id, _intern(profession), role)
+
+
+@dataclass(slots=True)
+class FilmRecord:
+    film_id: int
+    name_ru: str = None
+    name_original: str = None
+    year: int = None
+    genres: tuple = ()
+    countries: tuple = ()
+    rating_imdb: float = None
+    rating_kinopoisk: float = None
+    vote_count: int = None
+    description: str = None
+    duration: int = None
+    budget_amount: int = None
+    budget_currency: str = None
+    world_amount: int = None
+    world_currency: str = None
+    russia_amount: int = None
+    russia_currency: str = None
+    usa_amount: int = None
+    usa_currency: str = None
+    premiere_rf: str = None
+    premiere_world: str = None
+    fetched_at: str = None
+    cast: tuple = ()
+
+    @classmethod
+    def from_bundle(cls, film_id, bundle):
+        """Запись из результата kinopoisk_api.fetch_film_bundle"""
+        data = bundle['data'] or {}
+        record = cls(
+            film_id=int(film_id),
+            name_ru=data.get('nameRu'),
+            name_original=data.get('nameOriginal'),
+            year=_to_int(data.get('year')),
+            genres=tuple(_intern(g['genre']) for g in data.get('genres') or [] if g.get('genre')),
+            countries=tuple(_intern(c['country']) for c in data.get('countries') or [] if c.get('country')),
+            rating_imdb=_to_float(data.get('ratingImdb')),
+            rating_kinopoisk=_to_float(data.get('ratingKinopoisk')),
+            vote_count=_to_int(data.get('ratingKinopoiskVoteCount')),
+            description=data.get('description'),
+            duration=_to_int(data.get('filmLength')),
+            fetched_at=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            cast=tuple(bundle['cast']),
+        )
+        amounts = bundle['boxoffice_amounts']
+        for key in BOXOFFICE_KEYS:
+            amount, currency = amounts.get(key, (None, None))
+            amount = _to_int(amount)
+            setattr(record, f'{key}_amount', amount)
+            setattr(record, f'{key}_currency', _intern(currency) if amount else None)
+        premiere_rf, premiere_world = bundle['premiere_dates']
+        record.premiere_rf = premiere_rf[:10] if premiere_rf else None
+        record.premiere_world = premiere_world[:10] if premiere_world else None
+        return record
+
+    def to_json(self):
+        """Словарь для JSON Lines: значения как есть, состав — списки
+        [имя, staffId, профессия, роль]"""
+        data = {name: getattr(self, name) for name in self.__slots__ if name != 'cast'}
+        data['genres'] = list(self.genres)
+        data['countries'] = list(self.countries)
+        data['cast'] = [member.to_json() for member in self.cast]
+        return data
+
+    @classmethod
+    def from_json(cls, data):
+        """Запись из словаря to_json (или None для записей без данных)"""
+        if 'name_ru' not in data:
+            return None
+        fields = {name: data.get(name) for name in cls.__slots__ if name not in ('genres', 'countries', 'cast')}
+        fields['film_id'] = int(data['film_id'])
+        for key in BOXOFFICE_KEYS:
+            fields[f'{key}_currency'] = _intern(fields[f'{key}_currency'])
+        return cls(
+            genres=tuple(_intern(g) for g in data.get('genres') or ()),
+            countries=tuple(_intern(c) for c in data.get('countries') or ()),
+            cast=tuple(CastMember.from_json(item) for item in data.get('cast') or ()),
+            **fields,
+        )
+
+    def display(self):
+        """Словарь строк для отображения и экспорта в порядке FILM_FIELDS"""
+        return {
+            'Название (RU)': safe(self.name_ru),
+            'Оригинальное название': safe(self.name_original),
+            'Год': safe(self.year),
+            'Жанры': safe(', '.join(self.genres)),
+            'Страна': safe(', '.join(self.countries)),
+            'Рейтинг IMDB': safe(self.rating_imdb),
+            'Рейтинг Кинопоиска': safe(self.rating_kinopoisk),
+            'Кол-во голосов КП': format_vote_count(self.vote_count),
+            'Описание': safe(self.description),
+            'Продолжительность (мин)': format_duration(self.duration),
+            'Бюджет': format_amount(self.budget_amount, self.budget_currency),
+            'Касса (мир)': format_amount(self.world_amount, self.world_currency),
+            'Касса (РФ)': format_amount(self.russia_amount, self.russia_currency),
+            'Касса (США)': format_amount(self.usa_amount, self.usa_currency),
+            'Премьера в РФ': format_date(self.premiere_rf),
+            'Премьера мировая': format_date(self.premiere_world),
+        }
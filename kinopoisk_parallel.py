@@ -0,0 +1,229 @@
+"""Параллельный экспорт больших результатов пакетной обработки.
+
+Файл JSON Lines делится на участки по байтам (границы выравниваются по
+строкам), и каждый участок обрабатывается в отдельном процессе: разбор
+записей, очистка значений и запись в файл-часть. Основной процесс только
+склеивает части:
+
+    CSV      части без заголовка дописываются в итоговые файлы байтами
+    Parquet  группы строк частей переписываются в один файл
+    Excel    каждая часть — отдельная книга <префикс>-<N>.xlsx (xlsxwriter
+             пишет одну книгу в один поток); лист, переполнивший лимит строк
+             Excel, продолжается на следующем листе той же книги
+
+    python kinopoisk_parallel.py films.jsonl --csv films --parquet films --xlsx films --workers 8
+
+Время экспорта уменьшается примерно пропорционально числу ядер. При
+workers=1 участки обрабатываются в текущем процессе.
+"""
+import argparse
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+from kinopoisk_export import (
+    CAST_COLUMNS,
+    MAIN_COLUMNS,
+    _arrow,
+    _chunks,
+    _tables,
+    cast_csv_rows,
+    cast_schema,
+    csv_paths,
+    export_films_xlsx,
+    film_csv_row,
+    film_from_line,
+    film_schema,
+    parquet_paths,
+)
+from kinopoisk_metrics import instrument
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Участков на процесс: небольшой запас выравнивает нагрузку, если фильмы
+# в разных частях файла обрабатываются с разной скоростью
+SHARDS_PER_WORKER = 4
+
+
+def shard_ranges(path, shards):
+    """Границы участков файла [(начало, конец)] в байтах"""
+    size = os.path.getsize(path)
+    shards = max(min(shards, size), 1)
+    bounds = [size * i // shards for i in range(shards + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def iter_range(path, start, end):
+    """FilmRecord из строк, которые начинаются в [start, end)"""
+    with open(path, 'rb') as f:
+        if start:
+            # Строка, начатая до start, принадлежит предыдущему участку
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            film = film_from_line(line)
+            if film is not None:
+                yield film
+
+
+# Обработка участков (выполняется в процессах пула)
+
+def _csv_shard(path, start, end, main_part, cast_part):
+    count = 0
+    with open(main_part, 'w', encoding='utf-8', newline='') as main_file, \
+            open(cast_part, 'w', encoding='utf-8', newline='') as cast_file:
+        main = csv.writer(main_file, delimiter=';', quoting=csv.QUOTE_ALL)
+        cast = csv.writer(cast_file, delimiter=';', quoting=csv.QUOTE_ALL)
+        for film in iter_range(path, start, end):
+            main.writerow(film_csv_row(film))
+            cast.writerows(cast_csv_rows(film))
+            count += 1
+    return count
+
+
+def _parquet_shard(path, start, end, films_part, cast_part):
+    pa, pq = _arrow()
+    count = 0
+    with pq.ParquetWriter(films_part, film_schema(pa)) as films_writer, \
+            pq.ParquetWriter(cast_part, cast_schema(pa)) as cast_writer:
+        for chunk in _chunks(iter_range(path, start, end)):
+            films_table, cast_table = _tables(pa, chunk)
+            films_writer.write_table(films_table)
+            cast_writer.write_table(cast_table)
+            count += len(chunk)
+    return count
+
+
+def _xlsx_shard(path, start, end, output):
+    return export_films_xlsx(iter_range(path, start, end), output)
+
+
+def _run_shards(task, jobs, workers, progress):
+    """task(*args) для каждого набора аргументов из jobs; результаты в порядке jobs"""
+    results = [None] * len(jobs)
+    if progress:
+        progress(0, len(jobs))
+    if workers <= 1:
+        for i, args in enumerate(jobs):
+            results[i] = task(*args)
+            if progress:
+                progress(i + 1, len(jobs))
+        return results
+    # spawn, а не fork: экспорт запускается и из многопоточного сервера Streamlit
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+        futures = {pool.submit(task, *args): i for i, args in enumerate(jobs)}
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if progress:
+                progress(done, len(jobs))
+    return results
+
+
+def _concat(parts, output, header):
+    """Итоговый CSV: BOM, заголовок и части подряд"""
+    with open(output, 'w', encoding='utf-8-sig', newline='') as f:
+        csv.writer(f, delimiter=';', quoting=csv.QUOTE_ALL).writerow(header)
+    with open(output, 'ab') as out:
+        for part in parts:
+            with open(part, 'rb') as f:
+                shutil.copyfileobj(f, out, 1024 * 1024)
+
+
+@instrument('kinopoisk_export_seconds')
+def export_csv_parallel(path, main_path, cast_path, workers=DEFAULT_WORKERS, progress=None):
+    """Как export_films_csv, но участками в пуле процессов. Возвращает число
+    фильмов; progress(done, total) — по обработанным участкам"""
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(main_path))) as tmp:
+        ranges = shard_ranges(path, workers * SHARDS_PER_WORKER)
+        jobs = [(path, start, end, os.path.join(tmp, f'main-{i}.csv'), os.path.join(tmp, f'cast-{i}.csv'))
+                for i, (start, end) in enumerate(ranges)]
+        counts = _run_shards(_csv_shard, jobs, workers, progress)
+        _concat([job[3] for job in jobs], main_path, MAIN_COLUMNS)
+        _concat([job[4] for job in jobs], cast_path, CAST_COLUMNS)
+    return sum(counts)
+
+
+@instrument('kinopoisk_export_seconds')
+def export_parquet_parallel(path, films_path, cast_path, workers=DEFAULT_WORKERS, progress=None):
+    """Как export_films_parquet, но участками в пуле процессов: группы строк
+    частей переносятся в итоговые файлы без изменений. Возвращает число фильмов"""
+    _, pq = _arrow()
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(films_path))) as tmp:
+        ranges = shard_ranges(path, workers * SHARDS_PER_WORKER)
+        jobs = [(path, start, end, os.path.join(tmp, f'films-{i}.parquet'), os.path.join(tmp, f'cast-{i}.parquet'))
+                for i, (start, end) in enumerate(ranges)]
+        counts = _run_shards(_parquet_shard, jobs, workers, progress)
+        for output, column in ((films_path, 3), (cast_path, 4)):
+            # Схема — как у прочитанных частей (единицы времени после записи в Parquet)
+            with pq.ParquetWriter(output, pq.read_schema(jobs[0][column])) as writer:
+                for job in jobs:
+                    with pq.ParquetFile(job[column]) as part:
+                        for group in range(part.num_row_groups):
+                            writer.write_table(part.read_row_group(group))
+    return sum(counts)
+
+
+def xlsx_paths(prefix, parts):
+    """Имена книг: <префикс>.xlsx для одной части, иначе <префикс>-<N>.xlsx"""
+    if parts == 1:
+        return [f'{prefix}.xlsx']
+    return [f'{prefix}-{i:0{len(str(parts))}d}.xlsx' for i in range(1, parts + 1)]
+
+
+@instrument('kinopoisk_export_seconds')
+def export_xlsx_parallel(path, prefix, workers=DEFAULT_WORKERS, progress=None):
+    """Пишет фильмы в workers книг Excel параллельно (по книге на участок
+    файла). Возвращает (число фильмов, пути книг); пустые книги не остаются"""
+    ranges = shard_ranges(path, workers)
+    outputs = xlsx_paths(prefix, len(ranges))
+    counts = _run_shards(_xlsx_shard, [(path, start, end, output) for (start, end), output in zip(ranges, outputs)],
+                         workers, progress)
+    paths = []
+    for output, count in zip(outputs, counts):
+        if count or len(outputs) == 1:
+            paths.append(output)
+        else:
+            os.remove(output)
+    return sum(counts), paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Параллельный экспорт результатов пакетной обработки')
+    parser.add_argument('input', help='файл JSON Lines из kinopoisk_batch.py')
+    parser.add_argument('--csv', help='префикс для файлов <префикс>_films.csv и <префикс>_cast.csv')
+    parser.add_argument('--parquet', help='префикс для файлов <префикс>_films.parquet и <префикс>_cast.parquet')
+    parser.add_argument('--xlsx', help='префикс для книг Excel (по книге на процесс)')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'число процессов (по умолчанию {DEFAULT_WORKERS})')
+    args = parser.parse_args(argv)
+
+    if not (args.csv or args.parquet or args.xlsx):
+        parser.error('укажите хотя бы один из форматов: --csv, --parquet, --xlsx')
+
+    if args.csv:
+        started = time.perf_counter()
+        main_path, cast_path = csv_paths(args.csv)
+        count = export_csv_parallel(args.input, main_path, cast_path, args.workers)
+        print(f"CSV: {count} фильмов за {time.perf_counter() - started:.1f} с → {main_path}, {cast_path}")
+    if args.parquet:
+        started = time.perf_counter()
+        films_path, cast_path = parquet_paths(args.parquet)
+        count = export_parquet_parallel(args.input, films_path, cast_path, args.workers)
+        print(f"Parquet: {count} фильмов за {time.perf_counter() - started:.1f} с → {films_path}, {cast_path}")
+    if args.xlsx:
+        started = time.perf_counter()
+        count, paths = export_xlsx_parallel(args.input, args.xlsx, args.workers)
+        print(f"Excel: {count} фильмов за {time.perf_counter() - started:.1f} с → {', '.join(paths)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
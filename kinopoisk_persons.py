@@ -0,0 +1,234 @@
+"""Индекс персон по результатам пакетной обработки.
+
+Каждая персона хранится один раз, сколько бы фильмов у нее ни было:
+staffId → имя и набор профессий. Связи фильм → (staffId, профессия, роль)
+и обратные персона → фильмы лежат в целочисленных массивах (array), поэтому
+индекс по 100 тыс. фильмов занимает немного памяти, а выборки вида «все
+фильмы с этим актером» выполняются без просмотра всех фильмов:
+
+    python kinopoisk_persons.py films.jsonl --csv persons --parquet persons
+    python kinopoisk_persons.py films.jsonl --films-with 7836 --profession ACTOR
+
+Экспорт состоит из двух таблиц: персоны (staffId, имя, профессии, число
+фильмов) и связи (ID фильма, staffId, профессия, роль).
+"""
+import argparse
+import csv
+import sys
+from array import array
+
+from kinopoisk_export import _arrow, _chunks, clean_csv_value, iter_films
+from kinopoisk_metrics import instrument
+
+PERSONS_COLUMNS = ('ID', 'Имя', 'Профессии', 'Фильмов')
+CREDITS_COLUMNS = ('ID фильма', 'ID', 'Профессия', 'Роль')
+
+
+class PersonIndex:
+    """Персоны и их участие в фильмах.
+
+    Профессии кодируются номерами в self.professions; у персоны набор
+    профессий — битовая маска. Участники без staffId в индекс не попадают."""
+
+    def __init__(self):
+        self.professions = []
+        self._profession_codes = {}
+        self._names = {}
+        self._masks = {}
+        # staffId → (ID фильмов, коды профессий) — по элементу на связь
+        self._person_films = {}
+        # ID фильма → (staffId, коды профессий, роли или None, если ролей нет)
+        self._film_credits = {}
+
+    def _code(self, profession):
+        code = self._profession_codes.get(profession)
+        if code is None:
+            code = self._profession_codes[profession] = len(self.professions)
+            self.professions.append(profession)
+        return code
+
+    @classmethod
+    def from_films(cls, films):
+        index = cls()
+        for film in films:
+            index.add(film)
+        return index
+
+    def add(self, film):
+        """Добавляет состав FilmRecord (повторное добавление заменяет старый)"""
+        film_id = film.film_id
+        if film_id in self._film_credits:
+            self.remove(film_id)
+        staff_ids = array('q')
+        codes = array('B')
+        roles = []
+        for member in film.cast:
+            staff_id = member.staff_id
+            if staff_id is None:
+                continue
+            code = self._code(member.profession)
+            staff_ids.append(staff_id)
+            codes.append(code)
+            roles.append(member.role)
+            # Имя берется из первого фильма: строки интернированы, копий нет
+            self._names.setdefault(staff_id, member.name)
+            self._masks[staff_id] = self._masks.get(staff_id, 0) | (1 << code)
+            films = self._person_films.get(staff_id)
+            if films is None:
+                films = self._person_films[staff_id] = (array('q'), array('B'))
+            films[0].append(film_id)
+            films[1].append(code)
+        self._film_credits[film_id] = (staff_ids, codes, tuple(roles) if any(roles) else None)
+
+    def remove(self, film_id):
+        """Убирает связи фильма; персоны без фильмов удаляются"""
+        staff_ids, _, _ = self._film_credits.pop(film_id)
+        for staff_id in set(staff_ids):
+            films, codes = self._person_films[staff_id]
+            keep = [i for i, other in enumerate(films) if other != film_id]
+            if not keep:
+                del self._person_films[staff_id], self._names[staff_id], self._masks[staff_id]
+                continue
+            films = array('q', (films[i] for i in keep))
+            codes = array('B', (codes[i] for i in keep))
+            self._person_films[staff_id] = (films, codes)
+            mask = 0
+            for code in codes:
+                mask |= 1 << code
+            self._masks[staff_id] = mask
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, staff_id):
+        return staff_id in self._names
+
+    def film_count(self):
+        return len(self._film_credits)
+
+    def name(self, staff_id):
+        return self._names.get(staff_id)
+
+    def person_professions(self, staff_id):
+        mask = self._masks.get(staff_id, 0)
+        return [p for code, p in enumerate(self.professions) if mask >> code & 1]
+
+    def films_with(self, staff_id, profession=None):
+        """ID фильмов персоны (при заданной профессии — только в ней) в порядке добавления"""
+        films, codes = self._person_films.get(staff_id, ((), ()))
+        if profession is None:
+            return list(dict.fromkeys(films))
+        code = self._profession_codes.get(profession)
+        return list(dict.fromkeys(film_id for film_id, c in zip(films, codes) if c == code))
+
+    def credits(self, film_id):
+        """Состав фильма: список (staffId, профессия, роль)"""
+        staff_ids, codes, roles = self._film_credits.get(film_id, ((), (), None))
+        roles = roles or (None,) * len(staff_ids)
+        return [(staff_id, self.professions[code], role)
+                for staff_id, code, role in zip(staff_ids, codes, roles)]
+
+    def iter_persons(self):
+        """(staffId, имя, профессии, число фильмов) по всем персонам"""
+        for staff_id, name in self._names.items():
+            yield (staff_id, name, self.person_professions(staff_id),
+                   len(set(self._person_films[staff_id][0])))
+
+    def iter_credits(self):
+        """(ID фильма, staffId, профессия, роль) по всем связям"""
+        for film_id in self._film_credits:
+            for credit in self.credits(film_id):
+                yield (film_id,) + credit
+
+
+@instrument('kinopoisk_export_seconds')
+def export_persons_csv(index, persons_path, credits_path):
+    """Пишет персоны и связи в два файла CSV. Возвращает число персон"""
+    with open(persons_path, 'w', encoding='utf-8-sig', newline='') as persons_file, \
+            open(credits_path, 'w', encoding='utf-8-sig', newline='') as credits_file:
+        persons = csv.writer(persons_file, delimiter=';', quoting=csv.QUOTE_ALL)
+        credits = csv.writer(credits_file, delimiter=';', quoting=csv.QUOTE_ALL)
+        persons.writerow(PERSONS_COLUMNS)
+        credits.writerow(CREDITS_COLUMNS)
+        for staff_id, name, professions, count in index.iter_persons():
+            persons.writerow([staff_id, clean_csv_value(name), ', '.join(p or '-' for p in professions), count])
+        for film_id, staff_id, profession, role in index.iter_credits():
+            credits.writerow([film_id, staff_id, profession or '', clean_csv_value(role or '')])
+    return len(index)
+
+
+def persons_schema(pa):
+    return pa.schema([
+        ('staff_id', pa.int64()),
+        ('name', pa.string()),
+        ('professions', pa.list_(pa.string())),
+        ('film_count', pa.int32()),
+    ])
+
+
+def credits_schema(pa):
+    return pa.schema([
+        ('film_id', pa.int64()),
+        ('staff_id', pa.int64()),
+        ('profession', pa.dictionary(pa.int8(), pa.string())),
+        ('role', pa.string()),
+    ])
+
+
+@instrument('kinopoisk_export_seconds')
+def export_persons_parquet(index, persons_path, credits_path):
+    """Пишет персоны и связи в два файла Parquet группами по PARQUET_ROW_GROUP
+    строк. Возвращает число персон"""
+    pa, pq = _arrow()
+    tables = (
+        (persons_path, persons_schema(pa), index.iter_persons()),
+        (credits_path, credits_schema(pa), index.iter_credits()),
+    )
+    for path, schema, rows in tables:
+        with pq.ParquetWriter(path, schema) as writer:
+            for chunk in _chunks(rows):
+                writer.write_table(pa.Table.from_pylist(
+                    [dict(zip(schema.names, row)) for row in chunk], schema=schema))
+    return len(index)
+
+
+def persons_paths(prefix, extension):
+    return f'{prefix}_persons.{extension}', f'{prefix}_credits.{extension}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Индекс персон по результатам пакетной обработки')
+    parser.add_argument('input', help='файл JSON Lines из kinopoisk_batch.py')
+    parser.add_argument('--csv', help='префикс для файлов <префикс>_persons.csv и <префикс>_credits.csv')
+    parser.add_argument('--parquet', help='префикс для файлов <префикс>_persons.parquet и <префикс>_credits.parquet')
+    parser.add_argument('--films-with', type=int, metavar='STAFF_ID', help='вывести ID фильмов персоны')
+    parser.add_argument('--profession', help='профессия для --films-with (ACTOR, DIRECTOR, ...)')
+    args = parser.parse_args(argv)
+
+    if not (args.csv or args.parquet or args.films_with):
+        parser.error('укажите --csv, --parquet или --films-with')
+
+    index = PersonIndex.from_films(iter_films(args.input))
+    print(f"Индекс: {len(index)} персон в {index.film_count()} фильмах", file=sys.stderr)
+    if args.films_with:
+        name = index.name(args.films_with)
+        if name is None:
+            print(f"Персона {args.films_with} не найдена", file=sys.stderr)
+            return 1
+        professions = ', '.join(p or '-' for p in index.person_professions(args.films_with))
+        print(f"{name}: {professions}", file=sys.stderr)
+        for film_id in index.films_with(args.films_with, args.profession):
+            print(film_id)
+    if args.csv:
+        persons_path, credits_path = persons_paths(args.csv, 'csv')
+        count = export_persons_csv(index, persons_path, credits_path)
+        print(f"CSV: {count} персон → {persons_path}, {credits_path}", file=sys.stderr)
+    if args.parquet:
+        persons_path, credits_path = persons_paths(args.parquet, 'parquet')
+        count = export_persons_parquet(index, persons_path, credits_path)
+        print(f"Parquet: {count} персон → {persons_path}, {credits_path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
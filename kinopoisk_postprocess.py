@@ -0,0 +1,173 @@
+"""Векторная постобработка результатов пакетной обработки.
+
+Фильмы из файла JSON Lines собираются в таблицу pandas, после чего все
+столбцы приводятся к типам целиком, без обработки значений по одному:
+суммы — Int64, валюты — категории, даты премьер — datetime64. Сборы
+пересчитываются в одну валюту по локальной таблице курсов, а строки для
+отображения строятся только в самом конце (display_frame):
+
+    python kinopoisk_postprocess.py films.jsonl --parquet films_norm.parquet --csv films_norm.csv
+    python kinopoisk_postprocess.py films.jsonl --csv films_rub.csv --currency RUB --rates rates.csv
+
+Файл курсов — CSV со столбцами currency и rate (сколько долларов США стоит
+единица валюты). Без него используются приблизительные курсы DEFAULT_RATES.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from kinopoisk_format import CURRENCY_SYMBOLS
+from kinopoisk_metrics import instrument
+from kinopoisk_models import BOXOFFICE_KEYS, FILM_FIELDS, FilmRecord
+
+# Приблизительные курсы: долларов США за единицу валюты
+DEFAULT_RATES = {
+    'USD': 1.0, 'EUR': 1.08, 'GBP': 1.27, 'RUB': 0.011, 'CNY': 0.14,
+    'JPY': 0.0067, 'KZT': 0.0021, 'UAH': 0.024, 'BYN': 0.31, 'INR': 0.012,
+}
+
+# Столбцы отображения со сборами по BOXOFFICE_KEYS
+BOXOFFICE_FIELDS = dict(zip(BOXOFFICE_KEYS, ('Бюджет', 'Касса (мир)', 'Касса (РФ)', 'Касса (США)')))
+
+_COLUMNS = [name for name in FilmRecord.__slots__ if name != 'cast']
+
+
+def load_rates(path):
+    """Курсы из CSV (currency, rate) поверх DEFAULT_RATES"""
+    table = pd.read_csv(path, sep=None, engine='python')
+    rates = dict(DEFAULT_RATES)
+    rates.update(zip(table['currency'].str.upper().str.strip(), table['rate'].astype(float)))
+    return rates
+
+
+def films_frame(films):
+    """Таблица «сырых» значений FilmRecord (без состава), по столбцу на поле"""
+    columns = {name: [] for name in _COLUMNS}
+    for film in films:
+        for name, values in columns.items():
+            values.append(getattr(film, name))
+    return pd.DataFrame(columns, columns=_COLUMNS)
+
+
+@instrument('kinopoisk_export_seconds')
+def normalize(frame, currency='USD', rates=None):
+    """Приводит столбцы к типам и добавляет суммы в валюте currency.
+
+    Суммы и целые поля — Int64, валюты — category, даты — datetime64, время
+    загрузки — datetime64 UTC. Столбцы <вид>_<валюта> (например, world_usd)
+    содержат пересчитанные суммы; если курса валюты нет, значение пустое"""
+    rates = DEFAULT_RATES if rates is None else rates
+    if currency not in rates:
+        raise ValueError(f'Нет курса для валюты {currency}')
+    frame = frame.copy()
+    frame['film_id'] = frame['film_id'].astype('int64')
+    for name in ('year', 'vote_count', 'duration'):
+        frame[name] = pd.to_numeric(frame[name], errors='coerce').astype('Int64')
+    for name in ('rating_imdb', 'rating_kinopoisk'):
+        frame[name] = pd.to_numeric(frame[name], errors='coerce').astype('float64')
+    for name in ('premiere_rf', 'premiere_world'):
+        frame[name] = pd.to_datetime(frame[name], format='%Y-%m-%d', errors='coerce')
+    frame['fetched_at'] = pd.to_datetime(frame['fetched_at'], utc=True, errors='coerce')
+
+    target = rates[currency]
+    for key in BOXOFFICE_KEYS:
+        amount = pd.to_numeric(frame[f'{key}_amount'], errors='coerce').astype('Int64')
+        codes = frame[f'{key}_currency'].astype('category')
+        # Курс считается один раз на категорию, а не на строку
+        factors = np.array([rates.get(c, np.nan) / target for c in codes.cat.categories] + [np.nan])
+        factor = factors[codes.cat.codes.to_numpy()]
+        frame[f'{key}_amount'] = amount
+        frame[f'{key}_currency'] = codes
+        frame[f'{key}_{currency.lower()}'] = (amount.astype('float64') * factor).round().astype('Int64')
+    return frame
+
+
+def _thousands(values):
+    """Строки целых с пробелом между тысячами; пустые и непозитивные — NaN"""
+    positive = values[(values > 0).fillna(False)].astype('int64')
+    text = pd.Series([f'{value:,}' for value in positive.tolist()], index=positive.index, dtype='string')
+    return text.str.replace(',', ' ', regex=False).reindex(values.index)
+
+
+def _dates(values):
+    """Даты ДД.ММ.ГГГГ; каждая уникальная дата форматируется один раз"""
+    codes, uniques = pd.factorize(values)
+    text = np.append(uniques.strftime('%d.%m.%Y').to_numpy(dtype=object), '-')
+    return pd.Series(text[codes], index=values.index)
+
+
+def _amounts(amount, currency):
+    symbols = currency.cat.rename_categories(
+        [CURRENCY_SYMBOLS.get(c, c) for c in currency.cat.categories]).astype('string')
+    return (_thousands(amount) + ' ' + symbols.fillna('')).str.strip().fillna('-')
+
+
+@instrument('kinopoisk_export_seconds')
+def display_frame(frame, currency='USD'):
+    """Строки для отображения по нормализованной таблице: столбцы FILM_FIELDS
+    (как FilmRecord.display()) и сборы в валюте currency"""
+    def text(values):
+        return values.astype('object').where(values.notna() & (values != ''), '-')
+
+    def joined(values):
+        return values.map(', '.join, na_action='ignore').replace('', '-').fillna('-')
+
+    symbol = CURRENCY_SYMBOLS.get(currency, currency)
+    result = {
+        'ID фильма': frame['film_id'],
+        'Название (RU)': text(frame['name_ru']),
+        'Оригинальное название': text(frame['name_original']),
+        'Год': frame['year'].astype('string').fillna('-'),
+        'Жанры': joined(frame['genres']),
+        'Страна': joined(frame['countries']),
+        'Рейтинг IMDB': frame['rating_imdb'].astype('string').fillna('-'),
+        'Рейтинг Кинопоиска': frame['rating_kinopoisk'].astype('string').fillna('-'),
+        'Кол-во голосов КП': _thousands(frame['vote_count']).fillna('-'),
+        'Описание': text(frame['description']),
+        'Продолжительность (мин)': frame['duration'].where(frame['duration'] > 0).astype('string').fillna('-'),
+        'Премьера в РФ': _dates(frame['premiere_rf']),
+        'Премьера мировая': _dates(frame['premiere_world']),
+    }
+    for key, field in BOXOFFICE_FIELDS.items():
+        result[field] = _amounts(frame[f'{key}_amount'], frame[f'{key}_currency'])
+    display = pd.DataFrame(result, columns=('ID фильма',) + FILM_FIELDS)
+    for key, field in BOXOFFICE_FIELDS.items():
+        converted = _thousands(frame[f'{key}_{currency.lower()}'])
+        display[f'{field}, {symbol}'] = (converted + f' {symbol}').fillna('-')
+    return display
+
+
+def main(argv=None):
+    from kinopoisk_export import iter_films
+
+    parser = argparse.ArgumentParser(description='Нормализация и пересчет сборов для результатов пакетной обработки')
+    parser.add_argument('input', help='файл JSON Lines из kinopoisk_batch.py')
+    parser.add_argument('--parquet', help='типизированная таблица Parquet (нужен pyarrow)')
+    parser.add_argument('--csv', help='таблица CSV со строками для отображения')
+    parser.add_argument('--currency', default='USD', help='валюта пересчета сборов (по умолчанию USD)')
+    parser.add_argument('--rates', help='CSV с курсами: currency, rate (долларов за единицу валюты)')
+    args = parser.parse_args(argv)
+
+    if not (args.parquet or args.csv):
+        parser.error('укажите --parquet или --csv')
+    currency = args.currency.upper()
+    rates = load_rates(args.rates) if args.rates else None
+
+    started = time.perf_counter()
+    frame = normalize(films_frame(iter_films(args.input)), currency, rates)
+    print(f"Нормализовано {len(frame)} фильмов за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+    if args.parquet:
+        frame.assign(genres=frame['genres'].map(list), countries=frame['countries'].map(list)).to_parquet(
+            args.parquet, index=False)
+        print(f"Parquet → {args.parquet}", file=sys.stderr)
+    if args.csv:
+        display_frame(frame, currency).to_csv(args.csv, index=False, sep=';', quoting=1, encoding='utf-8-sig')
+        print(f"CSV → {args.csv}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""Клиентское ограничение частоты запросов и учет суточной квоты API-ключа.
+
+API ограничивает число запросов в секунду и в сутки для каждого X-API-KEY.
+Для каждого ключа заводится свой token bucket и счетчик суточной квоты;
+все запросы к API проходят через get_limiter(api_key).acquire().
+Токены выдаются с учетом приоритета запроса (см. kinopoisk_scheduler):
+фоновые запросы пропускают вперед интерактивные.
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from kinopoisk_scheduler import INTERACTIVE, INTERACTIVE_RESERVE, current_priority, scheduler
+
+# Лимиты по умолчанию (бесплатный тариф); переопределяются переменными окружения
+RATE_LIMIT = float(os.environ.get('KINOPOISK_RATE_LIMIT', 20))  # запросов в секунду
+RATE_BURST = int(os.environ.get('KINOPOISK_RATE_BURST', 20))
+DAILY_QUOTA = int(os.environ.get('KINOPOISK_DAILY_QUOTA', 500))  # 0 — без ограничения
+
+# Сутки для квоты считаем по московскому времени
+QUOTA_TZ = timezone(timedelta(hours=3))
+
+# Повторы при ответе 429
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+
+class ApiLimitError(Exception):
+    """Запрос не выполнен из-за ограничений API; данные фильма неполные"""
+
+
+class RateLimitError(ApiLimitError):
+    """Сервер продолжает отвечать 429 после всех повторов"""
+
+
+class QuotaExceededError(ApiLimitError):
+    """Суточная квота ключа исчерпана"""
+
+    def __init__(self, message, reset_at):
+        super().__init__(message)
+        self.reset_at = reset_at
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity в запасе.
+
+    Фоновые запросы получают токен, только если его не ждет интерактивный
+    запрос и после них в запасе остается reserve токенов"""
+
+    def __init__(self, rate, capacity, reserve=INTERACTIVE_RESERVE):
+        self.rate = rate
+        self.capacity = capacity
+        self.reserve = min(reserve, max(capacity - 1, 0))
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.interactive_waiting = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, priority=INTERACTIVE):
+        """Забирает токен, при необходимости ожидая его появления"""
+        interactive = priority == INTERACTIVE
+        with self._lock:
+            if interactive:
+                self.interactive_waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    need = 1 if interactive else 1 + self.reserve
+                    if self.tokens >= need and (interactive or not self.interactive_waiting):
+                        self.tokens -= 1
+                        return
+                    # Пока ждет интерактивный запрос, фоновые проверяют
+                    # очередь через интервал выдачи одного токена
+                    wait = (need - self.tokens if self.tokens < need else 1) / self.rate
+                time.sleep(wait)
+        finally:
+            if interactive:
+                with self._lock:
+                    self.interactive_waiting -= 1
+
+    def penalize(self, delay):
+        """Откладывает выдачу токенов на delay секунд (после ответа 429)"""
+        with self._lock:
+            # Паузы от одновременных 429 не складываются: берется самая длинная
+            self.tokens = min(self.tokens, -delay * self.rate)
+            self.updated = time.monotonic()
+
+
+class DailyQuota:
+    """Счетчик запросов за текущие сутки"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.day = self._today()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _today():
+        return datetime.now(QUOTA_TZ).date()
+
+    def reset_at(self):
+        """Момент сброса квоты (timestamp)"""
+        tomorrow = datetime.combine(self._today() + timedelta(days=1), datetime.min.time(), QUOTA_TZ)
+        return tomorrow.timestamp()
+
+    def _roll(self):
+        today = self._today()
+        if today != self.day:
+            self.day = today
+            self.used = 0
+
+    def consume(self):
+        with self._lock:
+            self._roll()
+            if self.limit and self.used >= self.limit:
+                raise QuotaExceededError(
+                    f'Суточная квота исчерпана ({self.used}/{self.limit})', self.reset_at())
+            self.used += 1
+
+    def exhaust(self):
+        """Помечает квоту исчерпанной (сервер ответил 402)"""
+        with self._lock:
+            self._roll()
+            self.used = max(self.used, self.limit)
+
+    def remaining(self):
+        with self._lock:
+            self._roll()
+            return max(self.limit - self.used, 0) if self.limit else None
+
+
+class RateLimiter:
+    """Ограничитель для одного API-ключа"""
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST, daily_quota=DAILY_QUOTA):
+        self.bucket = TokenBucket(rate, burst)
+        self.quota = DailyQuota(daily_quota)
+        self.throttled = 0
+
+    def acquire(self):
+        """Ждет разрешения на запрос с приоритетом текущего контекста;
+        QuotaExceededError, если квота исчерпана"""
+        priority = current_priority()
+        with scheduler.queued(priority):
+            self.quota.consume()
+            self.bucket.acquire(priority)
+
+    def backoff(self, attempt, retry_after=None):
+        """Пауза после 429: Retry-After, если сервер его прислал, иначе
+        экспоненциальная задержка со случайным разбросом"""
+        self.throttled += 1
+        delay = None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = None
+        if delay is None:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+        # Ожидание произойдет в следующем acquire(), заодно притормозив и
+        # остальные потоки с этим ключом
+        self.bucket.penalize(delay)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(api_key):
+    """Общий для процесса ограничитель для данного ключа"""
+    with _limiters_lock:
+        limiter = _limiters.get(api_key)
+        if limiter is None:
+            limiter = _limiters[api_key] = RateLimiter()
+        return limiter
@@ -0,0 +1,256 @@
+"""Инкрементальное обновление ранее загруженных фильмов.
+
+Для каждого фильма хранятся последние ответы всех эндпоинтов и их хэши.
+При повторном прогоне заново запрашиваются только часто меняющиеся
+эндпоинты (карточка фильма с рейтингами и числом голосов, кассовые сборы),
+а остальные — только если их ответ старше порога устаревания. Если хэши
+новых ответов совпали с сохраненными, фильм не изменился и ничего не пишется;
+иначе в файл изменений (JSON Lines) добавляется строка с новой записью и
+списком изменившихся полей:
+
+    python kinopoisk_refresh.py ids.txt --api-key KEY --state refresh.sqlite3 --delta delta.jsonl
+
+При первом прогоне состояние пустое, поэтому все фильмы загружаются целиком
+и попадают в файл изменений со статусом 'new'. Прерванный прогон можно
+просто запустить заново: уже обновленные фильмы окажутся без изменений.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+from kinopoisk_api import ENDPOINTS, bundle_from_payloads, fetch_payloads
+from kinopoisk_batch import (
+    DEFAULT_WORKERS,
+    add_key_arguments,
+    api_key_from_args,
+    print_pause,
+    print_progress,
+    process_ids,
+    read_film_ids,
+)
+from kinopoisk_cache import DAY
+from kinopoisk_models import FilmRecord
+from kinopoisk_ratelimit import ApiLimitError, QuotaExceededError
+
+# Эндпоинты, которые запрашиваются при каждом обновлении
+VOLATILE_ENDPOINTS = ('film', 'box_office')
+
+# Остальные эндпоинты запрашиваются, если сохраненный ответ старше, секунды
+DEFAULT_MAX_AGE = 30 * DAY
+
+# Поля записи, не участвующие в сравнении
+IGNORED_FIELDS = ('film_id', 'fetched_at')
+
+
+def payload_hash(status, data):
+    """Хэш ответа, не зависящий от порядка ключей JSON"""
+    raw = json.dumps([status, data], ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class RefreshState:
+    """Последние ответы API по фильмам в SQLite: (фильм, эндпоинт) →
+    статус, сжатый ответ, хэш и время запроса"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS payloads (
+                film_id TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                payload BLOB NOT NULL,
+                hash TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (film_id, endpoint)
+            )
+        """)
+        self._conn.commit()
+
+    def load(self, film_id):
+        """{эндпоинт: (status, data, hash, fetched_at)} для фильма"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT endpoint, status, payload, hash, fetched_at FROM payloads WHERE film_id = ?',
+                (str(film_id),),
+            ).fetchall()
+        return {endpoint: (status, json.loads(zlib.decompress(payload)), digest, fetched_at)
+                for endpoint, status, payload, digest, fetched_at in rows}
+
+    def save(self, film_id, entries):
+        """Сохраняет ответы {эндпоинт: (status, data, hash, fetched_at)} одной транзакцией"""
+        rows = [
+            (str(film_id), endpoint, status,
+             zlib.compress(json.dumps(data, ensure_ascii=False).encode('utf-8')), digest, fetched_at)
+            for endpoint, (status, data, digest, fetched_at) in entries.items()
+        ]
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO payloads VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(DISTINCT film_id) FROM payloads').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def changed_fields(old, new):
+    """{поле: [старое, новое]} для различающихся полей двух FilmRecord"""
+    old_data, new_data = old.to_json(), new.to_json()
+    return {name: [old_data[name], value] for name, value in new_data.items()
+            if name not in IGNORED_FIELDS and old_data[name] != value}
+
+
+def refresh_film(film_id, api_key, state, volatile=VOLATILE_ENDPOINTS, max_age=DEFAULT_MAX_AGE):
+    """Обновляет один фильм.
+
+    Возвращает ((delta, entries), None), где delta — строка файла изменений
+    или None, если фильм не изменился, а entries — ответы для сохранения в
+    состоянии; при ошибке — (None, ошибка)"""
+    now = time.time()
+    stored = state.load(film_id)
+    due = [endpoint for endpoint in ENDPOINTS
+           if endpoint in volatile or endpoint not in stored or now - stored[endpoint][3] > max_age]
+    fetched = fetch_payloads(film_id, api_key, due, use_cache=False)
+
+    entries = {}
+    for endpoint, (status, data) in fetched.items():
+        if status is None:
+            # Сетевая ошибка: остаемся на сохраненном ответе, если он есть
+            if endpoint == 'film' or endpoint not in stored:
+                return None, data
+            continue
+        entries[endpoint] = (status, data, payload_hash(status, data), now)
+    status, data = (entries.get('film') or stored['film'])[:2]
+    if status != 200:
+        return None, f'Ошибка: {status} — {data}'
+
+    changed = [endpoint for endpoint, entry in entries.items()
+               if endpoint not in stored or stored[endpoint][2] != entry[2]]
+    if not changed:
+        return (None, entries), None
+
+    current = {endpoint: entry[:2] for endpoint, entry in stored.items()}
+    current.update({endpoint: entry[:2] for endpoint, entry in entries.items()})
+    film = FilmRecord.from_bundle(film_id, bundle_from_payloads(current))
+    if 'film' not in stored:
+        return ({'film_id': film.film_id, 'status': 'new', 'changed_fields': [], 'changes': {},
+                 'film': film.to_json()}, entries), None
+
+    old = FilmRecord.from_bundle(film_id, bundle_from_payloads(
+        {endpoint: entry[:2] for endpoint, entry in stored.items()}))
+    changes = changed_fields(old, film)
+    if not changes:
+        # Ответ изменился в полях, которые в запись не попадают
+        return (None, entries), None
+    return ({'film_id': film.film_id, 'status': 'changed', 'changed_fields': list(changes),
+             'changes': changes, 'film': film.to_json()}, entries), None
+
+
+def run_refresh(film_ids, api_key, state_path, delta_path, workers=DEFAULT_WORKERS, progress=None,
+                wait_for_quota=True, on_pause=None, volatile=VOLATILE_ENDPOINTS, max_age=DEFAULT_MAX_AGE,
+                switch=None):
+    """Инкрементально обновляет список фильмов.
+
+    Новые и изменившиеся фильмы дописываются в delta_path, ответы API
+    сохраняются в state_path после записи строки изменений. Пауза при
+    исчерпании квоты, progress и switch — как в run_batch.
+    Возвращает словарь со статистикой прогона."""
+    state = RefreshState(state_path)
+    stats = {'total': len(film_ids), 'new': 0, 'changed': 0, 'unchanged': 0, 'failed': 0,
+             'errors': {}, 'stopped': None, 'requests': 0}
+
+    def task(film_id):
+        try:
+            return refresh_film(film_id, api_key, state, volatile, max_age)
+        except QuotaExceededError:
+            raise
+        except ApiLimitError as e:
+            return None, str(e)
+
+    started = time.time()
+    try:
+        with open(delta_path, 'a', encoding='utf-8') as out:
+            def on_result(film_id, result):
+                refreshed, error = result
+                if error:
+                    stats['failed'] += 1
+                    stats['errors'][film_id] = error
+                    return
+                delta, entries = refreshed
+                stats['requests'] += len(entries)
+                if delta is None:
+                    stats['unchanged'] += 1
+                else:
+                    out.write(json.dumps(delta, ensure_ascii=False) + '\n')
+                    out.flush()
+                    stats[delta['status']] += 1
+                state.save(film_id, entries)
+
+            stats['stopped'] = process_ids(film_ids, task, on_result, workers=workers, progress=progress,
+                                           wait_for_quota=wait_for_quota, on_pause=on_pause, switch=switch)
+    finally:
+        state.close()
+
+    stats['elapsed'] = time.time() - started
+    return stats
+
+
+def iter_delta(path):
+    """Строки файла изменений"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Инкрементальное обновление фильмов с Кинопоиска')
+    parser.add_argument('ids', help='файл CSV/TXT со списком ID фильмов')
+    add_key_arguments(parser)
+    parser.add_argument('--state', default='refresh.sqlite3', help='файл состояния с последними ответами API')
+    parser.add_argument('--delta', default='delta.jsonl', help='файл изменений JSON Lines (дописывается)')
+    parser.add_argument('--volatile', default=','.join(VOLATILE_ENDPOINTS),
+                        help=f'эндпоинты, запрашиваемые всегда (из {", ".join(ENDPOINTS)})')
+    parser.add_argument('--max-age-days', type=float, default=DEFAULT_MAX_AGE / DAY,
+                        help='через сколько дней перезапрашивать остальные эндпоинты')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help='число потоков')
+    parser.add_argument('--no-wait-quota', action='store_true',
+                        help='остановиться, а не ждать сброса суточной квоты')
+    args = parser.parse_args(argv)
+
+    volatile = tuple(e.strip() for e in args.volatile.split(',') if e.strip())
+    unknown = [e for e in volatile if e not in ENDPOINTS]
+    if unknown:
+        parser.error(f'неизвестные эндпоинты: {", ".join(unknown)}')
+    api_key = api_key_from_args(parser, args)
+
+    stats = run_refresh(read_film_ids(args.ids), api_key, args.state, args.delta, workers=args.workers,
+                        progress=print_progress, wait_for_quota=not args.no_wait_quota, on_pause=print_pause,
+                        volatile=volatile, max_age=args.max_age_days * DAY)
+    print(f"Готово: новых {stats['new']}, изменилось {stats['changed']}, без изменений {stats['unchanged']}, "
+          f"ошибок {stats['failed']}; запросов к API {stats['requests']} за {stats['elapsed']:.1f} с")
+    if stats['stopped'] == 'quota':
+        print("Остановлено: суточная квота исчерпана, повторный запуск продолжит обновление")
+    for film_id, error in stats['errors'].items():
+        print(f"  {film_id}: {error}", file=sys.stderr)
+    return 1 if stats['failed'] or stats['stopped'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""Приоритеты запросов к API: интерактивные и фоновые.
+
+Интерактивные запросы (загрузка фильма по кнопке, поиск, GET /films/{id})
+и фоновые (пакетная обработка, обновление, POST /films/batch) делят лимит
+частоты одного ключа. Приоритет задается контекстом (contextvars): код
+пакетной обработки выполняется внутри with priority(BATCH), а ограничитель
+частоты (kinopoisk_ratelimit) отдает токен фоновому запросу, только если
+его не ждет интерактивный и в запасе остается INTERACTIVE_RESERVE токенов.
+Поэтому интерактивный запрос во время большого прогона проходит без
+очереди, а фоновые забирают весь остальной лимит.
+
+Отдельный прогон можно приостановить через его PauseSwitch (у каждой
+фоновой задачи свой): уже отправленные запросы завершаются, новые фильмы
+не берутся до resume(); другие прогоны процесса продолжают работу.
+Глубина очереди по приоритетам — scheduler.stats(), время ожидания токена —
+гистограмма kinopoisk_scheduler_wait_seconds.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from kinopoisk_metrics import metrics
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+PRIORITIES = (INTERACTIVE, BATCH)
+
+# Токены ограничителя, которые фоновые запросы оставляют интерактивным
+INTERACTIVE_RESERVE = float(os.environ.get('KINOPOISK_INTERACTIVE_RESERVE', 2))
+
+_priority = contextvars.ContextVar('kinopoisk_priority', default=INTERACTIVE)
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def priority(level):
+    """Запросы к API внутри блока выполняются с приоритетом level"""
+    if level not in PRIORITIES:
+        raise ValueError(f'Неизвестный приоритет: {level}')
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def submit(pool, func, *args):
+    """pool.submit с текущим контекстом: задача в другом потоке получает тот
+    же приоритет, что и вызывающий код"""
+    return pool.submit(contextvars.copy_context().run, func, *args)
+
+
+def call_with_priority(level, func, *args):
+    """func(*args) с приоритетом level (для run_in_executor и потоков)"""
+    with priority(level):
+        return func(*args)
+
+
+class PauseSwitch:
+    """Пауза одного прогона пакетной обработки"""
+
+    def __init__(self):
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def pause(self):
+        """Приостанавливает прогон (с новых фильмов)"""
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def paused(self):
+        return not self._resumed.is_set()
+
+    def wait_resumed(self, timeout=None):
+        """Ждет снятия паузы; True, если пауза снята"""
+        return self._resumed.wait(timeout)
+
+
+class Scheduler:
+    """Учет ожидающих запросов"""
+
+    def __init__(self):
+        self._waiting = dict.fromkeys(PRIORITIES, 0)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def queued(self, level):
+        """Запрос уровня level ждет разрешения внутри блока"""
+        started = time.perf_counter()
+        with self._lock:
+            self._waiting[level] += 1
+            metrics.set('kinopoisk_scheduler_queue_depth', self._waiting[level], priority=level)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._waiting[level] -= 1
+                metrics.set('kinopoisk_scheduler_queue_depth', self._waiting[level], priority=level)
+            metrics.observe('kinopoisk_scheduler_wait_seconds', time.perf_counter() - started, priority=level)
+
+    def waiting(self, level):
+        return self._waiting[level]
+
+    def stats(self):
+        with self._lock:
+            waiting = dict(self._waiting)
+        return {'waiting': waiting}
+
+
+# Общий для процесса планировщик
+scheduler = Scheduler()
@@ -0,0 +1,254 @@
+"""Поиск фильмов по названию.
+
+Локальный индекс названий (nameRu и nameOriginal) строится из уже
+загруженных фильмов: карточек в кэше ответов и прошлых результатов поиска.
+Запрос сначала ищется в префиксном дереве по началу названия или любого его
+слова, затем — нечетко, по общим триграммам (опечатки, пропущенные буквы).
+К API (search-by-keyword) поиск обращается только если локально ничего не
+нашлось; ответ сохраняется в кэше и добавляется в индекс, поэтому повторные
+поиски выполняются без запросов к API:
+
+    python kinopoisk_search.py матрица --api-key KEY
+"""
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+from kinopoisk_api import api_get
+from kinopoisk_cache import get_cache
+from kinopoisk_metrics import metrics
+from kinopoisk_models import _intern, _to_int
+
+# Максимум результатов поиска
+SEARCH_LIMIT = 10
+
+# Минимальное сходство по триграммам (коэффициент Дайса) для нечеткого поиска
+FUZZY_THRESHOLD = 0.35
+
+# Глубина префиксного дерева: более длинные запросы ищутся по первым
+# PREFIX_DEPTH символам и перепроверяются по полному названию
+PREFIX_DEPTH = 12
+
+# Триграммы, которые встречаются больше чем в такой доле названий, не
+# используются для отбора кандидатов нечеткого поиска (только для оценки)
+COMMON_TRIGRAM_SHARE = 0.05
+
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize_title(text):
+    """Нижний регистр, ё → е, знаки препинания — пробелы"""
+    return _NON_WORD.sub(' ', (text or '').lower().replace('ё', 'е')).strip()
+
+
+def _trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@dataclass(slots=True)
+class TitleMatch:
+    film_id: int
+    name_ru: str = None
+    name_original: str = None
+    year: int = None
+
+    def label(self):
+        names = [name for name in (self.name_ru, self.name_original) if name]
+        if len(names) == 2 and names[0] == names[1]:
+            names.pop()
+        title = ' / '.join(names) or '-'
+        return f'{title} ({self.year}), ID {self.film_id}' if self.year else f'{title}, ID {self.film_id}'
+
+
+class TitleIndex:
+    """Индекс названий: префиксное дерево и триграммы.
+
+    Узел дерева — словарь символ → узел; под ключом None лежит множество ID
+    фильмов, у которых с этого места начинается название или одно из его
+    слов (не глубже PREFIX_DEPTH). Потокобезопасен: страница Streamlit и
+    загрузки пишут в общий индекс"""
+
+    def __init__(self):
+        self._films = {}
+        self._trie = {}
+        self._trigrams = {}
+        self._titles = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._films)
+
+    def add(self, film_id, name_ru=None, name_original=None, year=None):
+        film_id = int(film_id)
+        # Название → число его триграмм (для оценки сходства)
+        titles = {title: len(_trigrams(title))
+                  for title in map(normalize_title, (name_ru, name_original)) if title}
+        with self._lock:
+            known = self._films.get(film_id)
+            if known is not None and self._titles[film_id] == titles:
+                # Результаты поиска бывают без года: дополняем уже известную запись
+                known.year = known.year or _to_int(year)
+                return
+            self._films[film_id] = TitleMatch(film_id, _intern(name_ru), _intern(name_original), _to_int(year))
+            # Старые названия фильма остаются в дереве и триграммах; при выдаче
+            # результаты перепроверяются по текущим названиям
+            self._titles[film_id] = titles
+            for title in titles:
+                words = title.split()
+                for i in range(len(words)):
+                    node = self._trie
+                    for char in ' '.join(words[i:])[:PREFIX_DEPTH]:
+                        child = node.get(char)
+                        if child is None:
+                            child = node[char] = {None: set()}
+                        child[None].add(film_id)
+                        node = child
+                for trigram in _trigrams(title):
+                    films = self._trigrams.get(trigram)
+                    if films is None:
+                        films = self._trigrams[trigram] = set()
+                    films.add(film_id)
+
+    def get(self, film_id):
+        return self._films.get(int(film_id))
+
+    def add_film(self, film):
+        """Добавляет FilmRecord"""
+        self.add(film.film_id, film.name_ru, film.name_original, film.year)
+
+    def _prefix(self, query):
+        node = self._trie
+        for char in query[:PREFIX_DEPTH]:
+            node = node.get(char)
+            if node is None:
+                return set()
+        return node.get(None, ())
+
+    def _fuzzy(self, query):
+        query_trigrams = _trigrams(query)
+        postings = [self._trigrams[trigram] for trigram in query_trigrams if trigram in self._trigrams]
+        limit = max(len(self._films) * COMMON_TRIGRAM_SHARE, 100)
+        rare = [films for films in postings if len(films) <= limit]
+        common = [films for films in postings if len(films) > limit]
+        if not rare:
+            rare, common = postings, []
+        shared = {}
+        for films in rare:
+            for film_id in films:
+                shared[film_id] = shared.get(film_id, 0) + 1
+        for films in common:
+            for film_id in shared:
+                if film_id in films:
+                    shared[film_id] += 1
+        scores = {}
+        for film_id, count in shared.items():
+            best = max((2 * count / (len(query_trigrams) + size)
+                        for size in self._titles[film_id].values()), default=0)
+            if best >= FUZZY_THRESHOLD:
+                scores[film_id] = best
+        return scores
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Список TitleMatch: сначала совпадения по началу слов (короткие
+        названия выше), затем нечеткие по убыванию сходства"""
+        query = normalize_title(query)
+        if not query:
+            return []
+        with self._lock:
+            prefix = [film_id for film_id in self._prefix(query)
+                      if any(query in title for title in self._titles[film_id])]
+            prefix.sort(key=lambda film_id: min(len(title) for title in self._titles[film_id]))
+            result = prefix[:limit]
+            if len(result) < limit:
+                fuzzy = self._fuzzy(query)
+                seen = set(result)
+                result += sorted((film_id for film_id in fuzzy if film_id not in seen),
+                                 key=fuzzy.get, reverse=True)[:limit - len(result)]
+            return [self._films[film_id] for film_id in result]
+
+
+def add_search_results(index, data):
+    """Добавляет в индекс фильмы из ответа search-by-keyword. Возвращает их ID"""
+    film_ids = []
+    for item in (data or {}).get('films') or []:
+        if item.get('filmId'):
+            index.add(item['filmId'], item.get('nameRu'), item.get('nameEn'), item.get('year'))
+            film_ids.append(int(item['filmId']))
+    return film_ids
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_title_index():
+    """Общий для процесса индекс; при первом обращении заполняется из кэша ответов"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = TitleIndex()
+                cache = get_cache()
+                if cache is not None:
+                    for film_id, data in cache.entries('film'):
+                        index.add(film_id, data.get('nameRu'), data.get('nameOriginal'), data.get('year'))
+                    for _, data in cache.entries('search'):
+                        add_search_results(index, data)
+                _index = index
+    return _index
+
+
+def remember_films(films):
+    """Добавляет загруженные FilmRecord в уже построенный индекс (еще не
+    построенный индекс получит их из кэша ответов)"""
+    if _index is not None:
+        for film in films:
+            _index.add_film(film)
+
+
+def search_titles(query, api_key=None, limit=SEARCH_LIMIT):
+    """Ищет фильмы по названию: локально, а при промахе — через API (если
+    задан ключ). Возвращает список TitleMatch. ApiLimitError пробрасывается"""
+    started = time.perf_counter()
+    index = get_title_index()
+    results = index.search(query, limit)
+    source = 'local'
+    if not results and api_key and normalize_title(query):
+        # Ключ кэша — нормализованный запрос, чтобы «Матрица» и «матрица»
+        # не запрашивались дважды
+        status, data = api_get('search', normalize_title(query), api_key)
+        if status == 200:
+            film_ids = add_search_results(index, data)
+            # API ищет и по другим полям: если названия не совпали с запросом,
+            # отдаем его результаты как есть
+            results = index.search(query, limit) or [index.get(film_id) for film_id in film_ids[:limit]]
+        source = 'api'
+    metrics.inc('kinopoisk_search_total', source=source if results else 'none')
+    metrics.observe('kinopoisk_search_seconds', time.perf_counter() - started, source=source)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Поиск фильмов Кинопоиска по названию')
+    parser.add_argument('query', help='название или его часть')
+    parser.add_argument('-k', '--api-key', default=os.environ.get('KINOPOISK_API_KEY'),
+                        help='API-ключ для поиска при локальном промахе (по умолчанию из KINOPOISK_API_KEY)')
+    parser.add_argument('-n', '--limit', type=int, default=SEARCH_LIMIT, help='максимум результатов')
+    args = parser.parse_args(argv)
+
+    results = search_titles(args.query, args.api_key, args.limit)
+    if not results:
+        print('Ничего не найдено', file=sys.stderr)
+        return 1
+    for match in results:
+        print(match.label())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
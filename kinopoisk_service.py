@@ -0,0 +1,251 @@
+"""HTTP/JSON-сервис для загрузки фильмов другими системами.
+
+Сервис использует то же ядро, что и страница Streamlit (kinopoisk_api.fetch_film
+и FilmRecord), и отдает записи в формате JSON Lines пакетной обработки:
+
+    GET  /films/{id}             запись фильма (?view=display — строки для отображения)
+    POST /films/batch            {"ids": [326, 435]} → {"films": [...], "errors": {...}}
+                                 (с фоновым приоритетом: уступает одиночным запросам)
+    GET  /search?q=матрица       поиск по названию → {"results": [{"film_id": ..., ...}]}
+    GET  /metrics                метрики в формате Prometheus
+    GET  /health
+
+Одновременные запросы одного и того же фильма объединяются: пока идет
+загрузка, остальные запросы ждут ее результат, а не обращаются к API
+повторно. Запуск (нужны starlette и uvicorn):
+
+    KINOPOISK_API_KEY=KEY python kinopoisk_service.py --port 8000 --workers 4
+
+Ключ (или несколько ключей через запятую) берется из KINOPOISK_API_KEY.
+Процессы-воркеры делят между собой лимит частоты и суточную квоту ключа и
+общий кэш ответов в SQLite; объединение запросов и /metrics действуют в
+пределах одного процесса.
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from kinopoisk_api import fetch_film
+from kinopoisk_keys import get_key_pool, parse_keys
+from kinopoisk_metrics import metrics
+from kinopoisk_ratelimit import DAILY_QUOTA, RATE_BURST, RATE_LIMIT, ApiLimitError, QuotaExceededError
+from kinopoisk_scheduler import BATCH, INTERACTIVE, call_with_priority
+from kinopoisk_search import SEARCH_LIMIT, get_title_index, search_titles
+
+# Потоков для загрузки фильмов в одном процессе (каждый фильм — еще 4 запроса)
+SERVICE_THREADS = int(os.environ.get('KINOPOISK_SERVICE_THREADS', 16))
+
+# Максимальное число ID в одном пакетном запросе
+MAX_BATCH = 500
+
+# Код ответа API в тексте ошибки fetch_film ("Ошибка: 404 — ...")
+_UPSTREAM_STATUS = re.compile(r'^Ошибка: (\d{3})\b')
+
+
+class FilmFetcher:
+    """Загрузка фильмов в пуле потоков с объединением одновременных запросов.
+
+    Пакетные запросы выполняются в отдельном пуле с фоновым приоритетом,
+    поэтому большой POST /films/batch не занимает потоки и лимит частоты,
+    нужные одиночным запросам"""
+
+    def __init__(self, api_key, threads=SERVICE_THREADS):
+        self.api_key = api_key
+        self.executors = {
+            INTERACTIVE: ThreadPoolExecutor(max_workers=threads, thread_name_prefix='kinopoisk-service'),
+            BATCH: ThreadPoolExecutor(max_workers=threads, thread_name_prefix='kinopoisk-service-batch'),
+        }
+        self._in_flight = {}
+
+    async def fetch(self, film_id, level=INTERACTIVE):
+        """(FilmRecord, None) или (None, ошибка); ApiLimitError пробрасывается"""
+        future = self._in_flight.get((film_id, level))
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executors[level], call_with_priority,
+                                          level, fetch_and_index, film_id, self.api_key)
+            self._in_flight[film_id, level] = future
+            future.add_done_callback(lambda _: self._in_flight.pop((film_id, level), None))
+        else:
+            metrics.inc('kinopoisk_service_coalesced_total')
+        # shield: отмена одного из ожидающих запросов не отменяет общую загрузку
+        return await asyncio.shield(future)
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def fetch_and_index(film_id, api_key):
+    """fetch_film, который добавляет загруженный фильм в индекс названий:
+    последующий /search находит его без запроса к API"""
+    film, error = fetch_film(film_id, api_key)
+    if film is not None:
+        get_title_index().add_film(film)
+    return film, error
+
+
+def api_key_from_env():
+    keys = parse_keys(os.environ.get('KINOPOISK_API_KEY', ''))
+    if not keys:
+        return None
+    return keys[0] if len(keys) == 1 else get_key_pool(keys)
+
+
+def _error_response(film_id, error):
+    match = _UPSTREAM_STATUS.match(error)
+    status = int(match.group(1)) if match and match.group(1) in ('400', '404') else 502
+    return JSONResponse({'film_id': film_id, 'error': error}, status_code=status)
+
+
+def _limit_response(error):
+    if isinstance(error, QuotaExceededError):
+        retry_after = max(int(error.reset_at - time.time()), 1)
+        return JSONResponse({'error': str(error)}, status_code=503, headers={'Retry-After': str(retry_after)})
+    return JSONResponse({'error': str(error)}, status_code=429)
+
+
+def _film_json(film, view):
+    return dict(film.display(), film_id=film.film_id) if view == 'display' else film.to_json()
+
+
+def _observe(route, started, response):
+    metrics.observe('kinopoisk_service_request_seconds', time.perf_counter() - started, route=route)
+    metrics.inc('kinopoisk_service_requests_total', route=route, status=response.status_code)
+    return response
+
+
+async def film(request):
+    started = time.perf_counter()
+    film_id = request.path_params['film_id']
+    fetcher = request.app.state.fetcher
+    if fetcher is None:
+        return _observe('film', started, JSONResponse({'error': 'Не задан KINOPOISK_API_KEY'}, status_code=503))
+    try:
+        record, error = await fetcher.fetch(str(film_id))
+    except ApiLimitError as e:
+        return _observe('film', started, _limit_response(e))
+    if error:
+        return _observe('film', started, _error_response(film_id, error))
+    return _observe('film', started, JSONResponse(_film_json(record, request.query_params.get('view'))))
+
+
+async def film_batch(request):
+    started = time.perf_counter()
+    fetcher = request.app.state.fetcher
+    if fetcher is None:
+        return _observe('batch', started, JSONResponse({'error': 'Не задан KINOPOISK_API_KEY'}, status_code=503))
+    try:
+        body = await request.json()
+        # Строку вида "326" иначе пришлось бы разбирать посимвольно
+        if not isinstance(body, dict) or not isinstance(body.get('ids'), list):
+            raise TypeError('ids должен быть списком')
+        film_ids = list(dict.fromkeys(str(int(film_id)) for film_id in body['ids']))
+    except (ValueError, TypeError):
+        return _observe('batch', started, JSONResponse(
+            {'error': 'Ожидается JSON вида {"ids": [326, 435]}'}, status_code=400))
+    if len(film_ids) > MAX_BATCH:
+        return _observe('batch', started, JSONResponse(
+            {'error': f'Не больше {MAX_BATCH} ID в одном запросе'}, status_code=413))
+
+    view = request.query_params.get('view')
+    results = await asyncio.gather(*(fetcher.fetch(film_id, BATCH) for film_id in film_ids),
+                                   return_exceptions=True)
+    films = []
+    errors = {}
+    for film_id, result in zip(film_ids, results):
+        if isinstance(result, ApiLimitError):
+            errors[film_id] = f'Лимит API: {result}'
+        elif isinstance(result, Exception):
+            errors[film_id] = f'Ошибка запроса: {result}'
+        elif result[1]:
+            errors[film_id] = result[1]
+        else:
+            films.append(_film_json(result[0], view))
+    return _observe('batch', started, JSONResponse({'films': films, 'errors': errors}))
+
+
+async def search(request):
+    started = time.perf_counter()
+    query = request.query_params.get('q', '').strip()
+    try:
+        limit = min(int(request.query_params.get('limit', SEARCH_LIMIT)), 50)
+    except ValueError:
+        limit = SEARCH_LIMIT
+    if not query:
+        return _observe('search', started, JSONResponse({'error': 'Не задан параметр q'}, status_code=400))
+    fetcher = request.app.state.fetcher
+    # Без ключа поиск только локальный
+    api_key, executor = (fetcher.api_key, fetcher.executors[INTERACTIVE]) if fetcher is not None else (None, None)
+    try:
+        matches = await asyncio.get_running_loop().run_in_executor(executor, search_titles, query, api_key, limit)
+    except ApiLimitError as e:
+        return _observe('search', started, _limit_response(e))
+    results = [{'film_id': m.film_id, 'name_ru': m.name_ru, 'name_original': m.name_original, 'year': m.year}
+               for m in matches]
+    return _observe('search', started, JSONResponse({'query': query, 'results': results}))
+
+
+async def metrics_text(request):
+    return PlainTextResponse(metrics.to_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+async def health(request):
+    return JSONResponse({'status': 'ok', 'api_key': request.app.state.fetcher is not None})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    api_key = api_key_from_env()
+    app.state.fetcher = FilmFetcher(api_key) if api_key else None
+    try:
+        yield
+    finally:
+        if app.state.fetcher is not None:
+            app.state.fetcher.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/films/batch', film_batch, methods=['POST']),
+        Route('/films/{film_id:int}', film),
+        Route('/search', search),
+        Route('/metrics', metrics_text),
+        Route('/health', health),
+    ],
+    lifespan=lifespan,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='HTTP-сервис загрузки фильмов с Кинопоиска')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1, help='число процессов')
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    if args.workers > 1:
+        # Ограничители частоты и счетчики квоты у каждого процесса свои,
+        # поэтому лимиты ключа делятся между воркерами поровну
+        os.environ['KINOPOISK_RATE_LIMIT'] = str(RATE_LIMIT / args.workers)
+        os.environ['KINOPOISK_RATE_BURST'] = str(max(RATE_BURST // args.workers, 1))
+        if DAILY_QUOTA:
+            os.environ['KINOPOISK_DAILY_QUOTA'] = str(max(DAILY_QUOTA // args.workers, 1))
+    uvicorn.run('kinopoisk_service:app', host=args.host, port=args.port, workers=args.workers,
+                app_dir=os.path.dirname(os.path.abspath(__file__)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Объединение одновременных одинаковых запросов (single-flight).
+
+Пока запрос с данным ключом выполняется, другие потоки с тем же ключом не
+выполняют его повторно, а ждут и получают тот же результат. Используется в
+kinopoisk_api.api_get с ключом (эндпоинт, ID фильма): несколько сессий,
+открывших один и тот же фильм, расходуют квоту API один раз.
+"""
+import threading
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Реестр выполняющихся вызовов по ключу"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, func, reusable=None):
+        """Выполняет func() или ждет уже идущий вызов с тем же ключом.
+
+        Возвращает (результат, shared), где shared=True, если результат получен
+        от чужого вызова. Если чужой вызов завершился исключением или его
+        результат не подходит (reusable(result) ложно — например, ответ
+        относится к другому API-ключу), ожидавший поток выполняет func() сам."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                call.waiters += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is None and (reusable is None or reusable(call.result)):
+                with self._lock:
+                    self.shared += 1
+                return call.result, True
+            with self._lock:
+                self.calls += 1
+            return func(), False
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self.calls += 1
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            total = self.calls + self.shared
+            return {
+                'calls': self.calls,
+                'shared': self.shared,
+                # Доля обращений, обслуженных чужим запросом
+                'dedup_ratio': self.shared / total if total else 0.0,
+                'in_flight': len(self._calls),
+            }
@@ -0,0 +1,442 @@
+"""Архив «сырых» ответов API для повторного разбора без запросов.
+
+Архив включается переменной KINOPOISK_SNAPSHOTS=1. Каждый ответ API
+(статусы 200, 400, 404) дописывается в него как есть, в сжатом виде: zstd, если установлен пакет zstandard, иначе zlib. Архив —
+каталог с сегментами только для дописывания и индексом смещений в SQLite:
+
+    segments/<время>-<pid>.seg   записи: заголовок, ключ «эндпоинт\\tID», ответ
+    index.sqlite3                (эндпоинт, ID) → сегмент, смещение, время
+
+Каждый процесс пишет в свои сегменты, поэтому воркеры сервиса и пакетные
+прогоны не мешают друг другу. Сегменты читаются через mmap: чтобы вывести
+новое поле для 100 тыс. фильмов, достаточно локально пройти по архиву:
+
+    python kinopoisk_snapshots.py stats
+    python kinopoisk_snapshots.py films films.jsonl
+    python kinopoisk_snapshots.py fields film slogan ratingAgeLimits --csv fields.csv
+    python kinopoisk_snapshots.py reindex
+
+Размер архива ограничен KINOPOISK_SNAPSHOTS_MAX_BYTES: при переходе на новый
+сегмент самые старые сегменты удаляются целиком вместе с их записями в
+индексе (python kinopoisk_snapshots.py prune — то же вручную).
+
+Записи попадают в индекс пачками по INDEX_BATCH (а также при переходе на
+новый сегмент, перед чтением и при закрытии); если процесс упал раньше,
+reindex восстановит индекс по сегментам (оборванная последняя запись
+сегмента при этом пропускается).
+"""
+import argparse
+import atexit
+import csv
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from kinopoisk_metrics import metrics
+
+# Каталог архива; архив ведется только при KINOPOISK_SNAPSHOTS=1
+SNAPSHOTS_PATH = os.environ.get(
+    'KINOPOISK_SNAPSHOTS_PATH',
+    os.path.join(os.path.expanduser('~'), '.cache', 'kinopoisk', 'snapshots'),
+)
+SNAPSHOTS_ENABLED = os.environ.get('KINOPOISK_SNAPSHOTS', '0') == '1'
+
+# Максимальный размер всех сегментов, байты (0 — без ограничения)
+SNAPSHOTS_MAX_BYTES = int(os.environ.get('KINOPOISK_SNAPSHOTS_MAX_BYTES', 4 * 1024 * 1024 * 1024))
+
+# Сколько записей накапливается перед записью в индекс одной транзакцией
+INDEX_BATCH = 256
+
+# Размер сегмента, после которого запись продолжается в новом, байты
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024
+
+SEGMENT_MAGIC = b'KPSNAP1\n'
+
+# Заголовок записи: длина сжатого ответа, CRC32 сжатого ответа, длина ключа,
+# статус HTTP, время запроса (unix), кодек
+RECORD_HEADER = struct.Struct('<IIHHdB')
+
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def _codec():
+    return CODEC_ZSTD if _zstd() is not None else CODEC_ZLIB
+
+
+def _compress(codec, content):
+    if codec == CODEC_ZSTD:
+        return _zstd().ZstdCompressor(level=3).compress(content)
+    return zlib.compress(content, 6)
+
+
+def _decompress(codec, payload):
+    if codec == CODEC_ZSTD:
+        zstandard = _zstd()
+        if zstandard is None:
+            raise ImportError('Архив сжат zstd: установите zstandard (pip install zstandard)')
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+
+def iter_records(view, start=len(SEGMENT_MAGIC)):
+    """Записи сегмента (mmap или bytes) начиная со смещения start:
+    (смещение, эндпоинт, ID, статус, время, кодек, сжатый ответ).
+
+    Останавливается на оборванной или поврежденной записи в конце"""
+    offset = start
+    end = len(view)
+    while offset + RECORD_HEADER.size <= end:
+        size, crc, key_size, status, fetched_at, codec = RECORD_HEADER.unpack_from(view, offset)
+        data_start = offset + RECORD_HEADER.size + key_size
+        if data_start + size > end:
+            return
+        payload = view[data_start:data_start + size]
+        if zlib.crc32(payload) != crc:
+            return
+        endpoint, film_id = bytes(view[offset + RECORD_HEADER.size:data_start]).decode('utf-8').split('\t', 1)
+        yield offset, endpoint, film_id, status, fetched_at, codec, payload
+        offset = data_start + size
+
+
+class SnapshotStore:
+    """Архив ответов API: сегменты только для дописывания и индекс смещений"""
+
+    def __init__(self, path=SNAPSHOTS_PATH, segment_max_bytes=SEGMENT_MAX_BYTES, max_bytes=SNAPSHOTS_MAX_BYTES):
+        self.path = path
+        self.segments_dir = os.path.join(path, 'segments')
+        self.segment_max_bytes = segment_max_bytes
+        self.max_bytes = max_bytes
+        self.codec = _codec()
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_name = None
+        self._views = {}
+        # Записи, еще не добавленные в индекс
+        self._pending = []
+
+        os.makedirs(self.segments_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(path, 'index.sqlite3'), check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                endpoint TEXT NOT NULL,
+                film_id TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                segment TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                PRIMARY KEY (segment, offset)
+            )
+        """)
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS snapshots_key ON snapshots (endpoint, film_id, fetched_at)')
+        self._conn.commit()
+
+    def _segment_path(self, name):
+        return os.path.join(self.segments_dir, name)
+
+    def _segments(self):
+        """Имена сегментов от старых к новым (имя начинается со времени создания)"""
+        return sorted(name for name in os.listdir(self.segments_dir) if name.endswith('.seg'))
+
+    def _flush_index(self):
+        if self._pending:
+            self._conn.executemany('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?)', self._pending)
+            self._conn.commit()
+            self._pending = []
+
+    def flush(self):
+        """Добавляет в индекс накопленные записи"""
+        with self._lock:
+            self._flush_index()
+
+    def _prune(self):
+        """Удаляет самые старые сегменты, пока архив больше max_bytes (текущий
+        сегмент процесса не удаляется). Возвращает число удаленных сегментов"""
+        if not self.max_bytes:
+            return 0
+        sizes = {name: os.path.getsize(self._segment_path(name)) for name in self._segments()}
+        total = sum(sizes.values())
+        removed = 0
+        for name, size in sizes.items():
+            if total <= self.max_bytes:
+                break
+            if name == self._writer_name:
+                continue
+            view = self._views.pop(name, None)
+            if view is not None:
+                view.close()
+            try:
+                os.remove(self._segment_path(name))
+            except FileNotFoundError:
+                # Сегмент уже удален другим процессом
+                pass
+            self._conn.execute('DELETE FROM snapshots WHERE segment = ?', (name,))
+            total -= size
+            removed += 1
+        if removed:
+            self._conn.commit()
+        return removed
+
+    def prune(self):
+        with self._lock:
+            self._flush_index()
+            return self._prune()
+
+    def _open_writer(self):
+        """Новый сегмент этого процесса (старые сегменты не дописываются);
+        накопленные записи попадают в индекс, старые сегменты сверх лимита удаляются"""
+        self._flush_index()
+        if self._writer is not None:
+            self._writer.close()
+        name = f'{time.time_ns()}-{os.getpid()}.seg'
+        self._writer = open(self._segment_path(name), 'ab')
+        self._writer.write(SEGMENT_MAGIC)
+        self._writer_name = name
+        self._prune()
+
+    def append(self, endpoint, film_id, status, content, fetched_at=None):
+        """Дописывает ответ (bytes, как пришел от сервера)"""
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        key = f'{endpoint}\t{film_id}'.encode('utf-8')
+        payload = _compress(self.codec, content)
+        header = RECORD_HEADER.pack(len(payload), zlib.crc32(payload), len(key), status, fetched_at, self.codec)
+        with self._lock:
+            if self._writer is None or self._writer.tell() >= self.segment_max_bytes:
+                self._open_writer()
+            offset = self._writer.tell()
+            # Одна запись за вызов: читатели других процессов не видят половину заголовка
+            self._writer.write(header + key + payload)
+            self._writer.flush()
+            self._pending.append((endpoint, str(film_id), status, fetched_at, self._writer_name, offset))
+            if len(self._pending) >= INDEX_BATCH:
+                self._flush_index()
+        metrics.inc('kinopoisk_snapshot_records_total', endpoint=endpoint)
+        metrics.observe('kinopoisk_snapshot_bytes', len(payload), film_id, endpoint=endpoint)
+
+    def _view(self, segment, needed):
+        """mmap сегмента, покрывающий первые needed байт (дописанный
+        сегмент отображается заново)"""
+        view = self._views.get(segment)
+        if view is None or len(view) < needed:
+            if view is not None:
+                view.close()
+            with open(self._segment_path(segment), 'rb') as f:
+                view = self._views[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return view
+
+    def _read(self, segment, offset):
+        """(эндпоинт, ID, статус, время, JSON или текст ответа) по смещению"""
+        with self._lock:
+            view = self._view(segment, offset + RECORD_HEADER.size)
+            size, _, key_size, _, _, _ = RECORD_HEADER.unpack_from(view, offset)
+            view = self._view(segment, offset + RECORD_HEADER.size + key_size + size)
+            record = next(iter_records(view, offset), None)
+        if record is None:
+            raise ValueError(f'Поврежденная запись архива: {segment} @ {offset}')
+        _, endpoint, film_id, status, fetched_at, codec, payload = record
+        return endpoint, film_id, status, fetched_at, _decode(status, _decompress(codec, payload))
+
+    def get(self, endpoint, film_id):
+        """Последний ответ: (статус, JSON или текст, время) или None"""
+        with self._lock:
+            self._flush_index()
+            row = self._conn.execute(
+                'SELECT segment, offset FROM snapshots WHERE endpoint = ? AND film_id = ? '
+                'ORDER BY fetched_at DESC LIMIT 1', (endpoint, str(film_id))).fetchone()
+        if row is None:
+            return None
+        _, _, status, fetched_at, data = self._read(*row)
+        return status, data, fetched_at
+
+    def scan(self, endpoints=None, latest=True):
+        """Ответы архива: (эндпоинт, ID, статус, время, JSON или текст).
+
+        При latest=True — только последний ответ для каждого (эндпоинт, ID).
+        Записи читаются в порядке расположения в сегментах"""
+        # Для MAX() SQLite берет остальные столбцы из строки с максимумом
+        query = 'SELECT segment, offset, MAX(fetched_at) FROM snapshots' if latest else \
+            'SELECT segment, offset FROM snapshots'
+        if endpoints:
+            query += f' WHERE endpoint IN ({", ".join("?" * len(endpoints))})'
+        if latest:
+            query += ' GROUP BY endpoint, film_id'
+        with self._lock:
+            self._flush_index()
+            rows = self._conn.execute(query, list(endpoints or ())).fetchall()
+        rows.sort(key=lambda row: (row[0], row[1]))
+        for row in rows:
+            yield self._read(row[0], row[1])
+
+    def film_payloads(self):
+        """Последние ответы эндпоинтов фильма по фильмам: (ID, {эндпоинт:
+        (статус, данные)}, {эндпоинт: время}) в порядке ID"""
+        with self._lock:
+            self._flush_index()
+            rows = self._conn.execute(
+                'SELECT film_id, endpoint, segment, offset, MAX(fetched_at) FROM snapshots '
+                "WHERE endpoint != 'search' GROUP BY film_id, endpoint ORDER BY film_id").fetchall()
+        film_id, payloads, times = None, {}, {}
+        for row_film_id, endpoint, segment, offset, fetched_at in rows:
+            if row_film_id != film_id:
+                if payloads:
+                    yield film_id, payloads, times
+                film_id, payloads, times = row_film_id, {}, {}
+            _, _, status, _, data = self._read(segment, offset)
+            payloads[endpoint] = (status, data)
+            times[endpoint] = fetched_at
+        if payloads:
+            yield film_id, payloads, times
+
+    def reindex(self):
+        """Добавляет в индекс записи сегментов, которых в нем нет. Возвращает их число"""
+        self.flush()
+        added = 0
+        for name in self._segments():
+            if os.path.getsize(self._segment_path(name)) <= len(SEGMENT_MAGIC):
+                continue
+            with open(self._segment_path(name), 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                rows = [(endpoint, film_id, status, fetched_at, name, offset)
+                        for offset, endpoint, film_id, status, fetched_at, _, _ in iter_records(view)]
+            with self._lock:
+                before = self._conn.total_changes
+                self._conn.executemany('INSERT OR IGNORE INTO snapshots VALUES (?, ?, ?, ?, ?, ?)', rows)
+                self._conn.commit()
+                added += self._conn.total_changes - before
+        return added
+
+    def stats(self):
+        with self._lock:
+            self._flush_index()
+            entries, films = self._conn.execute(
+                'SELECT COUNT(*), COUNT(DISTINCT film_id) FROM snapshots').fetchone()
+        segments = self._segments()
+        return {
+            'entries': entries,
+            'films': films,
+            'segments': len(segments),
+            'size_bytes': sum(os.path.getsize(self._segment_path(name)) for name in segments),
+            'codec': 'zstd' if self.codec == CODEC_ZSTD else 'zlib',
+        }
+
+    def close(self):
+        with self._lock:
+            self._flush_index()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            for view in self._views.values():
+                view.close()
+            self._views.clear()
+            self._conn.close()
+
+
+def _decode(status, content):
+    if status == 200:
+        return json.loads(content)
+    return content.decode('utf-8', errors='replace')
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_snapshots():
+    """Общий для процесса архив (None, если архив отключен)"""
+    global _store
+    if not SNAPSHOTS_ENABLED:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SnapshotStore()
+                # Хвост записей попадает в индекс при выходе (иначе — через reindex)
+                atexit.register(_store.flush)
+    return _store
+
+
+def iter_archived_films(store):
+    """FilmRecord по последним ответам архива (время загрузки — время
+    ответа карточки фильма); фильмы без карточки пропускаются"""
+    from kinopoisk_api import bundle_from_payloads
+    from kinopoisk_models import FilmRecord
+
+    for film_id, payloads, times in store.film_payloads():
+        bundle = bundle_from_payloads(payloads)
+        if bundle['error'] or not bundle['data']:
+            continue
+        film = FilmRecord.from_bundle(film_id, bundle)
+        film.fetched_at = datetime.fromtimestamp(times['film'], timezone.utc).isoformat(timespec='seconds')
+        yield film
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Архив ответов API Кинопоиска')
+    parser.add_argument('--path', default=SNAPSHOTS_PATH, help='каталог архива')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help='размер архива')
+    commands.add_parser('reindex', help='восстановить индекс по сегментам')
+    commands.add_parser('prune', help='удалить старые сегменты сверх KINOPOISK_SNAPSHOTS_MAX_BYTES')
+    films = commands.add_parser('films', help='записи фильмов (JSON Lines) по последним ответам')
+    films.add_argument('output', help='выходной файл JSON Lines')
+    fields = commands.add_parser('fields', help='поля верхнего уровня ответов эндпоинта в CSV')
+    fields.add_argument('endpoint', help='эндпоинт (film, staff, box_office, distributions)')
+    fields.add_argument('names', nargs='+', help='имена полей JSON')
+    fields.add_argument('--csv', required=True, help='выходной файл CSV')
+    args = parser.parse_args(argv)
+
+    store = SnapshotStore(args.path)
+    started = time.perf_counter()
+    try:
+        if args.command == 'stats':
+            for name, value in store.stats().items():
+                print(f'{name}: {value}')
+        elif args.command == 'reindex':
+            print(f'Добавлено в индекс: {store.reindex()}', file=sys.stderr)
+        elif args.command == 'prune':
+            print(f'Удалено сегментов: {store.prune()}', file=sys.stderr)
+        elif args.command == 'films':
+            count = 0
+            with open(args.output, 'w', encoding='utf-8') as out:
+                for film in iter_archived_films(store):
+                    out.write(json.dumps(film.to_json(), ensure_ascii=False) + '\n')
+                    count += 1
+            print(f'Фильмов: {count} за {time.perf_counter() - started:.1f} с → {args.output}', file=sys.stderr)
+        else:
+            count = 0
+            with open(args.csv, 'w', encoding='utf-8-sig', newline='') as f:
+                writer = csv.writer(f, delimiter=';', quoting=csv.QUOTE_ALL)
+                writer.writerow(['ID'] + args.names)
+                for _, film_id, status, _, data in store.scan([args.endpoint]):
+                    if status != 200 or not isinstance(data, dict):
+                        continue
+                    values = [data.get(name) for name in args.names]
+                    writer.writerow([film_id] + [json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list))
+                                                 else '' if v is None else v for v in values])
+                    count += 1
+            print(f'Строк: {count} за {time.perf_counter() - started:.1f} с → {args.csv}', file=sys.stderr)
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,33 @@
 import streamlit as st
-import pandas as pd
-import requests
-import json
 from datetime import datetime
-import io
+import os
+import time
+
+from kinopoisk_api import fetch_film, flights
+from kinopoisk_batch import BatchJob, read_film_ids, run_batch
+from kinopoisk_cache import DAY, get_cache
+from kinopoisk_export import (
+    create_excel_file,
+    create_improved_csv_file,
+    create_parquet_file,
+    create_simple_csv_file,
+    csv_paths,
+    iter_films,
+    parquet_paths,
+)
+from kinopoisk_http import connection_stats
+from kinopoisk_keys import get_key_pool, parse_keys
+from kinopoisk_metrics import metrics
+from kinopoisk_parallel import export_csv_parallel, export_parquet_parallel, export_xlsx_parallel
+from kinopoisk_persons import PersonIndex, export_persons_csv, persons_paths
+from kinopoisk_ratelimit import ApiLimitError, get_limiter
+from kinopoisk_refresh import DEFAULT_MAX_AGE, run_refresh
+from kinopoisk_scheduler import BATCH, INTERACTIVE, scheduler
+from kinopoisk_search import get_title_index, remember_films, search_titles
+from kinopoisk_snapshots import get_snapshots
+
+# Каталог для результатов пакетной обработки
+BATCH_OUTPUT_DIR = 'batch_output'
 
 # Настройка страницы
 st.set_page_config(
@@ -12,325 +36,103 @@ st.set_page_config(
     layout="wide"
 )
 
-# API URLs
-API_URL = 'https://kinopoiskapiunofficial.tech/api/v2.2/films/{}'
-API_URL_STAFF = 'https://kinopoiskapiunofficial.tech/api/v1/staff?filmId={}'
-API_URL_BOXOFFICE = 'https://kinopoiskapiunofficial.tech/api/v2.2/films/{}/box_office'
-API_URL_DISTRIBUTIONS = 'https://kinopoiskapiunofficial.tech/api/v2.2/films/{}/distributions'
+# Время выполнения страницы учитывается в панели «Производительность»
+page_started = time.perf_counter()
+
+# Таблицы и файлы экспорта для фильма кэшируются между перезапусками страницы
+# и сессиями. Ключ — (ID фильма, время загрузки): запись после загрузки не
+# меняется, а объект записи (_film) Streamlit не хэширует
+FILM_CACHE_ENTRIES = 64
+FILM_CACHE_TTL = 60 * 60
 
-def get_headers(api_key):
+@st.cache_data(max_entries=FILM_CACHE_ENTRIES, ttl=FILM_CACHE_TTL, show_spinner=False)
+def cast_table(film_key, _film):
+    """Таблица состава для отображения: столбцы списками, без pandas"""
     return {
-        'X-API-KEY': api_key,
-        'Content-Type': 'application/json',
+        'Имя': [member.name for member in _film.cast],
+        'ID': [member.staff_id or '' for member in _film.cast],
+        'Профессия': [member.profession or '' for member in _film.cast],
+        'Роль': [member.role or '' for member in _film.cast],
     }
 
-def format_money(value):
-    if not value or value == '-' or value is None:
-        return '-'
-    parts = str(value).split()
-    if not parts or not parts[0].replace(',', '').replace(' ', '').isdigit():
-        return value
-    try:
-        num = int(parts[0].replace(' ', '').replace(',', ''))
-        currency = parts[1] if len(parts) > 1 and parts[1] else 'USD'
-        formatted = f"{num:,}".replace(",", " ")
-        return f"{formatted} {currency}".strip()
-    except Exception as e:
-        return value
-
-def format_date(date_str):
-    if not date_str or date_str == '-':
-        return '-'
-    try:
-        dt = datetime.strptime(date_str[:10], '%Y-%m-%d')
-        return dt.strftime('%d.%m.%Y')
-    except Exception as e:
-        return date_str
-
-def format_duration(duration):
-    """Форматирует продолжительность в минутах"""
-    if not duration or duration == '-' or duration is None:
-        return '-'
-    try:
-        minutes = int(duration)
-        if minutes <= 0:
-            return '-'
-        return str(minutes)
-    except (ValueError, TypeError):
-        return str(duration) if duration else '-'
-
-def format_vote_count(vote_count):
-    """Форматирует количество голосов"""
-    if not vote_count or vote_count == '-' or vote_count is None:
-        return '-'
-    try:
-        count = int(vote_count)
-        if count <= 0:
-            return '-'
-        # Форматируем с разделителями тысяч
-        return f"{count:,}".replace(",", " ")
-    except (ValueError, TypeError):
-        return str(vote_count) if vote_count else '-'
+@st.cache_data(max_entries=FILM_CACHE_ENTRIES, ttl=FILM_CACHE_TTL, show_spinner=False)
+def film_file(kind, film_key, _film):
+    """Содержимое файла экспорта ('excel', 'csv', 'simple_csv', 'parquet')"""
+    if kind == 'parquet':
+        return create_parquet_file(_film).getvalue()
+    builders = {
+        'excel': create_excel_file,
+        'csv': create_improved_csv_file,
+        'simple_csv': create_simple_csv_file,
+    }
+    return builders[kind](_film.display(), _film.cast).getvalue()
 
-def get_film_info(film_id, api_key):
-    url = API_URL.format(film_id)
-    try:
-        response = requests.get(url, headers=get_headers(api_key), timeout=10)
-        if response.status_code != 200:
-            return None, f'Ошибка: {response.status_code} — {response.text}'
-        return response.json(), None
-    except Exception as e:
-        return None, f'Ошибка запроса: {e}'
+@st.cache_resource
+def batch_jobs():
+    """Фоновые пакетные задачи процесса: выходной файл → (режим, BatchJob).
+    Общие для сессий, поэтому один файл не обрабатывается дважды одновременно"""
+    return {}
 
-def get_film_cast(film_id, api_key):
-    url = API_URL_STAFF.format(film_id)
-    try:
-        response = requests.get(url, headers=get_headers(api_key), timeout=10)
-        if response.status_code != 200:
-            return []
-        data = response.json()
-        cast = []
-        for p in data:
-            profession = (p.get('professionText') or p.get('profession') or '').lower()
-            if any(x in profession for x in ['монтажер', 'художник']):
-                continue
-            name = p.get('nameRu') or p.get('nameEn') or '-'
-            staff_id = p.get('staffId')
-            if staff_id:
-                cast.append(f"{name};{staff_id}")
-            else:
-                cast.append(f"{name}")
-        return cast
-    except Exception as e:
-        return []
+@st.fragment(run_every=1.0)
+def show_batch_progress(job):
+    """Прогресс фоновой обработки и пауза; обновляется без перезапуска страницы.
+    Пауза действует только на этот прогон"""
+    if not job.running:
+        # Прогон завершился: перезапуск страницы покажет итоги и файлы
+        st.rerun()
+    paused = job.switch.paused()
+    st.progress(job.done / job.total if job.total else 0.0,
+                text=f"Обработано {job.done} из {job.total}" + (" — пауза" if paused else ""))
+    # Колбэк выполняется до перезапуска, поэтому кнопка сразу сменится
+    if paused:
+        st.button("▶️ Продолжить фоновую обработку", on_click=job.switch.resume)
+    else:
+        st.button("⏸️ Приостановить фоновую обработку", on_click=job.switch.pause,
+                  help="Только этот файл: уже отправленные запросы завершатся, новые фильмы "
+                       "не берутся до продолжения. Другие прогоны продолжают работу")
+    waiting = scheduler.stats()['waiting']
+    st.caption(f"Ждут разрешения на запрос: интерактивных {waiting[INTERACTIVE]}, фоновых {waiting[BATCH]}")
 
-def get_film_boxoffice(film_id, api_key):
-    url = API_URL_BOXOFFICE.format(film_id)
-    try:
-        response = requests.get(url, headers=get_headers(api_key), timeout=10)
-        if response.status_code != 200:
-            return {}
-        data = response.json()
-        currency_symbols = {
-            'USD': '$', 'RUB': '₽', 'EUR': '€', 'GBP': '£',
-            'CNY': '¥', 'JPY': '¥', 'KZT': '₸', 'UAH': '₴',
-            'BYN': 'Br', 'INR': '₹',
-        }
-        result = {}
-        for item in data.get('items', []):
-            amount = item.get('amount')
-            currency = item.get('currencyCode', 'USD')
-            symbol = currency_symbols.get(currency, currency)
-            val = f"{amount} {symbol}" if amount else '-'
-            if item['type'] == 'BUDGET':
-                result['budget'] = val
-            elif item['type'] == 'WORLD':
-                result['world'] = val
-            elif item['type'] == 'RUS':
-                result['russia'] = val
-            elif item['type'] == 'USA':
-                result['usa'] = val
-            elif item['type'] == 'MARKETING':
-                result['marketing'] = val
-        return result
-    except Exception as e:
-        return {}
+def show_batch_result(mode, job):
+    if job.error is not None:
+        st.error(f"❌ Ошибка пакетной обработки: {job.error}")
+        return
+    stats = job.stats
+    if mode == 'refresh':
+        st.success(f"✅ Новых {stats['new']}, изменилось {stats['changed']}, без изменений "
+                   f"{stats['unchanged']}, ошибок {stats['failed']}; запросов к API "
+                   f"{stats['requests']} за {stats['elapsed']:.1f} с")
+        if stats['stopped'] == 'quota':
+            st.warning("⏸️ Суточная квота API-ключа исчерпана. Запустите обновление после сброса квоты.")
+        if stats['errors']:
+            st.warning("Не удалось обновить: " + ", ".join(stats['errors']))
+    else:
+        st.success(f"✅ Загружено {stats['fetched']}, пропущено (уже были) {stats['skipped']}, "
+                   f"ошибок {stats['failed']} за {stats['elapsed']:.1f} с")
+        if stats['stopped'] == 'quota':
+            st.warning("⏸️ Суточная квота API-ключа исчерпана. Загруженные фильмы сохранены — "
+                       "запустите обработку того же файла после сброса квоты, чтобы продолжить.")
+        if stats['errors']:
+            st.warning("Не удалось загрузить: " + ", ".join(stats['errors']))
 
-def get_film_premieres(film_id, api_key):
-    url = API_URL_DISTRIBUTIONS.format(film_id)
-    try:
-        response = requests.get(url, headers=get_headers(api_key), timeout=10)
-        if response.status_code != 200:
-            return '-', '-'
-        data = response.json()
-        premiere_rf = '-'
-        premiere_world = '-'
-        for item in data.get('items', []):
-            t = item.get('type', '').upper()
-            date = item.get('date', '-')
-            country_obj = item.get('country')
-            if t == 'WORLD_PREMIER':
-                premiere_world = format_date(date)
-            if t == 'COUNTRY_SPECIFIC' and country_obj:
-                country_name = country_obj.get('country', '').lower()
-                if country_name in ('россия', 'russia'):
-                    premiere_rf = format_date(date)
-        return premiere_rf, premiere_world
-    except Exception as e:
-        return '-', '-'
+def file_data(path):
+    """data для st.download_button: файл читается только при нажатии на кнопку,
+    а не при каждом перезапуске страницы"""
+    def read():
+        with open(path, 'rb') as f:
+            return f.read()
+    return read
 
-def create_excel_file(film_data, cast_data):
-    """Создает Excel файл с данными о фильме"""
-    output = io.BytesIO()
-    
-    try:
-        # Очищаем данные от проблемных символов
-        cleaned_film_data = {}
-        for key, value in film_data.items():
-            if isinstance(value, str):
-                # Удаляем или заменяем проблемные символы
-                cleaned_value = value.replace('\x00', '').replace('\ufeff', '')
-                # Ограничиваем длину для Excel (максимум 32767 символов в ячейке)
-                if len(cleaned_value) > 32000:
-                    cleaned_value = cleaned_value[:32000] + "..."
-                cleaned_film_data[key] = cleaned_value
-            else:
-                cleaned_film_data[key] = value
-        
-        # Основные данные фильма
-        df_main = pd.DataFrame([cleaned_film_data])
-        
-        # Данные о касте
-        cast_list = []
-        for line in cast_data:
-            if ';' in line:
-                name, staff_id = line.split(';', 1)
-                # Очищаем имя от проблемных символов
-                clean_name = name.strip().replace('\x00', '').replace('\ufeff', '')
-                if len(clean_name) > 255:  # Ограничение для имен
-                    clean_name = clean_name[:255]
-                cast_list.append({'Имя': clean_name, 'ID': staff_id.strip()})
-            else:
-                clean_name = line.strip().replace('\x00', '').replace('\ufeff', '')
-                if len(clean_name) > 255:
-                    clean_name = clean_name[:255]
-                cast_list.append({'Имя': clean_name, 'ID': ''})
-        
-        df_cast = pd.DataFrame(cast_list)
-        
-        # Записываем в Excel с правильными настройками
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            # Записываем основную информацию
-            df_main.to_excel(writer, sheet_name='Основная информация', index=False)
-            
-            # Записываем данные о касте
-            df_cast.to_excel(writer, sheet_name='Актеры и съемочная группа', index=False)
-            
-            # Получаем workbook и worksheet для настройки
-            workbook = writer.book
-            worksheet_main = writer.sheets['Основная информация']
-            worksheet_cast = writer.sheets['Актеры и съемочная группа']
-            
-            # Настраиваем ширину столбцов
-            worksheet_main.set_column('A:A', 25)  # Названия полей
-            worksheet_main.set_column('B:B', 50)  # Значения
-            
-            worksheet_cast.set_column('A:A', 40)  # Имена
-            worksheet_cast.set_column('B:B', 15)  # ID
-            
-            # Добавляем форматирование заголовков
-            header_format = workbook.add_format({
-                'bold': True,
-                'bg_color': '#D3D3D3',
-                'border': 1
-            })
-            
-            # Применяем форматирование к заголовкам
-            for col_num, value in enumerate(df_main.columns.values):
-                worksheet_main.write(0, col_num, value, header_format)
-            
-            for col_num, value in enumerate(df_cast.columns.values):
-                worksheet_cast.write(0, col_num, value, header_format)
-        
-        output.seek(0)
-        return output
-        
-    except Exception as e:
-        # Если произошла ошибка, возвращаем улучшенную версию CSV
-        st.error(f"Ошибка при создании Excel файла: {e}")
-        return create_improved_csv_file(film_data, cast_data)
-
-def create_improved_csv_file(film_data, cast_data):
-    """Создает улучшенный CSV файл как альтернатива Excel"""
-    output = io.BytesIO()
-    
-    # Создаем временный файл в памяти
-    temp_output = io.StringIO()
-    
-    try:
-        # Очищаем данные
-        cleaned_film_data = {}
-        for key, value in film_data.items():
-            if isinstance(value, str):
-                cleaned_value = value.replace('\x00', '').replace('\ufeff', '').replace('\n', ' ').replace('\r', ' ')
-                cleaned_film_data[key] = cleaned_value
-            else:
-                cleaned_film_data[key] = value
-        
-        # Создаем DataFrame для основной информации
-        df_main = pd.DataFrame([cleaned_film_data])
-        
-        # Создаем DataFrame для актеров
-        cast_list = []
-        for line in cast_data:
-            if ';' in line:
-                name, staff_id = line.split(';', 1)
-                clean_name = name.strip().replace('\x00', '').replace('\ufeff', '').replace('\n', ' ').replace('\r', ' ')
-                cast_list.append({'Имя': clean_name, 'ID': staff_id.strip()})
-            else:
-                clean_name = line.strip().replace('\x00', '').replace('\ufeff', '').replace('\n', ' ').replace('\r', ' ')
-                cast_list.append({'Имя': clean_name, 'ID': ''})
-        
-        df_cast = pd.DataFrame(cast_list)
-        
-        # Записываем в CSV с правильной кодировкой
-        temp_output.write("=== ОСНОВНАЯ ИНФОРМАЦИЯ ===\n")
-        df_main.to_csv(temp_output, index=False, encoding='utf-8', sep=';', quoting=1)
-        
-        temp_output.write("\n=== АКТЕРЫ И СЪЕМОЧНАЯ ГРУППА ===\n")
-        df_cast.to_csv(temp_output, index=False, encoding='utf-8', sep=';', quoting=1)
-        
-        # Получаем содержимое и кодируем с BOM для Excel
-        content = temp_output.getvalue()
-        temp_output.close()
-        
-        # Возвращаем байтовый поток с правильной кодировкой
-        final_content = '\ufeff' + content
-        output.write(final_content.encode('utf-8'))
-        output.seek(0)
-        
-        return output
-        
-    except Exception as e:
-        st.error(f"Ошибка при создании CSV файла: {e}")
-        return None
-
-def create_simple_csv_file(film_data, cast_data):
-    """Создает простой CSV файл для универсального использования"""
-    output = io.StringIO()
-    
-    # Создаем DataFrame для основной информации
-    df_main = pd.DataFrame([film_data])
-    
-    # Создаем DataFrame для актеров
-    cast_list = []
-    for line in cast_data:
-        if ';' in line:
-            name, staff_id = line.split(';', 1)
-            cast_list.append({'Имя': name.strip(), 'ID': staff_id.strip()})
-        else:
-            cast_list.append({'Имя': line.strip(), 'ID': ''})
-    
-    df_cast = pd.DataFrame(cast_list)
-    
-    # Записываем основную информацию
-    output.write("=== ОСНОВНАЯ ИНФОРМАЦИЯ ===\n")
-    df_main.to_csv(output, index=False, encoding='utf-8')
-    
-    output.write("\n=== АКТЕРЫ И СЪЕМОЧНАЯ ГРУППА ===\n")
-    df_cast.to_csv(output, index=False, encoding='utf-8')
-    
-    content = output.getvalue()
-    output.close()
-    
-    # Возвращаем с UTF-8 BOM для корректного отображения
-    return io.BytesIO(('\ufeff' + content).encode('utf-8'))
+def export_progress(label):
+    """progress(done, total) для параллельного экспорта: полоса по готовым частям"""
+    bar = st.progress(0.0, text=label)
+    def update(done, total):
+        bar.progress(done / total if total else 1.0, text=f"{label}: готово {done} из {total}")
+    return update
 
 # Инициализация сессии
-if 'film_data' not in st.session_state:
-    st.session_state.film_data = {}
-if 'cast_data' not in st.session_state:
-    st.session_state.cast_data = []
+if 'film' not in st.session_state:
+    st.session_state.film = None
 
 # Заголовок
 st.title("🎬 Кинопоиск Парсер")
@@ -347,73 +149,122 @@ with st.sidebar:
         2. Получите бесплатный API-ключ
         3. Вставьте его в поле выше
         """)
+    
+    # Несколько ключей: запросы распределяются между ними
+    with st.expander("🔑 Несколько API-ключей"):
+        extra_keys_text = st.text_area("Дополнительные ключи (по одному в строке):")
+        keys_file = st.file_uploader("Или файл с ключами:", type=["txt", "csv"], key="keys_file")
+    
+    api_keys = parse_keys(api_key) + parse_keys(extra_keys_text)
+    if keys_file is not None:
+        api_keys += parse_keys(keys_file.getvalue().decode('utf-8-sig'))
+    
+    if len(set(api_keys)) > 1:
+        # Пул общий для процесса, поэтому статистика и отключенные ключи
+        # сохраняются между перезапусками страницы
+        api_key = get_key_pool(api_keys)
+        st.caption(f"Пул из {len(api_key)} ключей")
+        st.dataframe(api_key.usage(), use_container_width=True, hide_index=True)
+    elif api_keys:
+        api_key = api_keys[0]
+        remaining = get_limiter(api_key).quota.remaining()
+        if remaining is not None:
+            st.caption(f"Осталось запросов сегодня (по счетчику приложения): {remaining}")
+    
+    # Статистика кэша ответов (общий для всех сессий)
+    cache = get_cache()
+    if cache is not None:
+        st.subheader("🗄️ Кэш ответов")
+        cache_stats = cache.stats()
+        col_hits, col_misses = st.columns(2)
+        col_hits.metric("Попадания", cache_stats['hits'])
+        col_misses.metric("Промахи", cache_stats['misses'])
+        st.caption(f"Записей: {cache_stats['entries']} • "
+                   f"{cache_stats['size_bytes'] / 1024 / 1024:.1f} МБ • "
+                   f"доля попаданий {cache_stats['hit_ratio']:.0%}")
+        if st.button("🧹 Очистить кэш"):
+            cache.clear()
+            st.rerun()
+    
+    # Архив исходных ответов API (для повторного разбора без запросов)
+    snapshots = get_snapshots()
+    if snapshots is not None:
+        snapshot_stats = snapshots.stats()
+        st.caption(f"Архив ответов: {snapshot_stats['entries']} ответов по {snapshot_stats['films']} фильмам • "
+                   f"{snapshot_stats['size_bytes'] / 1024 / 1024:.1f} МБ ({snapshot_stats['codec']})")
+    
+    # Переиспользование HTTP-соединений (общий пул процесса)
+    http_stats = connection_stats.snapshot()
+    if http_stats['requests']:
+        st.caption(f"HTTP: запросов {http_stats['requests']}, соединений {http_stats['connections']}, "
+                   f"переиспользовано {http_stats['reuse_ratio']:.0%}, "
+                   f"handshake в среднем {http_stats['avg_handshake_ms']:.0f} мс")
+
+    # Одинаковые одновременные запросы разных сессий (общий реестр процесса)
+    flight_stats = flights.stats()
+    if flight_stats['shared']:
+        st.caption(f"Объединено одинаковых запросов: {flight_stats['shared']} "
+                   f"({flight_stats['dedup_ratio']:.0%} обращений к API)")
+    
+    # Очередь к ограничителю частоты: интерактивные запросы идут без очереди
+    waiting = scheduler.stats()['waiting']
+    paused_jobs = sum(job.running and job.switch.paused() for _, job in batch_jobs().values())
+    if paused_jobs or any(waiting.values()):
+        st.caption(f"Очередь запросов: интерактивных {waiting[INTERACTIVE]}, фоновых {waiting[BATCH]}"
+                   + (f" • прогонов на паузе: {paused_jobs}" if paused_jobs else ""))
 
 # Основной интерфейс
 col1, col2 = st.columns([1, 3])
 
 with col1:
     st.header("🔍 Поиск")
-    film_id = st.text_input("ID фильма/сериала:", placeholder="Например: 326")
+    film_id = st.text_input("ID или название фильма/сериала:", placeholder="Например: 326 или Побег из Шоушенка").strip()
+    
+    if film_id and not film_id.isdigit():
+        # Поиск по названию: локальный индекс, API — только при промахе
+        try:
+            matches = search_titles(film_id, api_key)
+        except ApiLimitError as e:
+            matches = []
+            st.warning(f"Поиск через API недоступен: {e}")
+        if matches:
+            match = st.selectbox("Найденные фильмы:", matches, format_func=lambda m: m.label())
+            film_id = str(match.film_id)
+        else:
+            st.caption("Ничего не найдено")
     
     if st.button("🎯 Получить информацию", type="primary"):
         if not api_key:
             st.error("⚠️ Введите API-ключ в боковой панели!")
         elif not film_id.isdigit():
-            st.error("⚠️ Введите корректный числовой ID!")
+            st.error("⚠️ Введите числовой ID или выберите фильм из найденных!")
         else:
             with st.spinner("Загрузка данных..."):
-                # Получаем основную информацию
-                data, error = get_film_info(film_id, api_key)
+                # Запрашиваем все эндпоинты фильма параллельно
+                try:
+                    film, error = fetch_film(film_id, api_key)
+                except ApiLimitError as e:
+                    # Часть данных не получена из-за лимитов API — неполную карточку не показываем
+                    film, error = None, f'Лимит API: {e}'
                 
-                if error or not data:
-                    st.error(f"❌ {error or 'Нет данных'}")
+                if error:
+                    st.error(f"❌ {error}")
                 else:
-                    # Собираем всю информацию
-                    def safe(val):
-                        return '-' if val is None or val == '' else val
-                    
-                    # Основная информация
-                    film_info = {
-                        'Название (RU)': safe(data.get('nameRu')),
-                        'Оригинальное название': safe(data.get('nameOriginal')),
-                        'Год': safe(data.get('year')),
-                        'Жанры': safe(', '.join([g['genre'] for g in data.get('genres', [])]) if data.get('genres') else '-'),
-                        'Страна': safe(', '.join([c['country'] for c in data.get('countries', []) if c.get('country')])),
-                        'Рейтинг IMDB': safe(data.get('ratingImdb')),
-                        'Рейтинг Кинопоиска': safe(data.get('ratingKinopoisk')),
-                        'Кол-во голосов КП': format_vote_count(data.get('ratingKinopoiskVoteCount')),
-                        'Описание': safe(data.get('description')),
-                        'Продолжительность (мин)': format_duration(data.get('filmLength'))
-                    }
-                    
-                    # Касса
-                    boxoffice = get_film_boxoffice(film_id, api_key)
-                    film_info.update({
-                        'Бюджет': format_money(boxoffice.get('budget', '-')) if boxoffice else '-',
-                        'Касса (мир)': format_money(boxoffice.get('world', '-')) if boxoffice else '-',
-                        'Касса (РФ)': format_money(boxoffice.get('russia', '-')) if boxoffice else '-',
-                        'Касса (США)': format_money(boxoffice.get('usa', '-')) if boxoffice else '-'
-                    })
-                    
-                    # Премьеры
-                    premiere_rf, premiere_world = get_film_premieres(film_id, api_key)
-                    film_info.update({
-                        'Премьера в РФ': safe(premiere_rf),
-                        'Премьера мировая': safe(premiere_world)
-                    })
-                    
-                    # Актеры и съемочная группа
-                    cast = get_film_cast(film_id, api_key)
-                    
-                    st.session_state.film_data = film_info
-                    st.session_state.cast_data = cast
+                    st.session_state.film = film
+                    get_title_index().add_film(film)
                     
                     st.success("✅ Данные успешно загружены!")
 
 with col2:
     st.header("📊 Результаты")
     
-    if st.session_state.film_data:
+    if st.session_state.film:
+        # Строки для отображения строятся из типизированной записи только здесь
+        film = st.session_state.film
+        film_key = (film.film_id, film.fetched_at)
+        film_data = film.display()
+        cast_data = film.cast
+        
         # Основная информация
         st.subheader("🎭 Основная информация")
         
@@ -421,137 +272,101 @@ with col2:
         col_info1, col_info2 = st.columns(2)
         
         with col_info1:
-            st.metric("Название (RU)", st.session_state.film_data.get('Название (RU)', '-'))
-            st.metric("Год", st.session_state.film_data.get('Год', '-'))
-            st.metric("Рейтинг IMDB", st.session_state.film_data.get('Рейтинг IMDB', '-'))
-            st.metric("Премьера в РФ", st.session_state.film_data.get('Премьера в РФ', '-'))
-            st.metric("Премьера мировая", st.session_state.film_data.get('Премьера мировая', '-'))
+            st.metric("Название (RU)", film_data.get('Название (RU)', '-'))
+            st.metric("Год", film_data.get('Год', '-'))
+            st.metric("Рейтинг IMDB", film_data.get('Рейтинг IMDB', '-'))
+            st.metric("Премьера в РФ", film_data.get('Премьера в РФ', '-'))
+            st.metric("Премьера мировая", film_data.get('Премьера мировая', '-'))
         
         with col_info2:
-            st.metric("Оригинальное название", st.session_state.film_data.get('Оригинальное название', '-'))
-            st.metric("Страна", st.session_state.film_data.get('Страна', '-'))
-            st.metric("Рейтинг Кинопоиска", st.session_state.film_data.get('Рейтинг Кинопоиска', '-'))
-            st.metric("Кол-во голосов КП", st.session_state.film_data.get('Кол-во голосов КП', '-'))
-            st.metric("Продолжительность (мин)", st.session_state.film_data.get('Продолжительность (мин)', '-'))
+            st.metric("Оригинальное название", film_data.get('Оригинальное название', '-'))
+            st.metric("Страна", film_data.get('Страна', '-'))
+            st.metric("Рейтинг Кинопоиска", film_data.get('Рейтинг Кинопоиска', '-'))
+            st.metric("Кол-во голосов КП", film_data.get('Кол-во голосов КП', '-'))
+            st.metric("Продолжительность (мин)", film_data.get('Продолжительность (мин)', '-'))
         
         # Жанры отдельно на всю ширину
-        st.metric("Жанры", st.session_state.film_data.get('Жанры', '-'))
+        st.metric("Жанры", film_data.get('Жанры', '-'))
         
         # Описание
         st.subheader("📝 Описание")
-        st.write(st.session_state.film_data.get('Описание', '-'))
+        st.write(film_data.get('Описание', '-'))
         
         # Финансы
         st.subheader("💰 Финансы")
         col_money1, col_money2 = st.columns(2)
         
         with col_money1:
-            st.metric("Бюджет", st.session_state.film_data.get('Бюджет', '-'))
-            st.metric("Касса (мир)", st.session_state.film_data.get('Касса (мир)', '-'))
+            st.metric("Бюджет", film_data.get('Бюджет', '-'))
+            st.metric("Касса (мир)", film_data.get('Касса (мир)', '-'))
         
         with col_money2:
-            st.metric("Касса (РФ)", st.session_state.film_data.get('Касса (РФ)', '-'))
-            st.metric("Касса (США)", st.session_state.film_data.get('Касса (США)', '-'))
+            st.metric("Касса (РФ)", film_data.get('Касса (РФ)', '-'))
+            st.metric("Касса (США)", film_data.get('Касса (США)', '-'))
         
         # Актеры и съемочная группа
         st.subheader("🎬 Актеры и съемочная группа")
         
-        if st.session_state.cast_data:
-            # Создаем DataFrame для отображения
-            cast_display = []
-            for line in st.session_state.cast_data:
-                if ';' in line:
-                    name, staff_id = line.split(';', 1)
-                    cast_display.append({'Имя': name.strip(), 'ID': staff_id.strip()})
-                else:
-                    cast_display.append({'Имя': line.strip(), 'ID': ''})
-            
-            if cast_display:
-                df_cast = pd.DataFrame(cast_display)
-                st.dataframe(df_cast, use_container_width=True)
-            else:
-                st.write("Нет данных о съемочной группе")
+        if cast_data:
+            st.dataframe(cast_table(film_key, film), use_container_width=True)
         else:
             st.write("Нет данных о съемочной группе")
         
         # Кнопка экспорта
         st.subheader("📥 Экспорт данных")
         
-        col_export1, col_export2 = st.columns(2)
+        col_export1, col_export2, col_export3 = st.columns([1, 2, 1])
+        
+        # Файлы собираются только при нажатии на кнопку скачивания (в отдельном
+        # потоке) и кэшируются по фильму; нажатие не перезапускает страницу
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        
+        def lazy_file(kind):
+            return lambda: film_file(kind, film_key, film)
         
         with col_export1:
-            if st.button("📊 Скачать Excel файл"):
-                try:
-                    with st.spinner("Создание Excel файла..."):
-                        excel_file = create_excel_file(st.session_state.film_data, st.session_state.cast_data)
-                        
-                        if excel_file:
-                            filename = f"film_{film_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-                            
-                            st.download_button(
-                                label="⬇️ Скачать Excel",
-                                data=excel_file,
-                                file_name=filename,
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                key="excel_download"
-                            )
-                            st.success("Excel файл готов к скачиванию!")
-                        else:
-                            st.error("Не удалось создать Excel файл")
-                            
-                except Exception as e:
-                    st.error(f"Ошибка при создании Excel файла: {e}")
-                    st.info("Попробуйте скачать CSV файл")
+            st.download_button(
+                label="📊 Скачать Excel файл",
+                data=lazy_file('excel'),
+                file_name=f"film_{film.film_id}_{timestamp}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                on_click="ignore",
+                key="excel_download"
+            )
         
         with col_export2:
             # Создаем два варианта CSV
             csv_col1, csv_col2 = st.columns(2)
             
             with csv_col1:
-                if st.button("📄 CSV (для Excel)"):
-                    try:
-                        with st.spinner("Создание CSV файла..."):
-                            csv_file = create_improved_csv_file(st.session_state.film_data, st.session_state.cast_data)
-                            
-                            if csv_file:
-                                filename = f"film_{film_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-                                
-                                st.download_button(
-                                    label="⬇️ Скачать CSV",
-                                    data=csv_file,
-                                    file_name=filename,
-                                    mime="text/csv",
-                                    key="csv_download_1"
-                                )
-                                st.success("CSV файл готов к скачиванию!")
-                            else:
-                                st.error("Не удалось создать CSV файл")
-                                
-                    except Exception as e:
-                        st.error(f"Ошибка при создании CSV файла: {e}")
+                st.download_button(
+                    label="📄 CSV (для Excel)",
+                    data=lazy_file('csv'),
+                    file_name=f"film_{film.film_id}_{timestamp}.csv",
+                    mime="text/csv",
+                    on_click="ignore",
+                    key="csv_download_1"
+                )
             
             with csv_col2:
-                if st.button("📋 CSV (простой)"):
-                    try:
-                        with st.spinner("Создание простого CSV файла..."):
-                            csv_file = create_simple_csv_file(st.session_state.film_data, st.session_state.cast_data)
-                            
-                            if csv_file:
-                                filename = f"film_{film_id}_simple_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-                                
-                                st.download_button(
-                                    label="⬇️ Скачать CSV",
-                                    data=csv_file,
-                                    file_name=filename,
-                                    mime="text/csv",
-                                    key="csv_download_2"
-                                )
-                                st.success("Простой CSV файл готов к скачиванию!")
-                            else:
-                                st.error("Не удалось создать простой CSV файл")
-                                
-                    except Exception as e:
-                        st.error(f"Ошибка при создании простого CSV файла: {e}")
+                st.download_button(
+                    label="📋 CSV (простой)",
+                    data=lazy_file('simple_csv'),
+                    file_name=f"film_{film.film_id}_simple_{timestamp}.csv",
+                    mime="text/csv",
+                    on_click="ignore",
+                    key="csv_download_2"
+                )
+        
+        with col_export3:
+            st.download_button(
+                label="🧮 Parquet (типизированный)",
+                data=lazy_file('parquet'),
+                file_name=f"film_{film.film_id}_{timestamp}.parquet",
+                mime="application/vnd.apache.parquet",
+                on_click="ignore",
+                key="parquet_download"
+            )
         
         # Дополнительные советы по экспорту
         with st.expander("💡 Советы по экспорту"):
@@ -565,6 +380,7 @@ with col2:
             - **Excel**: Удобен для просмотра и редактирования
             - **CSV для Excel**: Совместим с Excel, использует точку с запятой
             - **CSV простой**: Универсальный формат для любых программ
+            - **Parquet**: Для аналитики — числа, валюты и даты сохраняются с типами
             
             **Для установки недостающих библиотек:**
             ```
@@ -575,6 +391,227 @@ with col2:
     else:
         st.info("👈 Введите ID фильма и нажмите 'Получить информацию'")
 
+# Пакетная обработка
+st.markdown("---")
+st.header("📦 Пакетная обработка")
+
+with st.expander("Загрузить список ID из файла"):
+    ids_file = st.file_uploader("Файл со списком ID (CSV/TXT):", type=["csv", "txt"])
+    batch_workers = st.slider("Число потоков:", min_value=1, max_value=32, value=8)
+    batch_to_dataset = st.checkbox(
+        "Дописывать результаты в набор данных Parquet",
+        help=f"Фильмы будут добавлены в {os.path.join(BATCH_OUTPUT_DIR, 'dataset')} (партиции по дате загрузки)"
+    )
+    batch_refresh = st.checkbox(
+        "Инкрементальное обновление",
+        help="Заново запрашиваются только рейтинги и кассовые сборы (остальное — раз в "
+             f"{DEFAULT_MAX_AGE // DAY} дней); в отдельный файл пишутся только новые и изменившиеся фильмы"
+    )
+    
+    if ids_file is not None:
+        batch_ids = read_film_ids(ids_file.getvalue())
+        st.write(f"Найдено ID: {len(batch_ids)}")
+        
+        # Имя выходного файла зависит от имени списка, поэтому повторный
+        # запуск с тем же файлом продолжит работу с чекпоинта
+        os.makedirs(BATCH_OUTPUT_DIR, exist_ok=True)
+        batch_output = os.path.join(BATCH_OUTPUT_DIR, os.path.splitext(ids_file.name)[0] + '.jsonl')
+        batch_delta = os.path.join(BATCH_OUTPUT_DIR, os.path.splitext(ids_file.name)[0] + '_delta.jsonl')
+        
+        # Обработка идет в фоновом потоке: страница не блокируется, а паузу
+        # можно поставить и снять, не прерывая прогон
+        jobs = batch_jobs()
+        batch_job = jobs.get(batch_output)
+        if st.button("🚀 Запустить пакетную обработку"):
+            if not api_key:
+                st.error("⚠️ Введите API-ключ в боковой панели!")
+            elif not batch_ids:
+                st.error("⚠️ В файле не найдено ни одного ID!")
+            elif batch_job is not None and batch_job[1].running:
+                st.warning("Обработка этого файла уже идет")
+            elif batch_refresh:
+                def refresh_task(progress, switch):
+                    return run_refresh(batch_ids, api_key, os.path.join(BATCH_OUTPUT_DIR, 'refresh.sqlite3'),
+                                       batch_delta, workers=batch_workers, progress=progress, wait_for_quota=False,
+                                       switch=switch)
+                
+                batch_job = jobs[batch_output] = ('refresh', BatchJob(refresh_task))
+            else:
+                dataset = os.path.join(BATCH_OUTPUT_DIR, 'dataset') if batch_to_dataset else None
+                
+                # Ждать сброса квоты в фоновом потоке страницы не нужно, поэтому
+                # при исчерпании квоты прогон останавливается, а чекпоинт сохраняется
+                def batch_task(progress, switch):
+                    stats = run_batch(batch_ids, api_key, batch_output, workers=batch_workers, progress=progress,
+                                      wait_for_quota=False, dataset=dataset, switch=switch)
+                    remember_films(iter_films(batch_output))
+                    return stats
+                
+                batch_job = jobs[batch_output] = ('batch', BatchJob(batch_task))
+        
+        if batch_job is not None:
+            batch_mode, job = batch_job
+            if job.running:
+                show_batch_progress(job)
+            else:
+                show_batch_result(batch_mode, job)
+        
+        if os.path.exists(batch_delta):
+            st.download_button(
+                label="⬇️ Скачать изменения (JSON Lines)",
+                data=file_data(batch_delta),
+                file_name=os.path.basename(batch_delta),
+                mime="application/x-ndjson",
+                on_click="ignore",
+                key="batch_delta_download"
+            )
+        
+        if os.path.exists(batch_output):
+            st.download_button(
+                label="⬇️ Скачать результаты (JSON Lines)",
+                data=file_data(batch_output),
+                file_name=os.path.basename(batch_output),
+                mime="application/x-ndjson",
+                on_click="ignore",
+                key="batch_download"
+            )
+            
+            # Экспорт всех фильмов прогона: файл результатов делится на участки,
+            # которые обрабатываются параллельно в отдельных процессах
+            batch_prefix = os.path.splitext(batch_output)[0]
+            col_batch_xlsx, col_batch_csv, col_batch_parquet, col_batch_persons = st.columns(4)
+            
+            with col_batch_xlsx:
+                if st.button("📊 Собрать Excel по всем фильмам"):
+                    try:
+                        with st.spinner("Создание Excel файлов..."):
+                            count, xlsx_paths = export_xlsx_parallel(
+                                batch_output, batch_prefix, progress=export_progress("Части Excel"))
+                        for i, xlsx_path in enumerate(xlsx_paths):
+                            st.download_button(
+                                label=f"⬇️ Скачать {os.path.basename(xlsx_path)} (всего {count} фильмов)",
+                                data=file_data(xlsx_path),
+                                file_name=os.path.basename(xlsx_path),
+                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                on_click="ignore",
+                                key=f"batch_excel_download_{i}"
+                            )
+                    except Exception as e:
+                        st.error(f"Ошибка при создании Excel файла: {e}")
+            
+            with col_batch_csv:
+                if st.button("📄 Собрать CSV по всем фильмам"):
+                    try:
+                        with st.spinner("Создание CSV файлов..."):
+                            main_path, cast_path = csv_paths(batch_prefix)
+                            count = export_csv_parallel(batch_output, main_path, cast_path,
+                                                        progress=export_progress("Части CSV"))
+                        for path, label, key in ((main_path, "фильмы", "batch_csv_main"),
+                                                 (cast_path, "состав", "batch_csv_cast")):
+                            st.download_button(
+                                label=f"⬇️ Скачать CSV: {label} ({count} фильмов)",
+                                data=file_data(path),
+                                file_name=os.path.basename(path),
+                                mime="text/csv",
+                                on_click="ignore",
+                                key=key
+                            )
+                    except Exception as e:
+                        st.error(f"Ошибка при создании CSV файла: {e}")
+            
+            with col_batch_parquet:
+                if st.button("🧮 Собрать Parquet по всем фильмам"):
+                    try:
+                        with st.spinner("Создание Parquet файлов..."):
+                            films_path, cast_path = parquet_paths(batch_prefix)
+                            count = export_parquet_parallel(batch_output, films_path, cast_path,
+                                                            progress=export_progress("Части Parquet"))
+                        for path, label, key in ((films_path, "фильмы", "batch_parquet_films"),
+                                                 (cast_path, "состав", "batch_parquet_cast")):
+                            st.download_button(
+                                label=f"⬇️ Скачать Parquet: {label} ({count} фильмов)",
+                                data=file_data(path),
+                                file_name=os.path.basename(path),
+                                mime="application/vnd.apache.parquet",
+                                on_click="ignore",
+                                key=key
+                            )
+                    except Exception as e:
+                        st.error(f"Ошибка при создании Parquet файла: {e}")
+            
+            with col_batch_persons:
+                if st.button("👥 Собрать таблицу персон"):
+                    try:
+                        with st.spinner("Построение индекса персон..."):
+                            index = PersonIndex.from_films(iter_films(batch_output))
+                            persons_path, credits_path = persons_paths(batch_prefix, 'csv')
+                            count = export_persons_csv(index, persons_path, credits_path)
+                        for path, label, key in ((persons_path, "персоны", "batch_persons"),
+                                                 (credits_path, "участие в фильмах", "batch_credits")):
+                            st.download_button(
+                                label=f"⬇️ Скачать CSV: {label} ({count} персон)",
+                                data=file_data(path),
+                                file_name=os.path.basename(path),
+                                mime="text/csv",
+                                on_click="ignore",
+                                key=key
+                            )
+                    except Exception as e:
+                        st.error(f"Ошибка при создании таблицы персон: {e}")
+
+# Панель производительности строится в конце страницы, чтобы учесть время
+# текущего запуска
+metrics.observe('kinopoisk_streamlit_rerun_seconds', time.perf_counter() - page_started)
+
+with st.sidebar:
+    if st.checkbox("⏱️ Производительность", help="Время запросов к API, разбора ответов, экспорта и "
+                                                  "выполнения страницы (по всем сессиям процесса)"):
+        st.subheader("⏱️ Производительность")
+        
+        def metric_row(row):
+            # Размеры — в КБ, время — в мс
+            scale, unit = (1 / 1024, 'КБ') if row['metric'].endswith('_bytes') else (1000, 'мс')
+            return {
+                'Метрика': row['metric'].removeprefix('kinopoisk_'),
+                'Метки': ', '.join(f"{k}={v}" for k, v in row['labels'].items()),
+                'Вызовов': row['count'],
+                'Среднее': f"{row['avg'] * scale:.1f} {unit}",
+                'p95': f"{row['p95'] * scale:.1f} {unit}",
+                'Макс.': f"{row['max'] * scale:.1f} {unit}",
+            }
+        
+        summary = metrics.summary()
+        if summary:
+            st.dataframe([metric_row(row) for row in summary], use_container_width=True, hide_index=True)
+        counters = metrics.counters()
+        if counters:
+            st.dataframe([{'Счетчик': name.removeprefix('kinopoisk_'),
+                           'Метки': ', '.join(f"{k}={v}" for k, v in labels.items()),
+                           'Значение': value} for name, labels, value in counters],
+                         use_container_width=True, hide_index=True)
+        
+        # Разбивка времени по последнему загруженному фильму
+        if st.session_state.film:
+            film_events = [e for e in metrics.events(st.session_state.film.film_id)
+                           if not e['metric'].endswith('_bytes')]
+            if film_events:
+                st.caption(f"Фильм {st.session_state.film.film_id}: последние замеры")
+                st.dataframe([{
+                    'Этап': e['metric'].removeprefix('kinopoisk_').removesuffix('_seconds'),
+                    'Метки': ', '.join(f"{k}={v}" for k, v in e['labels'].items()),
+                    'мс': round(e['value'] * 1000, 1),
+                } for e in film_events[-40:]], use_container_width=True, hide_index=True)
+        
+        col_prom, col_jsonl = st.columns(2)
+        # Выгрузки формируются только при нажатии на кнопку
+        col_prom.download_button("Prometheus", data=metrics.to_prometheus, file_name="kinopoisk_metrics.prom",
+                                 mime="text/plain", on_click="ignore", key="metrics_prometheus")
+        col_jsonl.download_button("JSON Lines", data=metrics.to_json_lines, file_name="kinopoisk_metrics.jsonl",
+                                  mime="application/x-ndjson", on_click="ignore", key="metrics_jsonl")
+        if st.button("🧹 Сбросить метрики"):
+            metrics.reset()
+            st.rerun()
+
 # Футер
 st.markdown("---")
 st.markdown("**Создано с помощью Streamlit** • [Кинопоиск API](https://kinopoiskapiunofficial.tech/)")